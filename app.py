@@ -7,42 +7,47 @@ Converts emails from IMAP to RSS feed for FreshRSS integration
 import imaplib
 import email
 import time
-import xml.etree.ElementTree as ET
+import signal
+import random
+import threading
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 import os
 import logging
 from email.utils import parsedate_to_datetime
 import html
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 import hashlib
 import json
 import urllib.parse
+import urllib.request
 import base64
+import gzip
+import zlib
+import envfile
+import feedgen
+import metrics
+import refresh
+import cycle_stats
+import profiling
+import scheduler
+import pipeline
+from store import ItemStore, FeedQuery
+from imap_parser import parse_fetch_response, parse_bodystructure, decode_transfer_encoding, estimate_decoded_size, ParseError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def load_env_file():
-    """Load environment variables from .env file"""
-    env_file = '/app/.env'
-    if not os.path.exists(env_file):
-        env_file = './.env'
-    if os.path.exists(env_file):
-        logger.info(f"Loading environment variables from {env_file}")
-        with open(env_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    os.environ[key] = value
-                    logger.debug(f"Set {key}={value[:20]}...")
-    else:
-        logger.warning("No .env file found")
+# Load .env file before doing anything else; envfile keeps what it set to tell what a reload changes
+envfile.load()
+
+# Seconds between checks of the .env file for changes while the daemon waits
+ENV_CHECK_INTERVAL = envfile.CHECK_INTERVAL
 
-# Load .env file before doing anything else
-load_env_file()
+# Folders listed by the server, kept in the data directory for MAILBOXES patterns
+FOLDER_LIST_FILE = 'mailbox_list.json'
 
 def decode_imap_utf7(s):
     """Decode IMAP modified UTF-7 string to normal UTF-8"""
@@ -71,8 +76,32 @@ def decode_imap_utf7(s):
         logger.debug(f"Failed to decode IMAP UTF-7: {s} -> {e}")
         return s  # Return original string if decode fails
 
+def mailbox_pattern(pattern: str, delimiter: str) -> re.Pattern:
+    """Compile a MAILBOXES pattern: * matches anything, % anything but the hierarchy delimiter"""
+    regex = ''.join('.*' if char == '*' else f"[^{re.escape(delimiter)}]*" if char == '%' else re.escape(char)
+                    for char in pattern)
+    return re.compile(regex)
+
+def feed_fingerprint(content: str) -> str:
+    """Hash feed content, ignoring lastBuildDate which changes on every run"""
+    stable = re.sub(r'<lastBuildDate>[^<]*</lastBuildDate>', '', content)
+    return hashlib.sha256(stable.encode('utf-8')).hexdigest()
+
+def write_file_atomic(file_path: str, data: bytes):
+    """Write bytes to a temporary file and rename it into place"""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
 class ImapToRss:
     
+    # Precompressed sidecar files written next to each feed (encoding -> suffix)
+    COMPRESSION_SUFFIXES = {
+        'gzip': '.gz',
+        'deflate': '.deflate'
+    }
+    
     # Email provider configurations
     PROVIDERS = {
         'gmail': {
@@ -108,6 +137,55 @@ class ImapToRss:
     }
     
     def __init__(self):
+        # Folders of the last LIST: decoded -> encoded names, hierarchy delimiter and
+        # folders that cannot be selected; MAILBOXES patterns expand against them
+        self.mailbox_mapping = {}
+        self.hierarchy_delimiter = '/'
+        self.unselectable = set()
+        
+        self.load_settings()
+        
+        # Content fingerprints of feeds already on disk (file path -> hash)
+        self.feed_fingerprints = {}
+        
+        # Feed index contents last written, ignoring its timestamp
+        self.feeds_index_key = None
+        
+        # Set by the HTTP server when both run in one process (RUN_MODE=combined)
+        self.feed_published = None  # callable(file name, {encoding: bytes})
+        self.local_hub = None
+        
+        # Timing spans of the cycle in progress, appended to data/cycle_stats.jsonl when it ends
+        self.trace = None
+        
+        # Use local data dir if not running in Docker
+        if os.path.exists('/app/data'):
+            self.data_dir = '/app/data'
+        else:
+            self.data_dir = './data'
+        
+        # Store of every processed email, backing the feed archives
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.store = ItemStore(os.path.join(self.data_dir, 'items.db'))
+        
+        # cProfile and tracemalloc captures of selected cycles, written to data/profiles
+        self.profiler = profiling.CycleProfiler(self.data_dir, keep=self.profile_keep)
+        
+        # Patterns expand against the folders of the previous run until the first LIST
+        self.load_folder_list()
+        self.mailboxes = self.expand_mailboxes()
+        
+        # Per-mailbox poll schedule used when ADAPTIVE_POLLING is on, and IMAP commands issued so far
+        self.scheduler = scheduler.AdaptiveScheduler(self.poll_min_interval, self.poll_max_interval,
+                                                     self.imap_command_budget)
+        self.imap_commands = 0
+        
+        # Deadline (time.monotonic()) of the cycle in progress, enforced by the watchdog thread in the daemon
+        self.cycle_deadline = None
+        self.watchdog = scheduler.CycleWatchdog()
+    
+    def load_settings(self):
+        """Read the settings that come from the environment; called again when .env changes"""
         # Email provider setup
         self.email_provider = os.getenv('EMAIL_PROVIDER', 'gmail').lower()
         self.setup_provider_config()
@@ -118,24 +196,100 @@ class ImapToRss:
         self.feed_description = os.getenv('FEED_DESCRIPTION', 'RSS feed generated from IMAP emails')
         self.max_emails = int(os.getenv('MAX_EMAILS', '50'))
         
-        # Support for multiple mailboxes
+        if not self.email_user or not self.email_pass:
+            raise ValueError("EMAIL_USER and EMAIL_PASS environment variables are required")
+        
+        # Support for multiple mailboxes; entries with * or % are patterns, e.g. Newsletters/*
         mailboxes_str = os.getenv('MAILBOXES', 'INBOX')
-        self.mailboxes = [mb.strip() for mb in mailboxes_str.split(',') if mb.strip()]
+        self.mailbox_patterns = [mb.strip() for mb in mailboxes_str.split(',') if mb.strip()]
+        self.mailboxes = self.expand_mailboxes()
+        
+        # IMAP sessions syncing mailboxes in parallel
+        self.fetch_connections = max(1, int(os.getenv('FETCH_CONNECTIONS', '4')))
+        
+        # Worker threads of the other sync pipeline stages, and the items queued in front of each stage
+        self.parse_workers = max(1, int(os.getenv('PARSE_WORKERS', '2')))
+        self.sanitize_workers = max(1, int(os.getenv('SANITIZE_WORKERS', '2')))
+        self.render_workers = max(1, int(os.getenv('RENDER_WORKERS', '2')))
+        self.publish_workers = max(1, int(os.getenv('PUBLISH_WORKERS', '2')))
+        self.pipeline_queue_size = max(1, int(os.getenv('PIPELINE_QUEUE_SIZE', str(pipeline.QUEUE_SIZE))))
         
         # Feed generation mode
         self.feed_mode = os.getenv('FEED_MODE', 'combined')  # 'combined' or 'separate'
         
-        # Mailbox name mapping (decoded -> encoded)
-        self.mailbox_mapping = {}
+        # Precompressed variants written alongside each feed ('gzip', 'deflate')
+        compression_str = os.getenv('FEED_COMPRESSION', 'gzip')
+        self.feed_compression = [enc.strip().lower() for enc in compression_str.split(',')
+                                 if enc.strip().lower() in self.COMPRESSION_SUFFIXES]
         
-        # Use local data dir if not running in Docker
-        if os.path.exists('/app/data'):
-            self.data_dir = '/app/data'
-        else:
-            self.data_dir = './data'
+        # Daemon schedule; refreshes never start a sync sooner than refresh_min_interval after the previous one
+        self.check_interval = int(os.getenv('CHECK_INTERVAL', '300'))  # 5 minutes default
+        self.refresh_min_interval = int(os.getenv('REFRESH_MIN_INTERVAL', '30'))
         
-        if not self.email_user or not self.email_pass:
-            raise ValueError("EMAIL_USER and EMAIL_PASS environment variables are required")
+        # Adaptive polling replaces CHECK_INTERVAL with per-mailbox intervals following each mailbox's arrival rate
+        self.adaptive_polling = os.getenv('ADAPTIVE_POLLING', 'false').lower() == 'true'
+        self.poll_min_interval = int(os.getenv('POLL_MIN_INTERVAL', '60'))
+        self.poll_max_interval = int(os.getenv('POLL_MAX_INTERVAL', '3600'))
+        self.imap_command_budget = int(os.getenv('IMAP_COMMAND_BUDGET', '1000'))  # per hour, 0 for no limit
+        
+        # Scheduled starts are delayed by up to this fraction of the interval
+        self.schedule_jitter = float(os.getenv('SCHEDULE_JITTER', '0.1'))
+        # Seconds a cycle may spend syncing; mailboxes left when it runs out wait for the next cycle
+        self.cycle_timeout = int(os.getenv('CYCLE_TIMEOUT', '600'))
+        
+        self.cycle_stats_max_bytes = int(os.getenv('CYCLE_STATS_MAX_KB', '1024')) * 1024
+        self.profile_keep = int(os.getenv('PROFILE_KEEP', '10'))
+        
+        # Public URL used for links inside the generated feeds
+        self.base_url = os.getenv('BASE_URL', 'http://localhost:8888').rstrip('/')
+        
+        # RFC 5005 archive pages; a page never holds more items than the current feed
+        self.archive_feeds = os.getenv('ARCHIVE_FEEDS', 'true').lower() == 'true'
+        self.archive_page_size = min(int(os.getenv('ARCHIVE_PAGE_SIZE', str(self.max_emails))), self.max_emails)
+        
+        # WebSub: advertise the hub in feeds and ping it when a feed changes
+        self.websub_hub = None
+        if os.getenv('WEBSUB_ENABLED', 'false').lower() == 'true':
+            self.websub_hub = os.getenv('WEBSUB_HUB_URL', f"{self.base_url}/hub")
+        # The server runs next to the converter, so publish pings go to it directly
+        self.websub_publish_url = os.getenv('WEBSUB_PUBLISH_URL', f"http://localhost:{os.getenv('HTTP_PORT', '8888')}/hub")
+        self.websub_publish_token = os.getenv('WEBSUB_PUBLISH_TOKEN', '')
+    
+    def connection_settings(self) -> tuple:
+        """Settings that need a new IMAP session when they change"""
+        return (self.imap_server, self.imap_port, self.use_ssl, self.email_user, self.email_pass)
+    
+    def reload_config(self) -> bool:
+        """Re-read .env and apply what changed, keeping sync state and caches; True if anything changed"""
+        previous_mailboxes = self.mailboxes
+        previous_connection = self.connection_settings()
+        try:
+            changed = envfile.reload(validate=self.load_settings)
+        except OSError as e:
+            logger.error(f"Failed to read {envfile.find_env_file()}: {e}")
+            return False
+        except ValueError as e:
+            logger.error(f"Invalid configuration in {envfile.find_env_file()}, keeping the current settings: {e}")
+            self.load_settings()
+            return False
+        if not changed:
+            return False
+        self.profiler.keep = self.profile_keep
+        logger.info(f"Configuration reloaded, changed: {', '.join(changed)}")
+        
+        if self.connection_settings() != previous_connection:
+            # Encoded mailbox names belong to the old server or account
+            self.mailbox_mapping = {}
+            self.unselectable = set()
+            self.mailboxes = self.expand_mailboxes()
+            logger.info(f"IMAP connection settings changed, next sync connects to {self.imap_server}:{self.imap_port}")
+        added = [mb for mb in self.mailboxes if mb not in previous_mailboxes]
+        removed = [mb for mb in previous_mailboxes if mb not in self.mailboxes]
+        if added:
+            logger.info(f"Mailboxes added: {', '.join(added)}")
+        if removed:
+            logger.info(f"Mailboxes removed: {', '.join(removed)}")
+        return True
     
     def setup_provider_config(self):
         """Setup IMAP configuration based on email provider"""
@@ -145,14 +299,14 @@ class ImapToRss:
             # Use provider defaults, but allow override via environment
             self.imap_server = os.getenv('IMAP_SERVER', provider_config['server'])
             self.imap_port = int(os.getenv('IMAP_PORT', str(provider_config['port'])))
-            self.use_ssl = provider_config['ssl']
+            self.use_ssl = os.getenv('IMAP_SSL', str(provider_config['ssl'])).lower() == 'true'
             
             logger.info(f"Using {provider_config['name']} configuration: {self.imap_server}:{self.imap_port}")
         else:
             # Fallback to manual configuration
             self.imap_server = os.getenv('IMAP_SERVER', 'imap.gmail.com')
             self.imap_port = int(os.getenv('IMAP_PORT', '993'))
-            self.use_ssl = True
+            self.use_ssl = os.getenv('IMAP_SSL', 'true').lower() == 'true'
             logger.warning(f"Unknown provider '{self.email_provider}', using manual configuration")
     
     def connect_imap(self) -> imaplib.IMAP4_SSL:
@@ -160,7 +314,10 @@ class ImapToRss:
         try:
             logger.info(f"Connecting to {self.imap_server}:{self.imap_port}")
             # Create connection with shorter timeout for faster response
-            mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=10)
+            if self.use_ssl:
+                mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port, timeout=10)
+            else:
+                mail = imaplib.IMAP4(self.imap_server, self.imap_port, timeout=10)
             mail.login(self.email_user, self.email_pass)
             # Set shorter timeout for operations
             mail.sock.settimeout(30)
@@ -179,7 +336,10 @@ class ImapToRss:
                 return ['INBOX']
             
             mailboxes = []
-            self.mailbox_mapping = {}  # Store mapping of decoded -> encoded names
+            previous = (self.mailbox_mapping, self.unselectable)
+            # Built aside and swapped in whole, as attachment downloads may read them concurrently
+            mailbox_mapping = {}  # Store mapping of decoded -> encoded names
+            unselectable = set()
             
             for item in mailbox_list:
                 # Parse mailbox name from IMAP response
@@ -195,103 +355,507 @@ class ImapToRss:
                     decoded_name = decode_imap_utf7(encoded_name)
                     mailboxes.append(decoded_name)
                     # Store mapping for later use
-                    self.mailbox_mapping[decoded_name] = encoded_name
+                    mailbox_mapping[decoded_name] = encoded_name
+                    if len(parts) >= 5 and len(parts[1]) == 1:
+                        self.hierarchy_delimiter = parts[1]
+                    if '\\noselect' in parts[0].lower():
+                        unselectable.add(decoded_name)
             
+            self.mailbox_mapping, self.unselectable = mailbox_mapping, unselectable
             logger.info(f"Available mailboxes: {mailboxes}")
+            if (self.mailbox_mapping, self.unselectable) != previous:
+                self.save_folder_list()
+                self.update_mailboxes()
             return mailboxes
             
         except Exception as e:
             logger.error(f"Failed to get mailboxes: {e}")
             return ['INBOX']
     
-    def fetch_emails_from_mailboxes(self, mail: imaplib.IMAP4_SSL) -> Dict[str, List[Dict[str, Any]]]:
-        """Fetch emails from all configured mailboxes"""
-        all_emails = {}
+    def has_mailbox_patterns(self) -> bool:
+        """Whether MAILBOXES contains * or % patterns"""
+        return any('*' in entry or '%' in entry for entry in self.mailbox_patterns)
+    
+    def expand_mailboxes(self) -> List[str]:
+        """Configured mailboxes, with patterns replaced by the matching folders of the last LIST"""
+        mailboxes = []
+        for entry in self.mailbox_patterns:
+            if '*' in entry or '%' in entry:
+                pattern = mailbox_pattern(entry, self.hierarchy_delimiter)
+                matches = sorted(name for name in self.mailbox_mapping
+                                 if name not in self.unselectable and pattern.fullmatch(name))
+            else:
+                matches = [entry]
+            mailboxes.extend(name for name in matches if name not in mailboxes)
+        return mailboxes
+    
+    def update_mailboxes(self):
+        """Re-expand the patterns after the folder list changed"""
+        expanded = self.expand_mailboxes()
+        added = [mb for mb in expanded if mb not in self.mailboxes]
+        removed = [mb for mb in self.mailboxes if mb not in expanded]
+        if added:
+            logger.info(f"Mailboxes added by a MAILBOXES pattern: {', '.join(added)}")
+        if removed:
+            logger.info(f"Mailboxes no longer on the server removed: {', '.join(removed)}")
+        self.mailboxes = expanded
+    
+    def load_folder_list(self):
+        """Folders listed by the previous run"""
+        folder_list = refresh.read_json(os.path.join(self.data_dir, FOLDER_LIST_FILE))
+        if folder_list:
+            self.mailbox_mapping = folder_list['mailboxes']
+            self.hierarchy_delimiter = folder_list['delimiter']
+            self.unselectable = set(folder_list['unselectable'])
+    
+    def save_folder_list(self):
+        """Keep the folder list for pattern expansion at the next start"""
+        try:
+            refresh.write_json(os.path.join(self.data_dir, FOLDER_LIST_FILE), {
+                'mailboxes': self.mailbox_mapping,
+                'delimiter': self.hierarchy_delimiter,
+                'unselectable': sorted(self.unselectable)
+            })
+        except OSError as e:
+            logger.error(f"Failed to save folder list: {e}")
+    
+    def select_mailbox(self, mail: imaplib.IMAP4_SSL, mailbox: str) -> Optional[int]:
+        """Select a mailbox by its decoded name and return its UIDVALIDITY"""
+        # Get the encoded name for IMAP commands
+        encoded_mailbox = self.mailbox_mapping.get(mailbox, mailbox)
+        # Properly encode mailbox name for IMAP - use UTF-7 encoding
+        try:
+            quoted_mailbox = f'"{encoded_mailbox}"'
+            status, _ = mail.select(quoted_mailbox)
+        except UnicodeEncodeError:
+            # Fallback: try encoding to UTF-7 (IMAP standard)
+            utf7_mailbox = encoded_mailbox.encode('utf-7').decode('ascii')
+            quoted_mailbox = f'"{utf7_mailbox}"'
+            status, _ = mail.select(quoted_mailbox)
         
-        for mailbox in self.mailboxes:
+        if status != 'OK':
+            raise Exception(f"Failed to select mailbox {mailbox}")
+        
+        return self.untagged_number(mail, 'UIDVALIDITY')
+    
+    def untagged_number(self, mail: imaplib.IMAP4_SSL, name: str) -> Optional[int]:
+        """Read a numeric untagged response, such as UIDNEXT, left by the last command"""
+        _, data = mail.response(name)
+        try:
+            return int(data[-1])
+        except (TypeError, ValueError, IndexError):
+            return None
+    
+    def mailbox_status(self, mail: imaplib.IMAP4_SSL, mailbox: str) -> Optional[Dict[str, int]]:
+        """MESSAGES, UIDNEXT and UIDVALIDITY of a mailbox, without selecting it"""
+        encoded_mailbox = self.mailbox_mapping.get(mailbox, mailbox)
+        items = '(MESSAGES UIDNEXT UIDVALIDITY)'
+        try:
+            status, data = mail.status(f'"{encoded_mailbox}"', items)
+        except UnicodeEncodeError:
+            utf7_mailbox = encoded_mailbox.encode('utf-7').decode('ascii')
+            status, data = mail.status(f'"{utf7_mailbox}"', items)
+        if status != 'OK' or not data or data[-1] is None:
+            return None
+        response = data[-1].decode('utf-8', errors='replace') if isinstance(data[-1], bytes) else str(data[-1])
+        return {name: int(value) for name, value in re.findall(r'(MESSAGES|UIDNEXT|UIDVALIDITY) (\d+)', response)}
+    
+    def probe_mailboxes(self, mailboxes: List[str]) -> List[str]:
+        """Check mailboxes with STATUS and return those changed since their last sync"""
+        changed = []
+        now = time.time()
+        mail = None
+        try:
+            mail = self.connect_imap()
+            self.watchdog.watch(mail, time.monotonic() + self.cycle_timeout if self.cycle_timeout > 0 else None)
+            if self.has_mailbox_patterns():
+                # Folders created or deleted since the last LIST change what the patterns match
+                previous = self.mailboxes
+                self.get_available_mailboxes(mail)
+                mailboxes = [mb for mb in self.mailboxes if mb in mailboxes or mb not in previous]
+            for mailbox in mailboxes:
+                status = self.mailbox_status(mail, mailbox)
+                state = self.store.get_mailbox_state(mailbox)
+                if status:
+                    self.scheduler.record_probe(mailbox, status.get('UIDVALIDITY'), status.get('UIDNEXT'), now)
+                unchanged = (status and state
+                             and (state['uidvalidity'], state['uidnext'], state['message_count'])
+                             == (status.get('UIDVALIDITY'), status.get('UIDNEXT'), status.get('MESSAGES'))
+                             and len(state['recent_uids']) == min(status['MESSAGES'], self.max_emails))
+                metrics.REGISTRY.inc('imap2rss_mailbox_probes_total',
+                                     {'mailbox': mailbox, 'result': 'unchanged' if unchanged else 'changed'})
+                if not unchanged:
+                    changed.append(mailbox)
+            mail.logout()
+        except Exception as e:
+            logger.error(f"Failed to probe mailboxes: {e}")
+            # Let a sync find out what changed
+            return mailboxes
+        finally:
+            self.watchdog.clear()
+            if mail is not None:
+                self.count_commands(mail, 'probe')
+        return changed
+    
+    def count_commands(self, mail: imaplib.IMAP4_SSL, purpose: str):
+        """Add the commands sent on a finished session to the totals"""
+        # imaplib numbers every tagged command it sends
+        metrics.REGISTRY.inc('imap2rss_imap_commands_total', {'purpose': purpose}, mail.tagnum)
+        self.imap_commands += mail.tagnum
+    
+    def fetch_emails_from_mailboxes(self, mail: imaplib.IMAP4_SSL,
+                                    mailboxes: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Fetch emails from the given mailboxes, or all configured ones, through the fetch, parse and sanitize stages"""
+        mailboxes = list(mailboxes or self.mailboxes)
+        if not mailboxes:
+            return {}
+        syncs = {}
+        sessions = []
+        
+        def open_session(index):
+            # The cycle's own session serves as the first fetch worker
+            if index == 0:
+                return mail
+            with self.span('login'):
+                session = self.connect_imap()
+            self.watchdog.watch(session, self.cycle_deadline)
+            sessions.append(session)
+            return session
+        
+        # Each fetch worker takes the next mailbox as it finishes one, so a large mailbox does not hold up the rest,
+        # and its messages are parsed and sanitized while the network waits for the next
+        # (cProfile only sees the thread that enabled it, so a profiled cycle runs every stage on this one)
+        sync_pipeline = pipeline.Pipeline('sync', [
+            pipeline.Stage('fetch', lambda session, mailbox, emit: self.fetch_stage(session, mailbox, syncs, emit),
+                           workers=min(self.fetch_connections, len(mailboxes)), open_worker=open_session),
+            pipeline.Stage('parse', self.parse_stage, workers=self.parse_workers),
+            pipeline.Stage('sanitize', self.sanitize_stage, workers=self.sanitize_workers)
+        ], queue_size=self.pipeline_queue_size, trace=self.trace, inline=self.profiler.active)
+        sync_pipeline.start()
+        for mailbox in mailboxes:
+            sync_pipeline.put(mailbox)
+        sync_pipeline.close()
+        
+        for session in sessions:
             try:
-                logger.info(f"Fetching emails from mailbox: {mailbox}")
-                # Get the encoded name for IMAP commands
-                encoded_mailbox = self.mailbox_mapping.get(mailbox, mailbox)
-                # Properly encode mailbox name for IMAP - use UTF-7 encoding
-                try:
-                    quoted_mailbox = f'"{encoded_mailbox}"'
-                    mail.select(quoted_mailbox)
-                except UnicodeEncodeError:
-                    # Fallback: try encoding to UTF-7 (IMAP standard)
-                    utf7_mailbox = encoded_mailbox.encode('utf-7').decode('ascii')
-                    quoted_mailbox = f'"{utf7_mailbox}"'
-                    mail.select(quoted_mailbox)
-                
-                emails = self.fetch_emails_from_mailbox(mail, mailbox)
-                all_emails[mailbox] = emails
-                logger.info(f"Fetched {len(emails)} emails from {mailbox}")
-                
+                session.close()
+                session.logout()
             except Exception as e:
-                logger.error(f"Failed to fetch from mailbox {mailbox}: {e}")
-                all_emails[mailbox] = []
+                logger.warning(f"IMAP session did not close cleanly: {e}")
+            self.count_commands(session, 'sync')
+        
+        # Configured order, as a sequential sync returns them
+        all_emails = {}
+        for mailbox in mailboxes:
+            sync = syncs.get(mailbox)
+            if sync is None:
+                continue
+            fetched = sync['fetched']
+            emails = [sync['known'].get(uid) or fetched.get(uid) for uid in reversed(sync['recent_uids'])]
+            emails = [email_data for email_data in emails if email_data]
+            self.save_mailbox_state(sync, complete=len(emails) == len(sync['recent_uids']))
+            if sync['straggler'] and not emails:
+                # Out of time: the mailbox keeps its stored items until the next cycle
+                continue
+            all_emails[mailbox] = emails
+            metrics.REGISTRY.inc('imap2rss_messages_fetched_total', {'mailbox': mailbox}, len(emails))
+            if self.trace:
+                self.trace.count(mailbox, messages=len(emails), fetched=len(fetched))
+            logger.info(f"{mailbox}: {len(fetched)} new messages fetched, {len(sync['known'])} loaded from the store")
+            logger.info(f"Fetched {len(emails)} emails from {mailbox}")
         
         return all_emails
-    def fetch_emails_from_mailbox(self, mail: imaplib.IMAP4_SSL, mailbox: str) -> List[Dict[str, Any]]:
-        """Fetch recent emails from a specific mailbox"""
+    
+    def save_mailbox_state(self, sync: Dict[str, Any], complete: bool):
+        """Record what a sync found in a mailbox, so the next one only fetches new messages"""
+        if not sync['state'] or not sync['state'][0]:
+            return
+        uidvalidity, uidnext, message_count = sync['state']
+        if not complete:
+            # Messages cut off by the deadline or that failed are missing; without UIDNEXT and the count the
+            # mailbox does not look unchanged to the next sync or probe, which then fetches them
+            uidnext = message_count = None
+        self.store.set_mailbox_state(sync['mailbox'], uidvalidity, uidnext, message_count, sync['recent_uids'])
+    
+    def fetch_stage(self, mail: imaplib.IMAP4_SSL, mailbox: str, syncs: Dict[str, Dict[str, Any]], emit):
+        """Fetch stage: sync one mailbox, passing its new messages on to be parsed"""
+        if self.past_deadline():
+            self.report_straggler(mailbox)
+            return
+        # Messages of the mailbox, completed by the sanitize stage
+        sync = {'mailbox': mailbox, 'recent_uids': [], 'known': {}, 'fetched': {}, 'straggler': False,
+                'state': None}
+        syncs[mailbox] = sync
         try:
-            # Search for emails
-            status, messages = mail.search(None, 'ALL')
-            if status != 'OK':
-                logger.error(f"Failed to search emails in {mailbox}")
-                return []
+            logger.info(f"Fetching emails from mailbox: {mailbox}")
+            started = time.perf_counter()
+            with metrics.REGISTRY.timer('imap2rss_mailbox_fetch_seconds', {'mailbox': mailbox}):
+                with self.span('select', mailbox):
+                    uidvalidity = self.select_mailbox(mail, mailbox)
+                self.fetch_emails_from_mailbox(mail, sync, uidvalidity, emit)
+            if self.trace:
+                self.trace.count(mailbox, seconds=time.perf_counter() - started)
+        except Exception as e:
+            logger.error(f"Failed to fetch from mailbox {mailbox}: {e}")
+            sync['recent_uids'] = []
+            sync['state'] = None
+        if self.past_deadline():
+            self.report_straggler(mailbox)
+            sync['straggler'] = True
+    
+    def past_deadline(self) -> bool:
+        """Whether the cycle in progress has used up its time budget"""
+        return self.cycle_deadline is not None and time.monotonic() >= self.cycle_deadline
+    
+    def report_straggler(self, mailbox: str):
+        """Record a mailbox the cycle had no time to finish"""
+        metrics.REGISTRY.inc('imap2rss_stragglers_total', {'mailbox': mailbox})
+        if self.trace:
+            self.trace.straggler(mailbox)
+    
+    def fetch_emails_from_mailbox(self, mail: imaplib.IMAP4_SSL, sync: Dict[str, Any],
+                                  uidvalidity: Optional[int], emit):
+        """Find the recent emails of the selected mailbox, downloading only messages not already stored"""
+        mailbox = sync['mailbox']
+        try:
+            uidnext = self.untagged_number(mail, 'UIDNEXT')
+            message_count = self.untagged_number(mail, 'EXISTS')
+            state = self.store.get_mailbox_state(mailbox) if uidvalidity else None
             
-            email_ids = messages[0].split()
+            if (state and uidnext is not None and message_count is not None
+                    and (state['uidvalidity'], state['uidnext'], state['message_count']) == (uidvalidity, uidnext, message_count)
+                    and len(state['recent_uids']) == min(message_count, self.max_emails)):
+                # Nothing was added or expunged since the last sync
+                recent_uids = state['recent_uids']
+            else:
+                with self.span('search', mailbox):
+                    status, messages = mail.uid('SEARCH', None, 'ALL')
+                if status != 'OK':
+                    logger.error(f"Failed to search emails in {mailbox}")
+                    return
+                # Get the most recent emails
+                recent_uids = [int(uid) for uid in messages[0].split()][-self.max_emails:]
             
-            # Get the most recent emails
-            recent_emails = email_ids[-self.max_emails:] if email_ids else []
+            with self.span('lookup', mailbox):
+                known = self.store.get_items_by_uid(mailbox, uidvalidity, recent_uids) if uidvalidity else {}
+            sync['known'] = known
+            sync['recent_uids'] = recent_uids
+            # Saved once the later stages have completed the messages, see save_mailbox_state()
+            sync['state'] = (uidvalidity, uidnext, message_count)
+            missing = [uid for uid in recent_uids if uid not in known]
+            if missing:
+                self.fetch_new_emails(mail, sync, missing, uidvalidity, emit)
             
-            emails = []
-            for email_id in reversed(recent_emails):  # Most recent first
-                try:
-                    status, msg_data = mail.fetch(email_id, '(RFC822)')
-                    if status != 'OK':
-                        continue
-                    
-                    email_message = email.message_from_bytes(msg_data[0][1])
-                    
-                    # Extract email data
-                    subject = self.decode_header(email_message.get('Subject', 'No Subject'))
-                    sender = self.decode_header(email_message.get('From', 'Unknown Sender'))
-                    date_str = email_message.get('Date', '')
-                    
-                    # Parse date
+        except Exception as e:
+            logger.error(f"Failed to fetch emails from {mailbox}: {e}")
+            sync['recent_uids'] = []
+            sync['state'] = None
+    
+    def fetch_new_emails(self, mail: imaplib.IMAP4_SSL, sync: Dict[str, Any], uids: List[int],
+                         uidvalidity: Optional[int], emit):
+        """Fetch messages by UID and pass each on to be parsed"""
+        mailbox = sync['mailbox']
+        # Structure and headers of every new message in one round trip,
+        # so attachments are never downloaded during a sync
+        summaries = {}
+        with self.span('fetch_headers', mailbox):
+            status, data = mail.uid('FETCH', ','.join(map(str, uids)), '(UID BODYSTRUCTURE BODY.PEEK[HEADER])')
+        self.count_fetched(mailbox, data)
+        if status == 'OK':
+            try:
+                summaries = {items.get('UID'): items for items in parse_fetch_response(data).values()}
+            except ParseError as e:
+                logger.warning(f"Could not parse message structure in {mailbox}, fetching full messages: {e}")
+        
+        for index, uid in enumerate(uids):
+            if self.past_deadline():
+                logger.warning(f"{mailbox}: out of time, {len(uids) - index} messages left for the next cycle")
+                break
+            try:
+                summary = summaries.get(uid, {})
+                message = None
+                if summary.get('BODYSTRUCTURE') and summary.get('BODY[HEADER]'):
                     try:
-                        date_obj = parsedate_to_datetime(date_str) if date_str else datetime.now()
-                    except:
-                        date_obj = datetime.now()
-                    
-                    # Extract body
-                    body = self.extract_body(email_message)
-                    
-                    # Create unique ID for the email
-                    email_id_str = f"{mailbox}_{sender}_{subject}_{date_obj.isoformat()}"
-                    unique_id = hashlib.md5(email_id_str.encode()).hexdigest()
-                    
-                    emails.append({
-                        'id': unique_id,
-                        'subject': subject,
-                        'sender': sender,
-                        'date': date_obj,
-                        'body': body,
-                        'mailbox': mailbox,
-                        'category': mailbox
-                    })
-                    
-                except Exception as e:
-                    logger.warning(f"Failed to process email {email_id} in {mailbox}: {e}")
-                    continue
+                        message = self.fetch_email_parts(mail, mailbox, uid, summary)
+                    except ParseError as e:
+                        logger.warning(f"Could not parse the structure of message {uid} in {mailbox}, fetching it whole: {e}")
+                        message = self.fetch_full_email(mail, mailbox, uid)
+                else:
+                    message = self.fetch_full_email(mail, mailbox, uid)
+                
+                if message:
+                    message.update(sync=sync, uid=uid, uidvalidity=uidvalidity)
+                    # Waits while the parse stage is behind, which bounds the messages held in memory
+                    emit(message)
+                
+            except Exception as e:
+                logger.warning(f"Failed to fetch email {uid} in {mailbox}: {e}")
+                continue
+    
+    def count_fetched(self, mailbox: str, data: List[Any]):
+        """Add the size of a FETCH response to the fetched bytes counter"""
+        size = sum(len(element[1]) + len(element[0]) if isinstance(element, tuple) else len(element)
+                   for element in data or [] if isinstance(element, (tuple, bytes)))
+        metrics.REGISTRY.inc('imap2rss_bytes_fetched_total', {'mailbox': mailbox}, size)
+        if self.trace:
+            self.trace.count(mailbox, bytes=size)
+    
+    def fetch_full_email(self, mail: imaplib.IMAP4_SSL, mailbox: str, uid: int) -> Optional[Dict[str, Any]]:
+        """Download a whole message, used when its structure is unavailable"""
+        with self.span('fetch_body', mailbox):
+            status, msg_data = mail.uid('FETCH', str(uid), '(RFC822)')
+        self.count_fetched(mailbox, msg_data)
+        if status != 'OK' or not msg_data or not isinstance(msg_data[0], tuple):
+            return None
+        return {'raw': msg_data[0][1]}
+    
+    def fetch_email_parts(self, mail: imaplib.IMAP4_SSL, mailbox: str, uid: int,
+                          summary: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Download only the text parts of a message, recording the others for lazy download"""
+        with self.span('parse'):
+            parts = parse_bodystructure(summary['BODYSTRUCTURE'])
+        text_parts = [part for part in parts
+                      if part['content_type'] in ('text/plain', 'text/html') and part['disposition'] != 'attachment']
+        
+        contents = {}
+        if text_parts:
+            sections = ' '.join(f"BODY.PEEK[{part['section']}]" for part in text_parts)
+            with self.span('fetch_body', mailbox):
+                status, data = mail.uid('FETCH', str(uid), f'({sections})')
+            self.count_fetched(mailbox, data)
+            if status != 'OK':
+                return None
+            contents = next(iter(parse_fetch_response(data).values()), {})
+        
+        return {'header': summary['BODY[HEADER]'], 'parts': parts, 'text_parts': text_parts, 'contents': contents}
+    
+    def parse_stage(self, message: Dict[str, Any], emit):
+        """Parse stage: decode the headers and text parts of a fetched message"""
+        mailbox = message['sync']['mailbox']
+        try:
+            with self.span('parse'):
+                if 'raw' in message:
+                    email_message = email.message_from_bytes(message['raw'])
+                    body, html_body = self.extract_texts(email_message)
+                else:
+                    email_message = email.message_from_bytes(message['header'])
+                    body = ""
+                    html_body = ""
+                    for part in message['text_parts']:
+                        text = self.decode_part_text(message['contents'].get(f"BODY[{part['section']}]") or b'', part)
+                        if part['content_type'] == 'text/html':
+                            html_body = text
+                        else:
+                            body = text
+                
+                email_data = self.build_email(mailbox, email_message, body)
+            email_data['uid'] = message['uid']
+            email_data['uidvalidity'] = message['uidvalidity']
+            if message['uidvalidity'] and self.store.id_held_by_other_uid(email_data['id'], message['uidvalidity'], message['uid']):
+                # Same sender, subject and date as a stored message: the UID tells them apart
+                email_data['id'] = hashlib.md5(f"{email_data['id']}_{message['uid']}".encode()).hexdigest()
+            if 'parts' in message:
+                email_data['parts'] = [part for part in message['parts'] if part not in message['text_parts']]
+            emit({'sync': message['sync'], 'email': email_data, 'html': html_body})
+        except Exception as e:
+            logger.warning(f"Failed to parse email {message['uid']} in {mailbox}: {e}")
+    
+    def sanitize_stage(self, message: Dict[str, Any], emit):
+        """Sanitize stage: choose and clean the body shown in the feed, completing the email"""
+        email_data = message['email']
+        try:
+            email_data['body'] = self.choose_body(email_data['body'], message['html'])
+            if 'parts' in email_data:
+                self.link_attachments(email_data)
+            message['sync']['fetched'][email_data['uid']] = email_data
+        except Exception as e:
+            logger.warning(f"Failed to process email {email_data['uid']} in {email_data['mailbox']}: {e}")
+    
+    def build_email(self, mailbox: str, email_message, body: str) -> Dict[str, Any]:
+        """Build the email dict used by the feed generators from headers and body"""
+        # Extract email data
+        subject = self.decode_header(email_message.get('Subject', 'No Subject'))
+        sender = self.decode_header(email_message.get('From', 'Unknown Sender'))
+        date_str = email_message.get('Date', '')
+        
+        # Parse date
+        try:
+            date_obj = parsedate_to_datetime(date_str) if date_str else datetime.now()
+        except:
+            date_obj = datetime.now()
+        
+        # Create unique ID for the email
+        email_id_str = f"{mailbox}_{sender}_{subject}_{date_obj.isoformat()}"
+        unique_id = hashlib.md5(email_id_str.encode()).hexdigest()
+        
+        return {
+            'id': unique_id,
+            'subject': subject,
+            'sender': sender,
+            'date': date_obj,
+            'body': body,
+            'mailbox': mailbox,
+            'category': mailbox
+        }
+    
+    def decode_part_text(self, raw: bytes, part: Dict[str, Any]) -> str:
+        """Decode a fetched text part using its transfer encoding and charset"""
+        data = decode_transfer_encoding(raw, part['encoding'])
+        try:
+            return data.decode(part['charset'] or 'utf-8', errors='ignore')
+        except LookupError:
+            return data.decode('utf-8', errors='ignore')
+    
+    def link_attachments(self, email_data: Dict[str, Any]):
+        """Point cid: images at the blob route and list remaining parts as enclosures"""
+        base = f"{self.base_url}/blob/{email_data['id']}"
+        parts_by_cid = {part['cid']: part for part in email_data['parts'] if part['cid']}
+        referenced = set()
+        
+        def replace_cid(match):
+            part = parts_by_cid.get(match.group(2))
+            if not part:
+                return match.group(0)
+            referenced.add(part['section'])
+            return f"{match.group(1)}{base}/{part['section']}"
+        
+        email_data['body'] = re.sub(r'(src=["\'])cid:([^"\']+)', replace_cid, email_data['body'], flags=re.IGNORECASE)
+        
+        email_data['attachments'] = []
+        for part in email_data['parts']:
+            if part['section'] in referenced:
+                continue
+            # An estimate until the part is downloaded, when the item store records the exact size
+            email_data['attachments'].append({
+                'url': f"{base}/{part['section']}",
+                'length': estimate_decoded_size(part['size'], part['encoding']),
+                'type': part['content_type']
+            })
+    
+    def fetch_part(self, mailbox: str, uidvalidity: Optional[int], uid: int, section: str, encoding: str) -> bytes:
+        """Download and decode a single MIME part of a stored message"""
+        mail = self.connect_imap()
+        try:
+            if not self.mailbox_mapping:
+                self.get_available_mailboxes(mail)
+            current_uidvalidity = self.select_mailbox(mail, mailbox)
+            if uidvalidity and current_uidvalidity and current_uidvalidity != uidvalidity:
+                raise ValueError(f"UIDVALIDITY of {mailbox} changed, message {uid} is gone")
             
-            return emails
+            status, data = mail.uid('FETCH', str(uid), f'(BODY.PEEK[{section}])')
+            if status != 'OK':
+                raise ValueError(f"Failed to fetch part {section} of message {uid}")
             
-        except Exception as e:
-            logger.error(f"Failed to fetch emails from {mailbox}: {e}")
-            return []
+            for items in parse_fetch_response(data).values():
+                raw = items.get(f"BODY[{section}]")
+                if raw is not None:
+                    return decode_transfer_encoding(raw, encoding)
+            raise ValueError(f"Message {uid} not found in {mailbox}")
+        finally:
+            try:
+                mail.logout()
+            except Exception:
+                pass
     
     def decode_header(self, header: str) -> str:
         """Decode email header"""
@@ -312,6 +876,10 @@ class ImapToRss:
     
     def extract_body(self, email_message) -> str:
         """Extract email body text with preserved HTML when available"""
+        return self.choose_body(*self.extract_texts(email_message))
+    
+    def extract_texts(self, email_message) -> Tuple[str, str]:
+        """Plain text and HTML bodies of a parsed message"""
         body = ""
         html_body = ""
         
@@ -340,9 +908,14 @@ class ImapToRss:
             except:
                 body = str(email_message.get_payload())
         
+        return body, html_body
+    
+    def choose_body(self, body: str, html_body: str) -> str:
+        """Pick the body shown in the feed"""
         # Prefer HTML version for better link preservation, fallback to plain text
         if html_body:
-            return self.clean_html_for_rss(html_body)
+            with metrics.REGISTRY.timer('imap2rss_sanitize_seconds'), self.span('sanitize'):
+                return self.clean_html_for_rss(html_body)
         return body.strip()
     
     def clean_html_for_rss(self, html_content: str) -> str:
@@ -408,27 +981,8 @@ class ImapToRss:
         text = re.sub(r'\s+', ' ', text)
         return text.strip()
     
-    def generate_combined_rss(self, all_emails: Dict[str, List[Dict[str, Any]]]) -> str:
-        """Generate a single RSS feed with all emails, categorized by mailbox"""
-        # Create RSS root element
-        rss = ET.Element("rss", version="2.0")
-        rss.set("xmlns:atom", "http://www.w3.org/2005/Atom")
-        channel = ET.SubElement(rss, "channel")
-        
-        # Channel metadata
-        ET.SubElement(channel, "title").text = self.feed_title
-        ET.SubElement(channel, "description").text = self.feed_description
-        ET.SubElement(channel, "link").text = "http://localhost:8888/feed.xml"
-        ET.SubElement(channel, "lastBuildDate").text = datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000")
-        ET.SubElement(channel, "generator").text = "IMAP to RSS Converter with Categories"
-        
-        # Atom link for self-reference
-        atom_link = ET.SubElement(channel, "atom:link")
-        atom_link.set("href", "http://localhost:8888/feed.xml")
-        atom_link.set("rel", "self")
-        atom_link.set("type", "application/rss+xml")
-        
-        # Collect all emails and sort by date
+    def combined_items(self, all_emails: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """The emails the combined feed shows: the most recent of all mailboxes"""
         all_items = []
         for mailbox, emails in all_emails.items():
             all_items.extend(emails)
@@ -437,99 +991,121 @@ class ImapToRss:
         all_items.sort(key=lambda x: x['date'], reverse=True)
         
         # Limit total items
-        all_items = all_items[:self.max_emails]
+        return all_items[:self.max_emails]
+    
+    def generate_combined_rss(self, all_emails: Dict[str, List[Dict[str, Any]]]) -> str:
+        """Generate a single RSS feed with all emails, categorized by mailbox"""
+        render_started = time.perf_counter()
+        rss, channel = feedgen.create_channel(
+            self.feed_title, self.feed_description, self.feed_url('feed'),
+            "IMAP to RSS Converter with Categories", hub=self.websub_hub)
+        self.add_archive_link(channel, 'feed')
         
         # Add items for each email
-        for email_data in all_items:
-            item = ET.SubElement(channel, "item")
-            
-            title = f"[{email_data['mailbox']}] [{email_data['sender']}] {email_data['subject']}"
-            ET.SubElement(item, "title").text = title
-            
-            # Include mailbox in description with preserved HTML
-            description = f"<p><strong>Folder:</strong> {email_data['mailbox']}</p><p><strong>From:</strong> {email_data['sender']}</p><hr/>"
-            
-            # Preserve HTML content with links
-            body_content = email_data['body']
-            if len(body_content) > 3000:  # Increased limit for HTML content
-                body_content = body_content[:3000] + "..."
-            
-            description += body_content
-            
-            # Use CDATA to preserve HTML content
-            desc_elem = ET.SubElement(item, "description")
-            desc_elem.text = f"<![CDATA[{description}]]>"
-            
-            ET.SubElement(item, "guid").text = email_data['id']
-            ET.SubElement(item, "pubDate").text = email_data['date'].strftime("%a, %d %b %Y %H:%M:%S +0000")
-            ET.SubElement(item, "author").text = email_data['sender']
-            ET.SubElement(item, "category").text = email_data['mailbox']
+        for email_data in self.combined_items(all_emails):
+            title, description = feedgen.format_combined_item(email_data)
+            feedgen.add_item(channel, email_data, title, description)
+        
+        with self.span('xml'):
+            content = feedgen.to_pretty_xml(rss)
+        metrics.REGISTRY.observe('imap2rss_feed_render_seconds', time.perf_counter() - render_started, {'feed': 'combined'})
+        return content
+    
+    def generate_mailbox_rss(self, mailbox: str, emails: List[Dict[str, Any]]) -> str:
+        """Generate the separate RSS feed of one mailbox"""
+        render_started = time.perf_counter()
+        rss, channel = feedgen.create_channel(
+            f"{self.feed_title} - {mailbox}", f"{self.feed_description} (Pasta: {mailbox})",
+            self.feed_url(self.normalize_filename(mailbox)), "IMAP to RSS Converter", category=mailbox, hub=self.websub_hub)
+        self.add_archive_link(channel, self.normalize_filename(mailbox))
         
-        # Convert to string
-        xml_str = ET.tostring(rss, encoding='unicode')
+        # Add items for each email
+        for email_data in emails:
+            title, description = feedgen.format_mailbox_item(email_data)
+            feedgen.add_item(channel, email_data, title, description)
         
-        # Pretty format
-        from xml.dom import minidom
-        dom = minidom.parseString(xml_str)
-        return dom.toprettyxml(indent="  ")
+        with self.span('xml'):
+            content = feedgen.to_pretty_xml(rss)
+        metrics.REGISTRY.observe('imap2rss_feed_render_seconds', time.perf_counter() - render_started, {'feed': 'mailbox'})
+        return content
     
-    def generate_separate_rss_feeds(self, all_emails: Dict[str, List[Dict[str, Any]]]) -> Dict[str, str]:
-        """Generate separate RSS feeds for each mailbox"""
-        feeds = {}
+    def render_stage(self, feed: Tuple[str, Optional[str]], all_emails: Dict[str, List[Dict[str, Any]]], emit):
+        """Render stage: build one feed document, the combined feed when no mailbox is given"""
+        name, mailbox = feed
+        if mailbox is None:
+            content = self.generate_combined_rss(all_emails)
+        else:
+            content = self.generate_mailbox_rss(mailbox, all_emails[mailbox])
+        emit((name, content))
+    
+    def publish_stage(self, feed: Tuple[str, str], changed: List[str]):
+        """Publish stage: write a rendered feed and its compressed sidecars if its content changed"""
+        name, rss_content = feed
+        file_path = os.path.join(self.data_dir, f"{name}.xml")
+        try:
+            if self.write_feed_file(file_path, rss_content):
+                logger.info(f"RSS feed saved to {file_path}")
+                metrics.REGISTRY.inc('imap2rss_feeds_written_total')
+                changed.append(name)
+            else:
+                logger.info(f"RSS feed {file_path} unchanged")
+        except Exception as e:
+            logger.error(f"Failed to save RSS feed {file_path}: {e}")
+    
+    def generate_archive_rss(self, feed_name: str, page: int, items: List[Dict[str, Any]]) -> str:
+        """Generate an immutable RFC 5005 archive page for a feed"""
+        rss, channel = feedgen.create_channel(
+            f"{self.feed_title} - {feed_name} (archive {page})", self.feed_description,
+            f"{self.base_url}/archive/{feed_name}-{page}.xml", "IMAP to RSS Converter")
+        feedgen.mark_as_archive(rss, channel)
+        feedgen.add_atom_link(channel, f"{self.base_url}/{feed_name}.xml", "current")
+        if page > 1:
+            feedgen.add_atom_link(channel, f"{self.base_url}/archive/{feed_name}-{page - 1}.xml", "prev-archive")
         
-        for mailbox, emails in all_emails.items():
-            if not emails:
-                continue
-                
-            # Create RSS root element
-            rss = ET.Element("rss", version="2.0")
-            rss.set("xmlns:atom", "http://www.w3.org/2005/Atom")
-            channel = ET.SubElement(rss, "channel")
-            
-            # Channel metadata
-            ET.SubElement(channel, "title").text = f"{self.feed_title} - {mailbox}"
-            ET.SubElement(channel, "description").text = f"{self.feed_description} (Pasta: {mailbox})"
-            ET.SubElement(channel, "link").text = f"http://localhost:8888/{mailbox}.xml"
-            ET.SubElement(channel, "lastBuildDate").text = datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000")
-            ET.SubElement(channel, "generator").text = "IMAP to RSS Converter"
-            ET.SubElement(channel, "category").text = mailbox
-            
-            # Atom link for self-reference
-            atom_link = ET.SubElement(channel, "atom:link")
-            atom_link.set("href", f"http://localhost:8888/{mailbox}.xml")
-            atom_link.set("rel", "self")
-            atom_link.set("type", "application/rss+xml")
-            
-            # Add items for each email
-            for email_data in emails:
-                item = ET.SubElement(channel, "item")
-                
-                title = f"[{email_data['sender']}] {email_data['subject']}"
-                ET.SubElement(item, "title").text = title
-                
-                # Preserve HTML content with links
-                body_content = email_data['body']
-                if len(body_content) > 3000:  # Increased limit for HTML content
-                    body_content = body_content[:3000] + "..."
-                
-                # Use CDATA to preserve HTML content
-                desc_elem = ET.SubElement(item, "description")
-                desc_elem.text = f"<![CDATA[{body_content}]]>"
-                
-                ET.SubElement(item, "guid").text = email_data['id']
-                ET.SubElement(item, "pubDate").text = email_data['date'].strftime("%a, %d %b %Y %H:%M:%S +0000")
-                ET.SubElement(item, "author").text = email_data['sender']
-                ET.SubElement(item, "category").text = mailbox
-            
-            # Convert to string
-            xml_str = ET.tostring(rss, encoding='unicode')
-            
-            # Pretty format
-            from xml.dom import minidom
-            dom = minidom.parseString(xml_str)
-            feeds[mailbox] = dom.toprettyxml(indent="  ")
+        # Most recent first, like the current feed
+        for email_data in reversed(items):
+            if feed_name == 'feed':
+                title, description = feedgen.format_combined_item(email_data)
+            else:
+                title, description = feedgen.format_mailbox_item(email_data)
+            feedgen.add_item(channel, email_data, title, description)
         
-        return feeds
+        return feedgen.to_pretty_xml(rss)
+    
+    def add_archive_link(self, channel, feed_name: str):
+        """Point the current feed at its most recent archive page, if any"""
+        if not self.archive_feeds:
+            return
+        last = self.store.last_archive(feed_name)
+        if last:
+            feedgen.add_atom_link(channel, f"{self.base_url}/archive/{feed_name}-{last['page']}.xml", "prev-archive")
+    
+    def update_archives(self, feed_name: str, mailboxes: List[str], current: List[Dict[str, Any]]):
+        """Write archive pages for every full page of stored items not archived yet that left the current feed"""
+        archive_dir = os.path.join(self.data_dir, 'archive')
+        os.makedirs(archive_dir, exist_ok=True)
+        
+        # RFC 5005 archives only hold what the current feed no longer shows
+        current_ids = {email_data['id'] for email_data in current}
+        last = self.store.last_archive(feed_name)
+        while True:
+            after_seq = last['last_seq'] if last else 0
+            items = []
+            for item in self.store.get_items_after(mailboxes, after_seq, self.archive_page_size):
+                # Pages cover consecutive items, so one still in the current feed ends the page
+                if item['id'] in current_ids:
+                    break
+                items.append(item)
+            if len(items) < self.archive_page_size:
+                break
+            
+            page = last['page'] + 1 if last else 1
+            with metrics.REGISTRY.timer('imap2rss_feed_render_seconds', {'feed': 'archive'}):
+                content = self.generate_archive_rss(feed_name, page, items)
+            self.write_feed_file(os.path.join(archive_dir, f"{feed_name}-{page}.xml"), content)
+            self.store.add_archive(feed_name, page, items[0]['seq'], items[-1]['seq'], len(items))
+            logger.info(f"Archived {len(items)} items of {feed_name} as page {page}")
+            last = self.store.last_archive(feed_name)
     
     def normalize_filename(self, mailbox_name: str) -> str:
         """Normalize mailbox name to valid filename"""
@@ -544,36 +1120,106 @@ class ImapToRss:
             filename = 'mailbox'
         return filename
     
-    def save_feeds(self, feeds_data: Dict[str, str]):
-        """Save RSS feeds to files"""
+    def feed_url(self, feed_name: str) -> str:
+        """Public URL of a feed file, also the topic WebSub subscribers use for it"""
+        return f"{self.base_url}/{urllib.parse.quote(feed_name)}.xml"
+    
+    def save_feeds(self, feed_names: List[str], changed: List[str]):
+        """Update the feed index and announce the feeds the publish stage rewrote"""
         try:
-            os.makedirs(self.data_dir, exist_ok=True)
-            
-            for feed_name, rss_content in feeds_data.items():
-                file_path = os.path.join(self.data_dir, f"{feed_name}.xml")
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(rss_content)
-                logger.info(f"RSS feed saved to {file_path}")
-                
             # Create index file with available feeds
-            self.create_feeds_index(list(feeds_data.keys()))
+            self.create_feeds_index(feed_names)
+            
+            if changed and self.websub_hub:
+                self.publish_feeds(changed)
             
         except Exception as e:
             logger.error(f"Failed to save RSS feeds: {e}")
     
+    def write_feed_file(self, file_path: str, rss_content: str) -> bool:
+        """Write a feed and its precompressed sidecars, only if the content changed"""
+        fingerprint = feed_fingerprint(rss_content)
+        
+        if file_path not in self.feed_fingerprints and os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                self.feed_fingerprints[file_path] = feed_fingerprint(f.read())
+        
+        sidecars_present = all(os.path.exists(file_path + self.COMPRESSION_SUFFIXES[enc])
+                               for enc in self.feed_compression)
+        if self.feed_fingerprints.get(file_path) == fingerprint and sidecars_present:
+            return False
+        
+        data = rss_content.encode('utf-8')
+        with self.span('write'):
+            write_file_atomic(file_path, data)
+        contents = {None: data}
+        
+        # Sidecars are written after the feed so the server can detect stale ones by mtime
+        for encoding in self.feed_compression:
+            with self.span('compress'):
+                if encoding == 'gzip':
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                else:
+                    compressed = zlib.compress(data, 9)
+            with self.span('write'):
+                write_file_atomic(file_path + self.COMPRESSION_SUFFIXES[encoding], compressed)
+            contents[encoding] = compressed
+        
+        self.feed_fingerprints[file_path] = fingerprint
+        if self.feed_published is not None:
+            self.feed_published(os.path.relpath(file_path, self.data_dir), contents)
+        return True
+    
+    def publish_feeds(self, feed_names: List[str]):
+        """Notify the WebSub hub that feeds changed"""
+        if self.local_hub is not None:
+            for name in feed_names:
+                self.local_hub.publish(self.feed_url(name))
+            return
+        
+        params = [('hub.mode', 'publish')] + [('hub.url', self.feed_url(name)) for name in feed_names]
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if self.websub_publish_token:
+            headers['Authorization'] = f"Bearer {self.websub_publish_token}"
+        request = urllib.request.Request(self.websub_publish_url, data=urllib.parse.urlencode(params).encode('ascii'),
+                                         headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+            logger.info(f"Published {len(feed_names)} changed feeds to WebSub hub")
+        except Exception as e:
+            logger.error(f"Failed to publish feeds to WebSub hub: {e}")
+    
     def create_feeds_index(self, feed_names: List[str]):
-        """Create an index file listing all available feeds"""
+        """Write the feed index (JSON and HTML page) when the set of feeds changes"""
         index_data = {
             'feeds': feed_names,
-            'base_url': 'http://localhost:8888',
+            'base_url': self.base_url,
             'generated_at': datetime.now().isoformat(),
             'feed_mode': self.feed_mode,
             'mailboxes': self.mailboxes
         }
         
         index_path = os.path.join(self.data_dir, 'feeds_index.json')
-        with open(index_path, 'w', encoding='utf-8') as f:
-            json.dump(index_data, f, indent=2)
+        page_path = os.path.join(self.data_dir, 'index.html')
+        
+        # A new timestamp alone does not make the index stale
+        index_key = json.dumps({k: v for k, v in index_data.items() if k != 'generated_at'}, sort_keys=True)
+        if self.feeds_index_key is None and os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    existing = json.load(f)
+                existing.pop('generated_at', None)
+                self.feeds_index_key = json.dumps(existing, sort_keys=True)
+            except Exception as e:
+                logger.warning(f"Could not read existing feeds index: {e}")
+        if index_key == self.feeds_index_key and os.path.exists(page_path):
+            return
+        
+        mailbox_names = [decode_imap_utf7(mb) for mb in self.mailboxes]
+        self.write_feed_file(index_path, json.dumps(index_data, indent=2))
+        self.write_feed_file(page_path, feedgen.render_feeds_index(index_data, mailbox_names))
+        self.feeds_index_key = index_key
     
     def save_rss(self, rss_content: str):
         """Save RSS content to file (legacy method for compatibility)"""
@@ -585,65 +1231,310 @@ class ImapToRss:
         except Exception as e:
             logger.error(f"Failed to save RSS feed: {e}")
     
-    def run_once(self):
-        """Run one iteration of email fetching and RSS generation"""
+    def run_once(self, mailboxes: Optional[List[str]] = None) -> str:
+        """Run one iteration of email fetching and RSS generation, optionally syncing only some mailboxes"""
+        cycle_started = time.perf_counter()
+        self.trace = cycle_stats.CycleTrace()
+        self.cycle_deadline = time.monotonic() + self.cycle_timeout if self.cycle_timeout > 0 else None
+        result = 'error'
+        mail = None
         try:
-            mail = self.connect_imap()
-            
-            # Get available mailboxes for logging
-            available_mailboxes = self.get_available_mailboxes(mail)
-            logger.info(f"Available mailboxes: {available_mailboxes}")
+            with self.phase('connect'):
+                with self.span('login'):
+                    mail = self.connect_imap()
+                self.watchdog.watch(mail, self.cycle_deadline)
+                
+                # Get available mailboxes for logging
+                with self.span('list'):
+                    available_mailboxes = self.get_available_mailboxes(mail)
+                logger.info(f"Available mailboxes: {available_mailboxes}")
             
             # Fetch emails from all configured mailboxes
-            all_emails = self.fetch_emails_from_mailboxes(mail)
-            mail.close()
-            mail.logout()
+            with self.phase('fetch'):
+                all_emails = self.fetch_emails_from_mailboxes(mail, mailboxes)
+                try:
+                    mail.close()
+                    mail.logout()
+                except Exception as e:
+                    # e.g. a connection shut down by the watchdog; what was fetched is still used
+                    logger.warning(f"IMAP session did not close cleanly: {e}")
             
-            total_emails = sum(len(emails) for emails in all_emails.values())
+            # Keep every processed email so history stays reachable through archives
+            with self.phase('store'):
+                for emails in all_emails.values():
+                    self.store.add_items(emails)
+                
+                # Mailboxes not synced this time keep the items already stored
+                for mailbox in self.mailboxes:
+                    if mailbox not in all_emails:
+                        all_emails[mailbox] = self.store.query_items(FeedQuery([mailbox], limit=self.max_emails))
             
-            if total_emails > 0:
-                if self.feed_mode == 'separate':
-                    # Generate separate feeds for each mailbox
-                    feeds = self.generate_separate_rss_feeds(all_emails)
-                    feeds['feed'] = self.generate_combined_rss(all_emails)  # Also create combined feed
-                    
-                    # Normalize feed names for files
-                    normalized_feeds = {}
-                    for mailbox, feed_content in feeds.items():
-                        if mailbox == 'feed':
-                            normalized_feeds['feed'] = feed_content
-                        else:
-                            normalized_name = self.normalize_filename(mailbox)
-                            normalized_feeds[normalized_name] = feed_content
-                    
-                    self.save_feeds(normalized_feeds)
-                    logger.info(f"Generated {len(normalized_feeds)} RSS feeds with {total_emails} total emails")
-                else:
-                    # Generate single combined feed
-                    combined_rss = self.generate_combined_rss(all_emails)
-                    self.save_feeds({'feed': combined_rss})
-                    logger.info(f"Generated combined RSS feed with {total_emails} emails from {len(all_emails)} mailboxes")
+            if self.generate_feeds(all_emails):
+                result = 'ok'
             else:
                 logger.warning("No emails found in any mailbox")
+                result = 'empty'
+            
+            if self.trace.stragglers:
+                logger.warning(f"Cycle ran out of its {self.cycle_timeout}s budget, "
+                               f"unfinished: {', '.join(self.trace.stragglers)}")
+                result = 'partial'
                 
         except Exception as e:
             logger.error(f"Error in run_once: {e}")
+        finally:
+            self.watchdog.clear()
+            self.cycle_deadline = None
+            if mail is not None:
+                self.count_commands(mail, 'sync')
+            duration = time.perf_counter() - cycle_started
+            self.publish_metrics(duration, result)
+            self.publish_cycle_stats(duration, result)
+        return result
+    
+    def generate_feeds(self, all_emails: Dict[str, List[Dict[str, Any]]]) -> bool:
+        """Update archives and render and save the feeds; False if there are no emails"""
+        total_emails = sum(len(emails) for emails in all_emails.values())
+        if total_emails == 0:
+            return False
+        
+        if self.archive_feeds:
+            with self.phase('archive'):
+                self.update_archives('feed', self.mailboxes, self.combined_items(all_emails))
+                if self.feed_mode == 'separate':
+                    for mailbox in self.mailboxes:
+                        self.update_archives(self.normalize_filename(mailbox), [mailbox], all_emails.get(mailbox, []))
+        
+        # Feed file name -> mailbox, or None for the combined feed; listed in this order in the feed index
+        feeds = {}
+        if self.feed_mode == 'separate':
+            feeds = {self.normalize_filename(mailbox): mailbox for mailbox, emails in all_emails.items() if emails}
+        feeds['feed'] = None
+        
+        # One feed is written and compressed while the next renders, except in profiled cycles
+        changed = []
+        with self.phase('render'):
+            feeds_pipeline = pipeline.Pipeline('feeds', [
+                pipeline.Stage('render', lambda feed, emit: self.render_stage(feed, all_emails, emit),
+                               workers=self.render_workers),
+                pipeline.Stage('publish', lambda feed, emit: self.publish_stage(feed, changed),
+                               workers=self.publish_workers)
+            ], queue_size=self.pipeline_queue_size, trace=self.trace, inline=self.profiler.active)
+            feeds_pipeline.start()
+            # The combined feed is the largest, so it starts first
+            for feed in reversed(feeds.items()):
+                feeds_pipeline.put(feed)
+            feeds_pipeline.close()
+        
+        with self.phase('save'):
+            self.save_feeds(list(feeds), changed)
+        if self.feed_mode == 'separate':
+            logger.info(f"Generated {len(feeds)} RSS feeds with {total_emails} total emails")
+        else:
+            logger.info(f"Generated combined RSS feed with {total_emails} emails from {len(all_emails)} mailboxes")
+        return True
+    
+    def restore_feeds(self):
+        """Render missing feeds from the item store, so they are served before the first sync completes"""
+        expected = ['feed']
+        if self.feed_mode == 'separate':
+            expected += [self.normalize_filename(mailbox) for mailbox in self.mailboxes]
+        if all(os.path.exists(os.path.join(self.data_dir, f"{name}.xml")) for name in expected):
+            return
+        
+        try:
+            all_emails = {mailbox: self.store.query_items(FeedQuery([mailbox], limit=self.max_emails))
+                          for mailbox in self.mailboxes}
+            if self.generate_feeds(all_emails):
+                logger.info("Restored feeds from the item store")
+        except Exception as e:
+            logger.error(f"Failed to restore feeds from the item store: {e}")
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Time one phase of a cycle"""
+        with metrics.REGISTRY.timer('imap2rss_cycle_phase_seconds', {'phase': name}):
+            with self.trace.phase(name) if self.trace else nullcontext():
+                yield
+    
+    def span(self, step: str, mailbox: Optional[str] = None):
+        """Time a step of the cycle in progress, if any"""
+        return self.trace.span(step, mailbox) if self.trace else nullcontext()
+    
+    def publish_cycle_stats(self, duration: float, result: str):
+        """Append the finished cycle's timings to the stats file"""
+        trace, self.trace = self.trace, None
+        record = trace.record(duration, result)
+        try:
+            cycle_stats.append_record(self.data_dir, record, self.cycle_stats_max_bytes)
+        except Exception as e:
+            logger.error(f"Failed to write cycle stats: {e}")
+        slowest = sorted(record['phases'].items(), key=lambda item: item[1], reverse=True)[:3]
+        logger.info(f"Cycle took {duration:.2f}s ({', '.join(f'{name} {seconds:.2f}s' for name, seconds in slowest)}), "
+                    f"fetched {record['messages_fetched']} messages, {record['bytes_fetched']} bytes")
+    
+    def publish_metrics(self, duration: float, result: str):
+        """Record a finished cycle and publish the daemon's metrics for the server"""
+        metrics.REGISTRY.observe('imap2rss_cycle_seconds', duration)
+        metrics.REGISTRY.inc('imap2rss_cycles_total', {'result': result})
+        metrics.REGISTRY.set('imap2rss_last_cycle_timestamp_seconds', time.time())
+        self.write_metrics()
+    
+    def write_metrics(self):
+        """Publish the daemon's metrics for the server"""
+        try:
+            metrics.REGISTRY.write_snapshot(os.path.join(self.data_dir, 'daemon_metrics.json'))
+        except Exception as e:
+            logger.error(f"Failed to publish metrics: {e}")
     
     def run_daemon(self):
-        """Run as daemon, checking for new emails periodically"""
-        check_interval = int(os.getenv('CHECK_INTERVAL', '300'))  # 5 minutes default
+        """Run as daemon, checking for new emails periodically or when a refresh is requested"""
+        if self.adaptive_polling:
+            logger.info(f"Starting IMAP to RSS daemon (adaptive polling every {self.poll_min_interval}-{self.poll_max_interval} seconds)")
+        else:
+            logger.info(f"Starting IMAP to RSS daemon (checking every {self.check_interval} seconds)")
         
-        logger.info(f"Starting IMAP to RSS daemon (checking every {check_interval} seconds)")
+        # The server wakes the daemon with SIGUSR1 for POST /refresh
+        wake = threading.Event()
+        signal.signal(signal.SIGUSR1, lambda signum, frame: wake.set())
+        # SIGUSR2 profiles the next cycles, as many as a pending request asks for or one
+        profile_signalled = threading.Event()
+        def on_profile_signal(signum, frame):
+            profile_signalled.set()
+            wake.set()
+        signal.signal(signal.SIGUSR2, on_profile_signal)
+        # SIGHUP (sent by the configuration GUI on save) or a newer .env reloads the settings
+        reload_signalled = threading.Event()
+        def on_reload_signal(signum, frame):
+            reload_signalled.set()
+            wake.set()
+        signal.signal(signal.SIGHUP, on_reload_signal)
+        env_mtime = envfile.mtime()
+        refresh.write_pid(self.data_dir)
         
+        profile_cycles = int(os.getenv('PROFILE_CYCLES', '0'))
+        if profile_cycles > 0:
+            self.profiler.arm(profile_cycles)
+        
+        self.restore_feeds()
+        
+        schedule_path = os.path.join(self.data_dir, scheduler.SCHEDULE_FILE)
+        self.scheduler.set_mailboxes(self.mailboxes)
+        self.scheduler.restore(refresh.read_json(schedule_path), time.time())
+        # Fixed mode starts cycles every CHECK_INTERVAL from now, however long each one takes
+        fixed_schedule = scheduler.FixedRateSchedule(self.check_interval, self.schedule_jitter)
+        self.watchdog.start()
+        
+        last_request_id = 0
+        triggered = False
+        reloaded = False
+        deadline = None
         while True:
-            self.run_once()
-            time.sleep(check_interval)
+            # Requests arriving during the sync are coalesced into the next one
+            request = refresh.take_request(self.data_dir)
+            mailboxes = request['mailboxes'] if triggered and request else None
+            if mailboxes:
+                logger.info(f"Refresh requested for {', '.join(mailboxes)}")
+            
+            profile_request = profiling.take_request(self.data_dir)
+            if profile_request:
+                self.profiler.arm(profile_request['cycles'], profile_request['id'])
+            elif profile_signalled.is_set():
+                self.profiler.arm(1)
+            profile_signalled.clear()
+            
+            started = time.time()
+            if deadline is not None and not (triggered or reloaded):
+                metrics.REGISTRY.observe('imap2rss_schedule_lag_seconds', max(0, started - deadline))
+            selected = [mb for mb in mailboxes if mb in self.mailboxes] if mailboxes else None
+            commands_before = self.imap_commands
+            scheduled = False
+            if self.adaptive_polling and not (triggered or reloaded or self.profiler.cycles_left > 0):
+                # Scheduled cycle: sync only the due mailboxes whose STATUS changed
+                self.scheduler.set_mailboxes(self.mailboxes)
+                due = self.scheduler.due(started)
+                # With patterns the probe also lists the folders, which is how a fresh install with
+                # nothing expanded yet, or a folder list gone stale, finds the mailboxes to poll
+                selected = self.probe_mailboxes(due) if due or self.has_mailbox_patterns() else []
+                scheduled = True
+                self.scheduler.record_commands(self.imap_commands - commands_before, time.time())
+                commands_before = self.imap_commands
+                if due or selected:
+                    logger.info(f"Probed {len(due)} mailboxes, {len(selected)} changed")
+            reloaded = False
+            
+            if scheduled and not selected:
+                result = 'unchanged'
+                self.write_metrics()
+            elif self.profiler.cycles_left > 0:
+                result = self.profiler.run(self.run_once, selected)
+            else:
+                result = self.run_once(selected)
+            
+            if self.adaptive_polling:
+                now = time.time()
+                self.scheduler.record_commands(self.imap_commands - commands_before, now)
+                self.scheduler.configure(self.poll_min_interval, self.poll_max_interval, self.imap_command_budget)
+                self.scheduler.set_mailboxes(self.mailboxes)
+                self.scheduler.plan(now)
+                for mailbox, state in self.scheduler.mailboxes.items():
+                    metrics.REGISTRY.set('imap2rss_poll_interval_seconds', state['interval'], {'mailbox': mailbox})
+                    metrics.REGISTRY.set('imap2rss_mailbox_arrival_rate', self.scheduler.rate(mailbox) * 3600,
+                                         {'mailbox': mailbox})
+                try:
+                    refresh.write_json(schedule_path, self.scheduler.snapshot(now))
+                except OSError as e:
+                    logger.error(f"Failed to save poll schedule: {e}")
+            if request:
+                last_request_id = max(last_request_id, request['id'])
+            refresh.write_status(self.data_dir, {
+                'request_id': last_request_id,
+                'result': result,
+                'mailboxes': mailboxes or self.mailboxes,
+                'completed_at': time.time()
+            })
+            
+            # The remaining cycles of a profile capture follow immediately; .env is checked every few seconds
+            now = time.time()
+            if self.profiler.cycles_left > 0:
+                deadline = now
+            elif self.adaptive_polling:
+                deadline = self.scheduler.next_due(now) + random.uniform(0, self.schedule_jitter * self.poll_min_interval)
+            else:
+                fixed_schedule.configure(self.check_interval, self.schedule_jitter, now)
+                skipped = fixed_schedule.advance(now)
+                if skipped:
+                    logger.warning(f"Cycle overran {skipped} scheduled starts, skipping them")
+                    metrics.REGISTRY.inc('imap2rss_cycles_skipped_total', value=skipped)
+                deadline = fixed_schedule.next_run()
+            triggered = False
+            while not triggered:
+                triggered = wake.wait(max(0, min(deadline - time.time(), ENV_CHECK_INTERVAL)))
+                current_mtime = envfile.mtime()
+                if current_mtime != env_mtime or reload_signalled.is_set():
+                    env_mtime = current_mtime
+                    reload_signalled.clear()
+                    if self.reload_config():
+                        # Sync right away with the new settings, e.g. to pick up added mailboxes
+                        reloaded = True
+                        break
+                    triggered = wake.is_set()
+                if time.time() >= deadline:
+                    break
+            wake.clear()
+            if triggered:
+                time.sleep(max(0, started + self.refresh_min_interval - time.time()))
 
 if __name__ == "__main__":
     converter = ImapToRss()
     
     # Check if running as daemon
-    if os.getenv('RUN_MODE', 'daemon') == 'daemon':
+    run_mode = os.getenv('RUN_MODE', 'daemon')
+    if run_mode == 'daemon':
         converter.run_daemon()
+    elif run_mode == 'combined':
+        # Converter and HTTP server in one process
+        import server
+        server.run_server(converter)
     else:
         converter.run_once()
\ No newline at end of file
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the body-processing hot path against stored baselines
+
+Measures throughput (MB/s of input) and memory (peak traced bytes and blocks
+still allocated afterwards, from tracemalloc) of extract_body,
+clean_html_for_rss, decode_header and the html_to_text used for search
+indexing, over a synthetic corpus built in this file: large marketing HTML,
+deeply nested tables, inputs that make the sanitizing regexes backtrack, plain
+text, and multi-charset headers. Runs offline; results are printed as JSON.
+
+Exits with status 1 when a measurement is slower than its baseline by more than
+--max-slowdown, or uses more memory than --max-memory-growth allows. Baselines
+are scaled by a reference workload timed in the same run, so they roughly carry
+over between machines; record new ones with --update-baselines after an
+intended change.
+"""
+
+import argparse
+import base64
+import email
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DEFAULT_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'body_baselines.json')
+
+WORDS = ("sale offer limited exclusive discount members free shipping today only new collection "
+         "unsubscribe preferences privacy policy view online account order invoice").split()
+
+def marketing_html(rng, blocks=120):
+    """Newsletter-style HTML: inline styles, layout tables, tracking links and images"""
+    rows = []
+    for index in range(blocks):
+        text = ' '.join(rng.choice(WORDS) for _ in range(30))
+        rows.append(
+            f'<tr><td align="center" bgcolor="#f4f4f4" style="padding: 20px 30px; font-family: Helvetica, Arial;" '
+            f'width="600" height="80"><table border="0" cellpadding="0" cellspacing="0" width="100%">'
+            f'<tr><td style="color:#333333;font-size:16px;line-height:24px">'
+            f'<span style="font-weight:bold">{text}</span> &amp; more &ndash; &euro;{index},99</td></tr>'
+            f'<tr><td><a href="https://click.example.com/track?u={index}&amp;id={rng.getrandbits(64):x}" '
+            f'target="_blank" style="background:#e91e63;color:#fff;border-radius:4px" class="btn">Shop now</a>'
+            f'<img src="https://img.example.com/{index}.png" width="600" height="200" border="0" '
+            f'style="display:block" alt="Product {index}"></td></tr></table></td></tr>')
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><style>'
+            f'{"td { padding: 0 } " * 200}</style></head><body style="margin:0">'
+            f'<div style="display:none">preheader</div><table width="100%" bgcolor="#ffffff">'
+            f'{"".join(rows)}</table><script>track()</script></body></html>')
+
+def nested_tables(depth=300):
+    """Tables nested hundreds deep, each with presentational attributes"""
+    opening = '<table border="1" cellpadding="2" style="width:100%"><tr><td bgcolor="#eee" style="padding:1px">' * depth
+    closing = '</td></tr></table>' * depth
+    return opening + '<p>innermost cell</p>' + closing
+
+def build_corpus():
+    """Named inputs and the functions each one exercises"""
+    rng = random.Random(42)
+    marketing = marketing_html(rng)
+    plain = '\n\n'.join(' '.join(rng.choice(WORDS) for _ in range(60)) for _ in range(400))
+
+    message = MIMEMultipart('alternative')
+    message['Subject'] = 'Weekly offers'
+    message['From'] = 'Shop <news@example.com>'
+    message.attach(MIMEText(plain, 'plain', 'utf-8'))
+    message.attach(MIMEText(marketing, 'html', 'utf-8'))
+
+    headers = [
+        str(Header('Prix réduits sur toute la collection été', 'iso-8859-1')),
+        str(Header('Специальное предложение для участников клуба', 'koi8-r')),
+        str(Header('本日限定のお知らせとクーポンのご案内', 'iso-2022-jp')),
+        str(Header('Ihre Bestellbestätigung für Größe XL', 'utf-8')),
+        '=?utf-8?B?' + base64.b64encode('😀 Ofertas exclusivas só hoje'.encode('utf-8')).decode('ascii') + '?=',
+        '"Müller, Jürgen" <j@example.com>, =?windows-1252?Q?Caf=E9?= <cafe@example.com>',
+        '=?unknown-8bit?Q?broken=FF?= plain tail',
+    ] * 20
+
+    html_functions = ('clean_html_for_rss', 'html_to_text')
+    return {
+        'marketing_html': (marketing, html_functions),
+        'nested_tables': (nested_tables(), html_functions),
+        # Long runs the attribute-stripping regexes rescan from every position
+        'whitespace_run': ('<p>' + ' ' * 2000 + 'x</p>', html_functions),
+        'unclosed_img': ('<img src="a.png" ' + 'alt=x ' * 2000, html_functions),
+        'unclosed_link': ('<a ' + 'x' * 20000, html_functions),
+        'plain_text': (plain, ('html_to_text',)),
+        'multipart_message': (message.as_bytes(), ('extract_body',)),
+        'multi_charset_headers': (headers, ('decode_header',)),
+    }
+
+def make_functions():
+    """Callables under test, each taking one corpus input"""
+    import app
+    import store
+    # The body methods need no IMAP settings or data directory
+    converter = app.ImapToRss.__new__(app.ImapToRss)
+    converter.trace = None
+    return {
+        'clean_html_for_rss': converter.clean_html_for_rss,
+        'html_to_text': store.html_to_text,
+        'extract_body': lambda raw: converter.extract_body(email.message_from_bytes(raw)),
+        'decode_header': lambda headers: [converter.decode_header(header) for header in headers],
+    }
+
+def input_size(value):
+    if isinstance(value, list):
+        return sum(len(item.encode('utf-8')) for item in value)
+    return len(value if isinstance(value, bytes) else value.encode('utf-8'))
+
+def measure(function, value, min_time, rounds):
+    """Best throughput over several rounds, then memory of a single call"""
+    best = None
+    for _ in range(rounds):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            function(value)
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        per_call = elapsed / calls
+        best = per_call if best is None else min(best, per_call)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = function(value)
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    del result
+
+    return {
+        'mb_per_s': round(input_size(value) / best / 1e6, 3),
+        'seconds_per_call': round(best, 6),
+        'peak_bytes': peak,
+        'retained_blocks': retained
+    }
+
+def calibrate(min_time, rounds):
+    """Time a fixed regex and string workload, used to cancel out the speed of the machine"""
+    import re
+    text = ('<td style="padding:4px">' + 'word ' * 40 + '</td>') * 200
+    def workload(value):
+        return re.sub(r'<[^>]+>', ' ', value).split()
+    return measure(workload, text, min_time, rounds)['seconds_per_call']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--baselines', default=DEFAULT_BASELINES)
+    parser.add_argument('--update-baselines', action='store_true', help='Record this run as the new baselines')
+    parser.add_argument('--max-slowdown', type=float, default=2.0,
+                        help='Fail when a function is this many times slower than its baseline')
+    parser.add_argument('--max-memory-growth', type=float, default=1.25,
+                        help='Fail when peak memory exceeds the baseline by this factor')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds per measurement round')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--case', action='append', help='Only run these corpus entries')
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+    functions = make_functions()
+    corpus = build_corpus()
+
+    calibration = calibrate(args.min_time, args.rounds)
+    results = {}
+    for case, (value, names) in corpus.items():
+        if args.case and case not in args.case:
+            continue
+        for name in names:
+            results[f"{case}/{name}"] = dict(measure(functions[name], value, args.min_time, args.rounds),
+                                             input_bytes=input_size(value))
+
+    if args.update_baselines:
+        with open(args.baselines, 'w', encoding='utf-8') as f:
+            json.dump({'calibration_seconds': calibration, 'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(json.dumps({'results': results, 'baselines_updated': args.baselines}, indent=2))
+        return
+
+    try:
+        with open(args.baselines, 'r', encoding='utf-8') as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {'calibration_seconds': calibration, 'results': {}}
+
+    # A machine running the reference workload slower is expected to be slower everywhere
+    speed_factor = calibration / baselines['calibration_seconds']
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines['results'].get(key)
+        if baseline is None:
+            continue
+        slowdown = baseline['mb_per_s'] / result['mb_per_s'] / speed_factor
+        result['slowdown'] = round(slowdown, 2)
+        if slowdown > args.max_slowdown:
+            regressions.append(f"{key}: {slowdown:.2f}x slower than baseline")
+        # Small absolute slack so tiny inputs do not fail on allocator noise
+        if result['peak_bytes'] > baseline['peak_bytes'] * args.max_memory_growth + 65536:
+            regressions.append(f"{key}: peak memory {result['peak_bytes']} > baseline {baseline['peak_bytes']}")
+
+    print(json.dumps({'speed_factor': round(speed_factor, 2), 'results': results, 'regressions': regressions}, indent=2))
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
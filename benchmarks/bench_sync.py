@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+End-to-end sync benchmark: ImapToRss.run_once against a local fake IMAP server
+
+Builds synthetic mailboxes, then runs a cold cycle on an empty data directory,
+a cycle with nothing new, and a cycle after new messages arrive. For each cycle
+it reports wall time, the phase timings from data/cycle_stats.jsonl, IMAP round
+trips and bytes transferred, and memory. Results are printed as JSON.
+
+Runs in a temporary working directory, so it must not be run inside the
+container, where the converter always uses /app/data. With --certfile the fake
+server uses TLS and the certificate is trusted through SSL_CERT_FILE; it must be
+valid for 127.0.0.1.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_imap
+
+def run_cycle(converter, server, label, trace_memory):
+    """Run one sync cycle and collect its measurements"""
+    import cycle_stats
+    server.reset_stats()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = converter.run_once()
+    elapsed = time.perf_counter() - started
+    peak_traced = None
+    if trace_memory:
+        peak_traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stats = server.stats
+    record = cycle_stats.read_latest(converter.data_dir) or {}
+    return {
+        'cycle': label,
+        'result': result,
+        'seconds': round(elapsed, 4),
+        'phases': record.get('phases', {}),
+        'messages_fetched': record.get('messages_fetched'),
+        'imap_connections': stats['connections'],
+        'imap_round_trips': stats['commands'],
+        'imap_commands': stats['by_command'],
+        'bytes_from_server': stats['bytes_sent'],
+        'bytes_to_server': stats['bytes_received'],
+        'peak_traced_bytes': peak_traced,
+        # ru_maxrss is in KiB on Linux and only ever grows
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000, help='Total messages, split across the folders')
+    parser.add_argument('--folders', type=int, default=5)
+    parser.add_argument('--html-ratio', type=float, default=0.7, help='Share of messages with an HTML part')
+    parser.add_argument('--attachment-size', type=int, default=0, help='Bytes attached to every tenth message')
+    parser.add_argument('--max-emails', type=int, default=50, help='MAX_EMAILS for the converter')
+    parser.add_argument('--feed-mode', choices=('combined', 'separate'), default='combined')
+    parser.add_argument('--new-messages', type=int, default=10, help='Messages delivered before the last cycle')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay per IMAP command')
+    parser.add_argument('--trace-memory', action='store_true', help='Report peak Python allocations (slows cycles)')
+    parser.add_argument('--certfile', help='Serve IMAP over TLS with this certificate')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--output', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    if os.path.exists('/app/data'):
+        parser.error("/app/data exists; run the benchmark outside the container")
+
+    setup_started = time.perf_counter()
+    mailboxes = fake_imap.build_mailboxes(args.messages, args.folders, args.html_ratio, args.attachment_size)
+    server = fake_imap.start_server(mailboxes, latency=args.latency, certfile=args.certfile, keyfile=args.keyfile)
+    setup_seconds = time.perf_counter() - setup_started
+
+    os.chdir(tempfile.mkdtemp(prefix='imap2rss-bench-'))
+    os.environ.update({
+        'EMAIL_USER': 'bench@example.com',
+        'EMAIL_PASS': 'bench',
+        'EMAIL_PROVIDER': 'custom',
+        'IMAP_SERVER': '127.0.0.1',
+        'IMAP_PORT': str(server.server_address[1]),
+        'IMAP_SSL': 'true' if args.certfile else 'false',
+        'MAILBOXES': ','.join(mailbox.name for mailbox in mailboxes),
+        'MAX_EMAILS': str(args.max_emails),
+        'FEED_MODE': args.feed_mode,
+        'WEBSUB_ENABLED': 'false'
+    })
+    if args.certfile:
+        os.environ['SSL_CERT_FILE'] = args.certfile
+
+    # Per-message logging would dominate the measurement
+    logging.disable(logging.WARNING)
+    import app
+
+    cycles = []
+    converter = app.ImapToRss()
+    cycles.append(run_cycle(converter, server, 'cold', args.trace_memory))
+    # A fresh converter, as after a restart, with nothing new on the server
+    converter = app.ImapToRss()
+    cycles.append(run_cycle(converter, server, 'unchanged', args.trace_memory))
+    for index in range(args.new_messages):
+        mailbox = mailboxes[index % len(mailboxes)]
+        raw = fake_imap.build_message(fake_imap.random.Random(index), args.messages + index, mailbox.name,
+                                      args.html_ratio, args.attachment_size)
+        mailbox.append(raw)
+    cycles.append(run_cycle(converter, server, 'incremental', args.trace_memory))
+    server.shutdown()
+
+    result = {
+        'messages': sum(len(mailbox.messages) for mailbox in mailboxes),
+        'folders': len(mailboxes),
+        'max_emails': args.max_emails,
+        'feed_mode': args.feed_mode,
+        'latency_s': args.latency,
+        'tls': bool(args.certfile),
+        'setup_seconds': round(setup_seconds, 2),
+        'cycles': cycles
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
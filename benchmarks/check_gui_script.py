@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Check that the JavaScript of the rendered configuration page parses
+
+Renders the GUI's configuration page without starting a server, extracts its
+<script> blocks and runs `node --check` on them. Python string escapes in the
+page template (a newline written as \\n instead of \\\\n) otherwise end up
+inside JavaScript string literals and break the whole page script. Exits with
+status 1 when a script does not parse; requires node on the PATH.
+"""
+
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def render_config_page():
+    """HTML of the configuration page, as the GUI serves it"""
+    import logging
+    logging.disable(logging.WARNING)
+    import config_gui
+    handler = config_gui.ConfigHandler.__new__(config_gui.ConfigHandler)
+    handler.wfile = io.BytesIO()
+    handler.request_version = 'HTTP/1.1'
+    handler.requestline = 'GET / HTTP/1.1'
+    handler.command = 'GET'
+    handler.path = '/'
+    handler.client_address = ('127.0.0.1', 0)
+    handler.serve_config_page()
+    response = handler.wfile.getvalue().decode('utf-8')
+    return response.split('\r\n\r\n', 1)[1]
+
+def main():
+    scripts = re.findall(r'<script>(.*?)</script>', render_config_page(), re.DOTALL)
+    if not scripts:
+        print("No <script> found in the configuration page")
+        sys.exit(1)
+    failed = False
+    for index, script in enumerate(scripts):
+        with tempfile.NamedTemporaryFile('w', suffix='.js', delete=False, encoding='utf-8') as f:
+            f.write(script)
+        try:
+            result = subprocess.run(['node', '--check', f.name], capture_output=True, text=True)
+        finally:
+            os.remove(f.name)
+        if result.returncode != 0:
+            failed = True
+            print(f"Script {index + 1} does not parse:\n{result.stderr}")
+    if failed:
+        sys.exit(1)
+    print(f"{len(scripts)} scripts parse")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Check the WebSub hub against a local stand-in subscriber
+
+Renders a mailbox feed with the converter, subscribes a stand-in subscriber
+to the topic in the feed's rel="self" link, then publishes the feed the way
+the converter does and checks that the subscriber is pushed the content with a
+valid signature. Also checks that publish pings from other hosts are refused
+without the shared token and that loopback callbacks are refused unless
+private callbacks are allowed. Exits with status 1 when a check fails.
+
+Runs in a temporary working directory, so it must not be run inside the
+container, where the converter always uses /app/data.
+"""
+
+import hashlib
+import hmac
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SECRET = 'stand-in-secret'
+REMOTE_HOST = '203.0.113.5'
+
+class Subscriber(BaseHTTPRequestHandler):
+    """Echoes verification challenges and records the content pushed to it"""
+
+    verified = []
+    pushed = []
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        self.verified.append(params)
+        content = params.get('hub.challenge', [''])[0].encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        self.pushed.append((dict(self.headers), body))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def main():
+    import logging
+    logging.disable(logging.WARNING)
+    os.chdir(tempfile.mkdtemp(prefix='check_websub_'))
+    os.makedirs('data')
+    os.environ.update(EMAIL_USER='check', EMAIL_PASS='check', BASE_URL='http://feeds.example', WEBSUB_ENABLED='true')
+    import app
+    from websub import WebSubHub
+
+    subscriber = HTTPServer(('127.0.0.1', 0), Subscriber)
+    threading.Thread(target=subscriber.serve_forever, daemon=True).start()
+    callback = f"http://127.0.0.1:{subscriber.server_address[1]}/callback"
+
+    converter = app.ImapToRss()
+    mailbox = 'Newsletters/Café'
+    feed_name = converter.normalize_filename(mailbox)
+    with open(os.path.join('data', f"{feed_name}.xml"), 'w', encoding='utf-8') as f:
+        f.write(converter.generate_mailbox_rss(mailbox, []))
+    with open(os.path.join('data', f"{feed_name}.xml"), 'r', encoding='utf-8') as f:
+        topic = re.search(r'<atom:link href="([^"]+)" rel="self"', f.read()).group(1)
+
+    failures = []
+    def check(name, passed):
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+        if not passed:
+            failures.append(name)
+
+    hub = WebSubHub('data', 'http://feeds.example/hub', timeout=5, allow_private_callbacks=True)
+    status, _ = hub.handle({'hub.mode': ['subscribe'], 'hub.topic': [topic], 'hub.callback': [callback],
+                            'hub.secret': [SECRET]}, REMOTE_HOST)
+    check("subscribe to the feed's self link is accepted", status == 202)
+    check("subscriber intent is verified", wait_until(lambda: hub.subscriptions))
+
+    status, _ = hub.handle({'hub.mode': ['publish'], 'hub.url': [topic]}, REMOTE_HOST)
+    check("publish from another host is refused", status == 403)
+    check("nothing is pushed for a refused publish", not wait_until(lambda: Subscriber.pushed, timeout=1))
+
+    converter.local_hub = hub
+    converter.publish_feeds([feed_name])
+    check("publishing the feed pushes it to the subscriber", wait_until(lambda: Subscriber.pushed))
+    if Subscriber.pushed:
+        headers, body = Subscriber.pushed[0]
+        signature = hmac.new(SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        check("pushed content is signed with the subscriber's secret", headers.get('X-Hub-Signature') == f"sha256={signature}")
+        check("pushed content is the feed", body.startswith(b'<?xml') and topic.encode('ascii') in body)
+
+    token_hub = WebSubHub('data', 'http://feeds.example/hub', publish_token='token', allow_private_callbacks=True)
+    publish = {'hub.mode': ['publish'], 'hub.url': [topic]}
+    check("publish without the token is refused", token_hub.handle(publish, '127.0.0.1')[0] == 403)
+    check("publish with the token is accepted", token_hub.handle(publish, REMOTE_HOST, 'Bearer token')[0] == 202)
+
+    Subscriber.verified.clear()
+    public_hub = WebSubHub('data', 'http://feeds.example/hub', timeout=5)
+    status, _ = public_hub.handle({'hub.mode': ['subscribe'], 'hub.topic': [topic], 'hub.callback': [callback]}, REMOTE_HOST)
+    check("loopback callback address is refused", status == 400)
+    named_callback = callback.replace('127.0.0.1', 'localhost')
+    status, _ = public_hub.handle({'hub.mode': ['subscribe'], 'hub.topic': [topic], 'hub.callback': [named_callback]}, REMOTE_HOST)
+    check("callback host resolving to loopback is never contacted",
+          status == 202 and not wait_until(lambda: Subscriber.verified, timeout=1)
+          and not any(named_callback in callbacks for callbacks in public_hub.subscriptions.values()))
+
+    subscriber.shutdown()
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Local IMAP4rev1 stand-in server serving synthetic mailboxes for benchmarks
+
+Implements the subset of IMAP the converter and the config GUI use (LIST with
+LIST-STATUS, SELECT, STATUS, SEARCH, FETCH and their UID forms) and counts
+commands and bytes per session. Run it standalone to point a converter at it,
+or import it as bench_sync.py does. TLS is used when --certfile is given.
+"""
+
+import argparse
+import email.policy
+import json
+import random
+import re
+import socketserver
+import ssl
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua invoice report weekly update release "
+         "newsletter offer account security meeting project deadline").split()
+
+def build_message(rng, index, mailbox, html_ratio, attachment_size):
+    """Build one synthetic email as raw bytes"""
+    msg = EmailMessage()
+    subject = ' '.join(rng.choice(WORDS) for _ in range(6))
+    msg['Subject'] = f"{subject} #{index}"
+    msg['From'] = f"Sender {index % 37} <sender{index % 37}@example.com>"
+    msg['To'] = "user@example.com"
+    sent = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=7 * index)
+    msg['Date'] = format_datetime(sent)
+    msg['Message-ID'] = f"<{index}.{mailbox.replace('/', '.')}@example.com>"
+
+    paragraphs = [' '.join(rng.choice(WORDS) for _ in range(40)) for _ in range(rng.randint(3, 20))]
+    text = '\n\n'.join(paragraphs)
+    msg.set_content(text)
+
+    if rng.random() < html_ratio:
+        cells = ''.join(f'<tr><td style="padding:4px" width="600"><p class="x">{p}</p>'
+                        f'<a href="https://example.com/{index}/{n}" style="color:red">link</a></td></tr>'
+                        for n, p in enumerate(paragraphs))
+        html_body = (f'<html><head><style>p {{ color: red; }}</style></head><body>'
+                     f'<table border="0" cellpadding="0">{cells}</table>'
+                     f'<img src="cid:logo{index}@example.com" alt="logo"></body></html>')
+        msg.add_alternative(html_body, subtype='html')
+        html_part = msg.get_payload()[1]
+        html_part.add_related(b'\x89PNG\r\n\x1a\n' + rng.randbytes(256),
+                              maintype='image', subtype='png', cid=f"<logo{index}@example.com>")
+
+    if attachment_size and index % 10 == 0:
+        msg.add_attachment(rng.randbytes(attachment_size), maintype='application',
+                           subtype='octet-stream', filename=f"report-{index}.bin")
+
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+class Mailbox:
+    """A synthetic folder with messages addressed by sequence number and UID"""
+
+    def __init__(self, name, messages, uidvalidity):
+        self.name = name
+        self.messages = messages  # list of (uid, raw bytes)
+        self.uidvalidity = uidvalidity
+        self.lock = threading.Lock()
+
+    @property
+    def uidnext(self):
+        return self.messages[-1][0] + 1 if self.messages else 1
+
+    def append(self, raw):
+        with self.lock:
+            self.messages.append((self.uidnext, raw))
+
+def imap_quote(value):
+    if value is None:
+        return 'NIL'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def bodystructure(part):
+    """Render the BODYSTRUCTURE of a parsed message part"""
+    if part.is_multipart():
+        children = ''.join(bodystructure(child) for child in part.get_payload())
+        # Extension data (parameters, disposition, language), as real servers send it
+        boundary = part.get_boundary()
+        params = f"({imap_quote('BOUNDARY')} {imap_quote(boundary)})" if boundary else 'NIL'
+        return f"({children} {imap_quote(part.get_content_subtype().upper())} {params} NIL NIL)"
+
+    maintype = part.get_content_maintype().upper()
+    subtype = part.get_content_subtype().upper()
+    params = []
+    for key, value in part.get_params()[1:] if part.get_params() else []:
+        params.append(f"{imap_quote(key.upper())} {imap_quote(value)}")
+    params_str = f"({' '.join(params)})" if params else 'NIL'
+    cid = part.get('Content-ID')
+    encoding = (part.get('Content-Transfer-Encoding') or '7BIT').upper()
+    payload = part.get_payload(decode=False)
+    size = len(payload.encode('ascii', errors='replace')) if isinstance(payload, str) else 0
+
+    disposition = 'NIL'
+    if part.get_content_disposition():
+        filename = part.get_filename()
+        disp_params = f"({imap_quote('FILENAME')} {imap_quote(filename)})" if filename else 'NIL'
+        disposition = f"({imap_quote(part.get_content_disposition().upper())} {disp_params})"
+
+    fields = f"{imap_quote(maintype)} {imap_quote(subtype)} {params_str} {imap_quote(cid)} NIL {imap_quote(encoding)} {size}"
+    if maintype == 'TEXT':
+        fields += f" {payload.count(chr(10)) if isinstance(payload, str) else 0}"
+    fields += f" NIL {disposition} NIL NIL"
+    return f"({fields})"
+
+def find_part(message, section):
+    """Locate a part by IMAP section number (e.g. '1.2')"""
+    part = message
+    for number in section.split('.'):
+        index = int(number) - 1
+        if part.is_multipart():
+            part = part.get_payload()[index]
+        elif index == 0:
+            return part
+        else:
+            return None
+    return part
+
+def part_body_bytes(part):
+    """Raw (still transfer-encoded) body of a part, as IMAP BODY[n] returns it"""
+    raw = part.as_bytes(policy=email.policy.SMTP)
+    header_end = raw.find(b'\r\n\r\n')
+    return raw[header_end + 4:] if header_end >= 0 else raw
+
+def parse_sequence_set(spec, values):
+    """Resolve an IMAP sequence set against a sorted list of numbers"""
+    if not values:
+        return []
+    top = values[-1]
+    wanted = set()
+    selected = []
+    for chunk in spec.split(','):
+        if ':' in chunk:
+            low, high = chunk.split(':')
+            low = top if low == '*' else int(low)
+            high = top if high == '*' else int(high)
+            low, high = min(low, high), max(low, high)
+            selected.extend(v for v in values if low <= v <= high)
+        else:
+            number = top if chunk == '*' else int(chunk)
+            selected.extend(v for v in values if v == number)
+    result = []
+    for value in selected:
+        if value not in wanted:
+            wanted.add(value)
+            result.append(value)
+    return sorted(result)
+
+def tokenize(line):
+    """Split an IMAP command line into atoms, quoted strings and parenthesized lists"""
+    return re.findall(r'"(?:[^"\\]|\\.)*"|\([^)]*\)|\S+', line)
+
+def unquote(token):
+    if token.startswith('"') and token.endswith('"'):
+        return token[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return token
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    """One IMAP session"""
+
+    def setup(self):
+        super().setup()
+        self.selected = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bytes_sent += len(data)
+        self.wfile.write(data)
+
+    def handle(self):
+        server = self.server
+        with server.stats_lock:
+            server.stats['connections'] += 1
+        self.send("* OK [CAPABILITY IMAP4rev1 LIST-STATUS] Fake IMAP ready\r\n")
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                self.bytes_received += len(line)
+                line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if not line:
+                    continue
+                if server.latency:
+                    time.sleep(server.latency)
+                tag, _, rest = line.partition(' ')
+                command, _, args = rest.partition(' ')
+                command = command.upper()
+                with server.stats_lock:
+                    server.stats['commands'] += 1
+                    server.stats['by_command'][command] = server.stats['by_command'].get(command, 0) + 1
+                if command == 'UID':
+                    sub, _, args = args.partition(' ')
+                    command = 'UID ' + sub.upper()
+                if not self.dispatch(tag, command, args):
+                    break
+        finally:
+            with server.stats_lock:
+                server.stats['bytes_sent'] += self.bytes_sent
+                server.stats['bytes_received'] += self.bytes_received
+
+    def dispatch(self, tag, command, args):
+        if command == 'CAPABILITY':
+            self.send("* CAPABILITY IMAP4rev1 LIST-STATUS AUTH=PLAIN\r\n")
+        elif command == 'LOGIN':
+            pass
+        elif command == 'NOOP':
+            pass
+        elif command == 'LOGOUT':
+            self.send("* BYE Fake IMAP logging out\r\n")
+            self.send(f"{tag} OK LOGOUT completed\r\n")
+            return False
+        elif command == 'LIST':
+            self.do_list(args)
+        elif command in ('SELECT', 'EXAMINE'):
+            return self.do_select(tag, args)
+        elif command == 'STATUS':
+            return self.do_status(tag, args)
+        elif command == 'CLOSE':
+            self.selected = None
+        elif command in ('SEARCH', 'UID SEARCH'):
+            if not self.selected:
+                self.send(f"{tag} BAD No mailbox selected\r\n")
+                return True
+            self.do_search(command.startswith('UID'), args)
+        elif command in ('FETCH', 'UID FETCH'):
+            if not self.selected:
+                self.send(f"{tag} BAD No mailbox selected\r\n")
+                return True
+            self.do_fetch(command.startswith('UID'), args)
+        else:
+            self.send(f"{tag} BAD Unknown command\r\n")
+            return True
+        self.send(f"{tag} OK {command} completed\r\n")
+        return True
+
+    def status_items(self, mailbox, items):
+        values = {
+            'MESSAGES': len(mailbox.messages),
+            'UIDNEXT': mailbox.uidnext,
+            'UIDVALIDITY': mailbox.uidvalidity,
+            'UNSEEN': len(mailbox.messages),
+            'RECENT': 0
+        }
+        return ' '.join(f"{item} {values[item]}" for item in items if item in values)
+
+    def do_list(self, args):
+        match = re.search(r'RETURN \(STATUS \(([^)]*)\)\)', args, re.IGNORECASE)
+        status_items = match.group(1).upper().split() if match else None
+        for mailbox in self.server.mailboxes.values():
+            self.send(f'* LIST (\\HasNoChildren) "/" {imap_quote(mailbox.name)}\r\n')
+            if status_items:
+                self.send(f"* STATUS {imap_quote(mailbox.name)} ({self.status_items(mailbox, status_items)})\r\n")
+
+    def lookup(self, token):
+        return self.server.mailboxes.get(unquote(token))
+
+    def do_select(self, tag, args):
+        mailbox = self.lookup(args.strip())
+        if mailbox is None:
+            self.send(f"{tag} NO Mailbox does not exist\r\n")
+            return True
+        self.selected = mailbox
+        self.send(f"* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n")
+        self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n")
+        self.send(f"* OK [UIDNEXT {mailbox.uidnext}] Predicted next UID\r\n")
+        self.send(f"{tag} OK [READ-WRITE] SELECT completed\r\n")
+        return True
+
+    def do_status(self, tag, args):
+        tokens = tokenize(args)
+        mailbox = self.lookup(tokens[0])
+        if mailbox is None:
+            self.send(f"{tag} NO Mailbox does not exist\r\n")
+            return True
+        items = tokens[1].strip('()').upper().split()
+        self.send(f"* STATUS {imap_quote(mailbox.name)} ({self.status_items(mailbox, items)})\r\n")
+        self.send(f"{tag} OK STATUS completed\r\n")
+        return True
+
+    def do_search(self, by_uid, args):
+        messages = self.selected.messages
+        tokens = args.upper().split()
+        numbers = list(range(1, len(messages) + 1))
+        if 'UID' in tokens:
+            uid_spec = tokens[tokens.index('UID') + 1]
+            uids = parse_sequence_set(uid_spec, [uid for uid, _ in messages])
+            wanted = set(uids)
+            numbers = [n for n in numbers if messages[n - 1][0] in wanted]
+        elif tokens and tokens[0] not in ('ALL', 'CHARSET') and re.match(r'^[\d:*,]+$', tokens[0]):
+            numbers = parse_sequence_set(tokens[0], numbers)
+        results = [str(messages[n - 1][0]) if by_uid else str(n) for n in numbers]
+        self.send(f"* SEARCH {' '.join(results)}\r\n")
+
+    def do_fetch(self, by_uid, args):
+        spec, _, items = args.partition(' ')
+        items = items.strip()
+        if items.startswith('(') and items.endswith(')'):
+            items = items[1:-1]
+        item_list = re.findall(r'BODY(?:\.PEEK)?\[[^\]]*\](?:<[\d.]+>)?|\S+', items, re.IGNORECASE)
+        item_list = [item.upper() for item in item_list]
+        if by_uid and 'UID' not in item_list:
+            item_list.insert(0, 'UID')
+
+        messages = self.selected.messages
+        if by_uid:
+            wanted = set(parse_sequence_set(spec, [uid for uid, _ in messages]))
+            numbers = [n for n in range(1, len(messages) + 1) if messages[n - 1][0] in wanted]
+        else:
+            numbers = parse_sequence_set(spec, list(range(1, len(messages) + 1)))
+
+        for number in numbers:
+            uid, raw = messages[number - 1]
+            parsed = None
+            pieces = []
+            for item in item_list:
+                if item == 'UID':
+                    pieces.append(f"UID {uid}".encode())
+                elif item == 'FLAGS':
+                    pieces.append(b"FLAGS ()")
+                elif item == 'RFC822.SIZE':
+                    pieces.append(f"RFC822.SIZE {len(raw)}".encode())
+                elif item == 'INTERNALDATE':
+                    pieces.append(b'INTERNALDATE "01-Jan-2024 00:00:00 +0000"')
+                elif item in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+                    name = 'RFC822' if item == 'RFC822' else 'BODY[]'
+                    pieces.append(f"{name} {{{len(raw)}}}\r\n".encode() + raw)
+                elif item in ('BODYSTRUCTURE', 'BODY'):
+                    if parsed is None:
+                        parsed = email.message_from_bytes(raw, policy=email.policy.default)
+                    pieces.append(f"BODYSTRUCTURE {bodystructure(parsed)}".encode())
+                elif item.startswith('BODY'):
+                    section = item[item.index('[') + 1:item.index(']')]
+                    if parsed is None:
+                        parsed = email.message_from_bytes(raw, policy=email.policy.default)
+                    data = self.section_bytes(raw, parsed, section)
+                    pieces.append(f"BODY[{section}] {{{len(data)}}}\r\n".encode() + data)
+            self.send(f"* {number} FETCH (".encode() + b" ".join(pieces) + b")\r\n")
+
+    def section_bytes(self, raw, parsed, section):
+        header_end = raw.find(b'\r\n\r\n')
+        if section in ('HEADER', 'HEADER.FIELDS'):
+            return raw[:header_end + 4]
+        if section == 'TEXT':
+            return raw[header_end + 4:]
+        if section.startswith('HEADER.FIELDS'):
+            return raw[:header_end + 4]
+        part = find_part(parsed, section)
+        if part is None:
+            return b''
+        if part is parsed and not parsed.is_multipart():
+            return raw[header_end + 4:]
+        return part_body_bytes(part)
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """IMAP server over a fixed set of mailboxes, with optional per-command latency"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, mailboxes, latency=0.0, ssl_context=None):
+        self.mailboxes = {mailbox.name: mailbox for mailbox in mailboxes}
+        self.latency = latency
+        self.ssl_context = ssl_context
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+        super().__init__(address, FakeImapHandler)
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'connections': 0, 'commands': 0, 'bytes_sent': 0,
+                          'bytes_received': 0, 'by_command': {}}
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+def build_mailboxes(messages, folders, html_ratio=0.7, attachment_size=0, seed=1):
+    """Create synthetic folders sharing a total message count"""
+    rng = random.Random(seed)
+    names = ['INBOX'] + [f"Newsletters/Folder{n}" for n in range(1, folders)]
+    per_folder = max(1, messages // len(names))
+    mailboxes = []
+    for folder_index, name in enumerate(names):
+        raw_messages = [(uid, build_message(rng, uid + folder_index * per_folder, name, html_ratio, attachment_size))
+                        for uid in range(1, per_folder + 1)]
+        mailboxes.append(Mailbox(name, raw_messages, uidvalidity=1000 + folder_index))
+    return mailboxes
+
+def start_server(mailboxes, host='127.0.0.1', port=0, latency=0.0, certfile=None, keyfile=None):
+    """Start the fake server in a background thread and return it"""
+    ssl_context = None
+    if certfile:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(certfile, keyfile)
+    server = FakeImapServer((host, port), mailboxes, latency=latency, ssl_context=ssl_context)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=1143)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--folders', type=int, default=5)
+    parser.add_argument('--html-ratio', type=float, default=0.7)
+    parser.add_argument('--attachment-size', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay per command')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+
+    mailboxes = build_mailboxes(args.messages, args.folders, args.html_ratio, args.attachment_size)
+    server = start_server(mailboxes, port=args.port, latency=args.latency,
+                          certfile=args.certfile, keyfile=args.keyfile)
+    print(json.dumps({'port': server.server_address[1], 'folders': [m.name for m in mailboxes]}))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Load test for the RSS HTTP server: many concurrent keep-alive pollers plus slow clients
+
+Without --url, a server is started in-process on a temporary data directory
+holding a synthetic feed. Results are printed as JSON.
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def write_synthetic_feed(data_dir, items):
+    """Render a feed of synthetic emails with the converter's own generator"""
+    import feedgen
+    rss, channel = feedgen.create_channel("Load test", "Synthetic feed", "http://localhost:8888/feed.xml",
+                                          "IMAP to RSS Converter")
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for index in range(items):
+        email_data = {
+            'id': f"item-{index}",
+            'subject': f"Synthetic message {index}",
+            'sender': f"sender{index % 17}@example.com",
+            'date': start + timedelta(minutes=index),
+            'body': "<p>" + "lorem ipsum dolor sit amet " * 120 + "</p>",
+            'mailbox': 'INBOX'
+        }
+        title, description = feedgen.format_combined_item(email_data)
+        feedgen.add_item(channel, email_data, title, description)
+    content = feedgen.to_pretty_xml(rss).encode('utf-8')
+    with open(os.path.join(data_dir, 'feed.xml'), 'wb') as f:
+        f.write(content)
+    return len(content)
+
+def start_local_server(workers, items):
+    """Start server.py's server on a free port, serving a temporary ./data directory"""
+    work_dir = tempfile.mkdtemp(prefix='imap2rss-load-')
+    data_dir = os.path.join(work_dir, 'data')
+    os.makedirs(data_dir)
+    feed_size = write_synthetic_feed(data_dir, items)
+    os.chdir(work_dir)
+
+    import server
+    # Per-request access logging would dominate the measurement
+    logging.getLogger('server').setLevel(logging.CRITICAL)
+
+    httpd = server.create_server(('127.0.0.1', 0), workers)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}", feed_size
+
+def slow_client(host, port, stop, hold_seconds):
+    """Open connections and trickle a request one byte at a time"""
+    request = b"GET /feed.xml HTTP/1.1\r\nHost: localhost\r\n\r\n"
+    while not stop.is_set():
+        try:
+            sock = socket.create_connection((host, port), timeout=30)
+            for byte in request[:-2]:
+                if stop.is_set():
+                    break
+                sock.send(bytes([byte]))
+                time.sleep(hold_seconds / len(request))
+            sock.close()
+        except OSError:
+            time.sleep(0.1)
+
+def poller(host, port, path, headers, conditional, stop, latencies, errors, statuses, served, lock):
+    """Poll a feed over one keep-alive connection, reconnecting when the server closes it"""
+    connection = None
+    completed = 0
+    headers = dict(headers)
+    while not stop.is_set():
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(host, port, timeout=30)
+            started = time.perf_counter()
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if conditional and response.getheader('ETag'):
+                headers['If-None-Match'] = response.getheader('ETag')
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status in (200, 304):
+                    latencies.append(elapsed)
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                    if not completed:
+                        served.append(threading.get_ident())
+                    completed += 1
+                else:
+                    errors.append(response.status)
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException) as e:
+            with lock:
+                errors.append(type(e).__name__)
+            if connection is not None:
+                connection.close()
+            connection = None
+            time.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Base URL of a running server (default: start one in-process)')
+    parser.add_argument('--path', default='/feed.xml')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--slow-clients', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=32, help='Worker threads for the in-process server (0 = single-threaded)')
+    parser.add_argument('--items', type=int, default=50, help='Items in the synthetic feed')
+    parser.add_argument('--gzip', action='store_true', help='Send Accept-Encoding: gzip')
+    parser.add_argument('--conditional', action='store_true', help='Revalidate with If-None-Match like a polling reader')
+    args = parser.parse_args()
+
+    feed_size = None
+    if args.url:
+        base_url = args.url
+    else:
+        _, base_url, feed_size = start_local_server(args.workers, args.items)
+
+    target = urlparse(base_url)
+    headers = {'Accept-Encoding': 'gzip'} if args.gzip else {}
+    stop = threading.Event()
+    latencies, errors, served, lock = [], [], [], threading.Lock()
+    statuses = {}
+
+    threads = [threading.Thread(target=slow_client, args=(target.hostname, target.port, stop, 5.0), daemon=True)
+               for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=poller, args=(target.hostname, target.port, args.path, headers, args.conditional,
+                                                      stop, latencies, errors, statuses, served, lock), daemon=True)
+                for _ in range(args.clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    elapsed = time.time() - started
+
+    result = {
+        'clients': args.clients,
+        'slow_clients': args.slow_clients,
+        'workers': None if args.url else args.workers,
+        'duration_s': round(elapsed, 2),
+        'feed_bytes': feed_size,
+        'clients_served': len(served),
+        'requests': len(latencies),
+        'not_modified': statuses.get(304, 0),
+        'errors': len(errors),
+        'error_kinds': sorted(set(map(str, errors))),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            'p90': round(percentile(latencies, 0.90) * 1000, 2) if latencies else None,
+            'p99': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+            'max': round(max(latencies) * 1000, 2) if latencies else None
+        }
+    }
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache for email attachments and inline images
+"""
+
+import os
+import hashlib
+import threading
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class BlobCache:
+    """Stores blobs by SHA-256 and evicts the least recently used beyond a size budget"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in self.scan())
+
+    def scan(self):
+        """Iterate over stored blob files"""
+        for shard in os.scandir(self.directory):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        yield entry
+
+    def path(self, digest: str) -> str:
+        """Location of a blob, sharded by the first two hex digits"""
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, digest: str) -> Optional[str]:
+        """Return the path of a cached blob, marking it as recently used"""
+        blob_path = self.path(digest)
+        try:
+            os.utime(blob_path)
+        except OSError:
+            return None
+        return blob_path
+
+    def put(self, data: bytes) -> str:
+        """Store a blob and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.path(digest)
+        with self.lock:
+            if os.path.exists(blob_path):
+                os.utime(blob_path)
+                return digest
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f"{blob_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+            self.total_bytes += len(data)
+            self.evict(keep=digest)
+        return digest
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used blobs until the cache fits its budget"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        entries = sorted(self.scan(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            logger.info(f"Evicted blob {entry.name} ({size} bytes)")
@@ -3,15 +3,19 @@
 Web GUI for IMAP to RSS configuration with multiple email providers
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from html import escape
 import json
 import os
 import urllib.parse
 import logging
 from datetime import datetime
-import imaplib
 import base64
 import re
+import cycle_stats
+import profiling
+import refresh
+import discovery
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -62,6 +66,9 @@ def decode_imap_utf7(s):
         logger.debug(f"Failed to decode IMAP UTF-7: {s} -> {e}")
         return s  # Return original string if decode fails
 
+# Folder listings run in the background and are cached per account
+DISCOVERY = discovery.MailboxDiscovery(cache_ttl=int(os.getenv('DISCOVERY_CACHE_TTL', '600')))
+
 class ConfigHandler(BaseHTTPRequestHandler):
     
     # Email provider configurations
@@ -70,30 +77,35 @@ class ConfigHandler(BaseHTTPRequestHandler):
             'name': 'Gmail',
             'server': 'imap.gmail.com',
             'port': 993,
+            'ssl': True,
             'instructions': 'Gmail: Enable IMAP in settings + Use app password (not regular password). See complete guide.'
         },
         'outlook': {
             'name': 'Outlook/Hotmail',
             'server': 'outlook.office365.com', 
             'port': 993,
+            'ssl': True,
             'instructions': 'Use your regular password or app password if you have 2FA enabled'
         },
         'yahoo': {
             'name': 'Yahoo Mail',
             'server': 'imap.mail.yahoo.com',
             'port': 993,
+            'ssl': True,
             'instructions': 'Use an app password. Go to: Settings → Account Security → Generate app password'
         },
         'zoho': {
             'name': 'Zoho Mail',
             'server': 'imap.zoho.com',
             'port': 993,
+            'ssl': True,
             'instructions': 'Free Zoho does not support IMAP. Use paid plan or another provider'
         },
         'custom': {
             'name': 'Customizado',
             'server': '',
             'port': 993,
+            'ssl': True,
             'instructions': 'Configure your IMAP server manually'
         }
     }
@@ -103,6 +115,10 @@ class ConfigHandler(BaseHTTPRequestHandler):
             self.serve_config_page()
         elif self.path == '/status':
             self.serve_status_page()
+        elif self.path.startswith('/detect-mailboxes/'):
+            self.serve_discovery_progress()
+        elif self.path.startswith('/profiles/'):
+            self.serve_profile_download()
         elif self.path.startswith('/static/'):
             self.serve_static()
         else:
@@ -113,6 +129,8 @@ class ConfigHandler(BaseHTTPRequestHandler):
             self.save_configuration()
         elif self.path == '/detect-mailboxes':
             self.detect_mailboxes()
+        elif self.path == '/profile':
+            self.capture_profile()
         else:
             self.send_error(404)
     
@@ -264,7 +282,7 @@ class ConfigHandler(BaseHTTPRequestHandler):
                 <p><strong>1.</strong> Select your email provider</p>
                 <p><strong>2.</strong> Configure email and password</p>
                 <p><strong>3.</strong> Choose folders to monitor</p>
-                <p><strong>4.</strong> Save and restart: <code>docker-compose restart</code></p>
+                <p><strong>4.</strong> Save: changes are applied without a restart</p>
                 <p><strong>5.</strong> Access: <a href="http://localhost:8888/" target="_blank">View all feeds</a></p>
             </div>
             
@@ -321,6 +339,15 @@ class ConfigHandler(BaseHTTPRequestHandler):
                             <input type="number" id="imap_port" name="imap_port" value="{imap_port}" readonly>
                             <small>Default SSL port (993)</small>
                         </div>
+                        
+                        <div class="form-group">
+                            <label for="imap_ssl">IMAP SSL</label>
+                            <select id="imap_ssl" name="imap_ssl">
+                                <option value="true" {ssl_selected}>SSL/TLS</option>
+                                <option value="false" {plain_selected}>None (port 143)</option>
+                            </select>
+                            <small>Use SSL unless your server only accepts plain connections</small>
+                        </div>
                     </div>
                     
                     <div class="form-group">
@@ -393,6 +420,9 @@ class ConfigHandler(BaseHTTPRequestHandler):
             if (providerInfo) {{
                 document.getElementById('imap_server').value = providerInfo.server;
                 document.getElementById('imap_port').value = providerInfo.port;
+                if (provider !== 'custom') {{
+                    document.getElementById('imap_ssl').value = String(providerInfo.ssl);
+                }}
                 document.getElementById('provider_instructions').textContent = providerInfo.instructions;
                 
                 // Show/hide Gmail checklist
@@ -417,12 +447,16 @@ class ConfigHandler(BaseHTTPRequestHandler):
                 const isCustom = provider === 'custom';
                 document.getElementById('imap_server').readOnly = !isCustom;
                 document.getElementById('imap_port').readOnly = !isCustom;
+                document.getElementById('imap_ssl').disabled = !isCustom;
             }}
         }}
         
         // Initialize on page load
         updateProviderSettings();
         
+        // Set after a cached result, so the next click asks the server for a fresh listing
+        let refreshDiscovery = false;
+        
         function detectMailboxes() {{
             const emailUser = document.getElementById('email_user').value;
             const emailPass = document.getElementById('email_pass').value;
@@ -442,30 +476,55 @@ class ConfigHandler(BaseHTTPRequestHandler):
             formData.append('email_user', emailUser);
             formData.append('email_pass', emailPass);
             formData.append('email_provider', emailProvider);
+            formData.append('imap_server', document.getElementById('imap_server').value);
+            formData.append('imap_port', document.getElementById('imap_port').value);
+            formData.append('imap_ssl', document.getElementById('imap_ssl').value);
+            if (refreshDiscovery) {{
+                formData.append('refresh', '1');
+            }}
             
-            fetch('/detect-mailboxes', {{
-                method: 'POST',
-                headers: {{
-                    'Content-Type': 'application/x-www-form-urlencoded'
-                }},
-                body: formData
-            }})
-            .then(response => response.json())
-            .then(data => {{
+            function finish(data) {{
                 button.textContent = originalText;
                 button.disabled = false;
                 
                 if (data.success) {{
+                    refreshDiscovery = data.cached;
                     document.getElementById('mailboxes').value = data.mailboxes.join(', ');
-                    alert(`✅ Found ${{data.mailboxes.length}} folders:\\n\\n${{data.mailboxes.join('\\n')}}`);
+                    const lines = data.folders.map(folder => folder.messages === null ? folder.name
+                        : `${{folder.name}} (${{folder.messages}} messages, ${{folder.unseen}} unread)`);
+                    const note = data.cached ? '\\n\\n(Cached result, click Detect again to refresh)' : '';
+                    alert(`✅ Found ${{data.count}} folders:\\n\\n${{lines.join('\\n')}}${{note}}`);
                 }} else {{
                     alert('❌ Error detecting folders: ' + data.error);
                 }}
+            }}
+            
+            // Detection runs in the background; poll its progress until it finishes
+            function poll(data) {{
+                if (!data.success || data.state !== 'running') {{
+                    finish(data);
+                    return;
+                }}
+                button.textContent = data.total ? `🔄 ${{data.step}} ${{data.done}}/${{data.total}}` : `🔄 ${{data.step}}...`;
+                setTimeout(() => {{
+                    fetch('/detect-mailboxes/' + data.job)
+                    .then(response => response.json())
+                    .then(poll)
+                    .catch(error => finish({{success: false, error: error}}));
+                }}, 500);
+            }}
+            
+            fetch('/detect-mailboxes', {{
+                method: 'POST',
+                headers: {{
+                    'Content-Type': 'application/x-www-form-urlencoded'
+                }},
+                body: formData
             }})
+            .then(response => response.json())
+            .then(poll)
             .catch(error => {{
-                button.textContent = originalText;
-                button.disabled = false;
-                alert('❌ Error: ' + error);
+                finish({{success: false, error: error}});
             }});
         }}
         
@@ -484,7 +543,11 @@ class ConfigHandler(BaseHTTPRequestHandler):
             .then(response => response.json())
             .then(data => {{
                 if (data.success) {{
-                    alert('✅ Configuration saved successfully!\\n\\nRestart the container to apply changes:\\ndocker-compose restart\\n\\nThen access: http://localhost:8888/');
+                    if (data.applied) {{
+                        alert('✅ Configuration saved and applied!\\n\\nThe converter picks up the changes without a restart.\\n\\nAccess: http://localhost:8888/');
+                    }} else {{
+                        alert('✅ Configuration saved successfully!\\n\\nRestart the container to apply changes:\\ndocker-compose restart\\n\\nThen access: http://localhost:8888/');
+                    }}
                 }} else {{
                     alert('❌ Error saving: ' + data.error);
                 }}
@@ -506,6 +569,8 @@ class ConfigHandler(BaseHTTPRequestHandler):
             email_pass=config.get('EMAIL_PASS', ''),
             imap_server=config.get('IMAP_SERVER', 'imap.gmail.com'),
             imap_port=config.get('IMAP_PORT', '993'),
+            ssl_selected='selected' if config.get('IMAP_SSL', 'true').lower() == 'true' else '',
+            plain_selected='selected' if config.get('IMAP_SSL', 'true').lower() != 'true' else '',
             mailboxes=config.get('MAILBOXES', 'INBOX'),
             combined_selected='selected' if config.get('FEED_MODE', 'combined') == 'combined' else '',
             separate_selected='selected' if config.get('FEED_MODE') == 'separate' else '',
@@ -521,7 +586,7 @@ class ConfigHandler(BaseHTTPRequestHandler):
         self.wfile.write(html.encode('utf-8'))
     
     def detect_mailboxes(self):
-        """Detect available mailboxes from IMAP server"""
+        """Start detecting the available mailboxes in the background, or return a recent result"""
         try:
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
@@ -532,53 +597,48 @@ class ConfigHandler(BaseHTTPRequestHandler):
             email_provider = form_data.get('email_provider', ['gmail'])[0]
             
             # Get provider configuration
-            if email_provider in self.EMAIL_PROVIDERS:
+            if email_provider in self.EMAIL_PROVIDERS and email_provider != 'custom':
                 provider_config = self.EMAIL_PROVIDERS[email_provider]
                 imap_server = provider_config['server']
                 imap_port = provider_config['port']
+                use_ssl = provider_config['ssl']
             else:
                 imap_server = form_data.get('imap_server', ['imap.gmail.com'])[0]
                 imap_port = int(form_data.get('imap_port', ['993'])[0])
+                use_ssl = form_data.get('imap_ssl', [str(imap_port != 143).lower()])[0].lower() == 'true'
             
             if not email_user or not email_pass:
                 raise ValueError("Email and password are required")
             
-            # Try to connect to IMAP and get mailbox list
-            mail = imaplib.IMAP4_SSL(imap_server, imap_port)
-            mail.login(email_user, email_pass)
-            
-            status, mailbox_list = mail.list()
-            mail.logout()
-            
-            if status != 'OK':
-                raise Exception("Failed to get folder list")
-            
-            mailboxes = []
-            for item in mailbox_list:
-                # Parse mailbox name from IMAP response
-                if isinstance(item, bytes):
-                    item = item.decode('utf-8')
-                
-                # Extract mailbox name (last quoted part)
-                parts = item.split('"')
-                if len(parts) >= 3:
-                    encoded_name = parts[-2]  # Original IMAP name
-                    # Decode IMAP modified UTF-7 to normal UTF-8
-                    decoded_name = decode_imap_utf7(encoded_name)
-                    mailboxes.append(decoded_name)
-            
-            # Sort mailboxes
-            mailboxes.sort()
-            
-            response = {
-                "success": True, 
-                "mailboxes": mailboxes,
-                "count": len(mailboxes)
-            }
+            job, cached = DISCOVERY.start(imap_server, imap_port, use_ssl, email_user, email_pass,
+                                          refresh=form_data.get('refresh', [''])[0] == '1')
+            response = self.discovery_response(job)
+            response['cached'] = cached
             
         except Exception as e:
             response = {"success": False, "error": str(e)}
         
+        self.send_json(response)
+    
+    def serve_discovery_progress(self):
+        """Report the progress of a mailbox detection job"""
+        job = DISCOVERY.get(self.path[len('/detect-mailboxes/'):])
+        if job is None:
+            self.send_error(404)
+            return
+        self.send_json(self.discovery_response(job))
+    
+    def discovery_response(self, job):
+        """JSON body for a detection job, with decoded folder names"""
+        response = job.to_dict()
+        response['success'] = job.state != 'error'
+        for folder in response['folders']:
+            folder['name'] = decode_imap_utf7(folder['name'])
+        response['mailboxes'] = [folder['name'] for folder in response['folders']]
+        response['count'] = len(response['folders'])
+        return response
+    
+    def send_json(self, response):
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.end_headers()
@@ -640,6 +700,9 @@ class ConfigHandler(BaseHTTPRequestHandler):
             # Optional fields
             env_content.append(f"IMAP_SERVER={form_data.get('imap_server', ['imap.gmail.com'])[0]}")
             env_content.append(f"IMAP_PORT={form_data.get('imap_port', ['993'])[0]}")
+            if email_provider == 'custom':
+                # Provider presets always use SSL, so only a custom server sets it
+                env_content.append(f"IMAP_SSL={form_data.get('imap_ssl', ['true'])[0]}")
             env_content.append(f"MAILBOXES={form_data.get('mailboxes', ['INBOX'])[0]}")
             env_content.append(f"FEED_MODE={form_data.get('feed_mode', ['combined'])[0]}")
             env_content.append(f"FEED_TITLE={form_data.get('feed_title', ['My RSS Emails'])[0]}")
@@ -652,14 +715,22 @@ class ConfigHandler(BaseHTTPRequestHandler):
             
             env_content.append("HTTP_PORT=8888")
             env_content.append("CONFIG_PORT=9999")
-            env_content.append("RUN_MODE=daemon")
+            env_content.append(f"RUN_MODE={os.getenv('RUN_MODE', 'daemon')}")
             
-            # Write to .env file
-            with open('/app/.env', 'w') as f:
+            # Write to .env file; replaced in one step, as the running daemon watches it
+            with open('/app/.env.tmp', 'w') as f:
                 f.write('\n'.join(env_content))
+            os.replace('/app/.env.tmp', '/app/.env')
             
             print(f"DEBUG: File written successfully!")
-            response = {"success": True, "message": "Configuration saved successfully"}
+            
+            # The daemon applies the new settings without a restart
+            data_dir = '/app/data' if os.path.exists('/app/data') else './data'
+            try:
+                refresh.request_reload(data_dir)
+                response = {"success": True, "applied": True, "message": "Configuration saved and applied"}
+            except refresh.DaemonNotRunning:
+                response = {"success": True, "applied": False, "message": "Configuration saved successfully"}
             
         except Exception as e:
             print(f"DEBUG: Exception occurred: {str(e)}")
@@ -674,6 +745,10 @@ class ConfigHandler(BaseHTTPRequestHandler):
     def serve_status_page(self):
         """Serve the status page"""
         config = self.load_current_config()
+        data_dir = '/app/data' if os.path.exists('/app/data') else './data'
+        last_sync = self.render_cycle_summary(cycle_stats.read_latest(data_dir))
+        captures = ''.join(f'<li><a href="/profiles/{name}.zip">{name}</a></li>'
+                           for name in profiling.list_captures(data_dir)) or '<li>None yet</li>'
         
         html = f"""<!DOCTYPE html>
 <html lang="pt-BR">
@@ -687,20 +762,33 @@ class ConfigHandler(BaseHTTPRequestHandler):
         .status-ok {{ color: green; }}
         .status-error {{ color: red; }}
         .btn {{ padding: 10px 20px; margin: 5px; text-decoration: none; background: #007bff; color: white; border-radius: 5px; }}
+        table {{ border-collapse: collapse; margin: 10px 0 20px; }}
+        td, th {{ padding: 4px 12px; border-bottom: 1px solid #eee; text-align: left; }}
     </style>
 </head>
 <body>
     <div class="container">
         <h1>📊 IMAP2RSS Status</h1>
-        <p><strong>Provider:</strong> {config.get('EMAIL_PROVIDER', 'gmail').title()}</p>
-        <p><strong>Email:</strong> {config.get('EMAIL_USER', 'Not configured')}</p>
-        <p><strong>Server:</strong> {config.get('IMAP_SERVER', 'imap.gmail.com')}</p>
-        <p><strong>Folders:</strong> {config.get('MAILBOXES', 'INBOX')}</p>
+        <p><strong>Provider:</strong> {escape(config.get('EMAIL_PROVIDER', 'gmail').title())}</p>
+        <p><strong>Email:</strong> {escape(config.get('EMAIL_USER', 'Not configured'))}</p>
+        <p><strong>Server:</strong> {escape(config.get('IMAP_SERVER', 'imap.gmail.com'))}</p>
+        <p><strong>Folders:</strong> {escape(config.get('MAILBOXES', 'INBOX'))}</p>
         
         <h2>RSS Links:</h2>
         <p><a href="http://localhost:8888/feed.xml" target="_blank">Main Feed</a></p>
         <p><a href="http://localhost:8888/" target="_blank">All Feeds</a></p>
         
+        <h2>Last Sync:</h2>
+        {last_sync}
+        
+        <h2>Profiling:</h2>
+        <form method="post" action="/profile">
+            Profile the next <input type="number" name="cycles" value="1" min="1" max="10" style="width: 50px"> sync cycles
+            <button type="submit" class="btn">🔬 Capture and Download</button>
+        </form>
+        <p><small>Starts a sync right away and downloads the cProfile and tracemalloc results when it finishes.</small></p>
+        <ul>{captures}</ul>
+        
         <a href="/" class="btn">⚙️ Settings</a>
         <a href="http://localhost:8888/" class="btn" target="_blank">📰 View Feeds</a>
     </div>
@@ -712,6 +800,79 @@ class ConfigHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(html.encode('utf-8'))
     
+    def render_cycle_summary(self, record):
+        """Render the timings of the last sync cycle as HTML"""
+        if not record:
+            return "<p>No sync has completed yet.</p>"
+        
+        status_class = 'status-ok' if record['result'] == 'ok' else 'status-error'
+        html = f"""<p><strong>Started:</strong> {escape(str(record['started_at']))} &middot;
+        <strong>Result:</strong> <span class="{status_class}">{escape(record['result'])}</span> &middot;
+        <strong>Duration:</strong> {record['duration']:.2f}s &middot;
+        <strong>Fetched:</strong> {record['messages_fetched']} messages, {record['bytes_fetched'] / 1024:.1f} KB</p>"""
+        if record.get('stragglers'):
+            html += (f"<p class=\"status-error\">Ran out of time before finishing: "
+                     f"{', '.join(escape(decode_imap_utf7(mailbox)) for mailbox in record['stragglers'])}</p>")
+        html += "<table><tr><th>Phase</th><th>Seconds</th></tr>"
+        for name, seconds in record['phases'].items():
+            html += f"<tr><td>{escape(name)}</td><td>{seconds:.3f}</td></tr>"
+        if record.get('stages'):
+            html += ("</table><table><tr><th>Stage</th><th>Workers</th><th>Items</th><th>Items/s</th>"
+                     "<th>Busy s</th><th>Blocked s</th><th>Max queue</th></tr>")
+            for name, stats in record['stages'].items():
+                html += (f"<tr><td>{escape(name)}</td><td>{stats['workers']}</td><td>{stats['items']}</td>"
+                         f"<td>{stats['items_per_second']:.1f}</td><td>{stats['busy']:.3f}</td>"
+                         f"<td>{stats['blocked']:.3f}</td><td>{stats['max_queue']}</td></tr>")
+        html += "</table><table><tr><th>Folder</th><th>Seconds</th><th>Items</th><th>Fetched</th><th>KB</th><th>Slowest step</th></tr>"
+        for mailbox, totals in record['mailboxes'].items():
+            slowest = max(totals['steps'].items(), key=lambda item: item[1]['seconds'], default=None)
+            slowest_text = f"{escape(slowest[0])} ({slowest[1]['seconds']:.3f}s)" if slowest else ''
+            html += (f"<tr><td>{escape(decode_imap_utf7(mailbox))}</td><td>{totals['seconds']:.3f}</td><td>{totals['messages']}</td>"
+                     f"<td>{totals['fetched']}</td><td>{totals['bytes'] / 1024:.1f}</td><td>{slowest_text}</td></tr>")
+        html += "</table>"
+        return html
+    
+    def capture_profile(self):
+        """Profile the next daemon cycles and send the captures as a zip file"""
+        data_dir = '/app/data' if os.path.exists('/app/data') else './data'
+        content_length = int(self.headers.get('Content-Length', 0))
+        form_data = urllib.parse.parse_qs(self.rfile.read(content_length).decode('utf-8'))
+        try:
+            cycles = max(1, min(10, int(form_data.get('cycles', ['1'])[0])))
+        except ValueError:
+            cycles = 1
+        
+        try:
+            request_id = profiling.request_capture(data_dir, cycles)
+        except refresh.DaemonNotRunning as e:
+            self.send_error(503, str(e))
+            return
+        logger.info(f"Requested profile of {cycles} cycles")
+        
+        status = profiling.wait_for(data_dir, request_id, timeout=float(os.getenv('PROFILE_WAIT_TIMEOUT', '900')))
+        if status is None:
+            self.send_error(504, "Capture not finished yet; it will be listed on the status page")
+            return
+        self.send_zip(f"profile-{request_id}.zip", profiling.capture_archive(data_dir, status['captures']))
+    
+    def serve_profile_download(self):
+        """Send one earlier capture as a zip file"""
+        data_dir = '/app/data' if os.path.exists('/app/data') else './data'
+        name = self.path[len('/profiles/'):]
+        if not name.endswith('.zip') or name[:-len('.zip')] not in profiling.list_captures(data_dir):
+            self.send_error(404)
+            return
+        self.send_zip(name, profiling.capture_archive(data_dir, [name[:-len('.zip')]]))
+    
+    def send_zip(self, file_name, data):
+        """Send bytes as a zip file download"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', f'attachment; filename="{file_name}"')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
     def load_current_config(self):
         """Load current configuration from environment or .env file"""
         config = {}
@@ -727,7 +888,7 @@ class ConfigHandler(BaseHTTPRequestHandler):
                         config[key] = value
         
         # Override with environment variables
-        for key in ['EMAIL_USER', 'EMAIL_PASS', 'EMAIL_PROVIDER', 'IMAP_SERVER', 'IMAP_PORT', 'MAILBOXES', 'FEED_MODE',
+        for key in ['EMAIL_USER', 'EMAIL_PASS', 'EMAIL_PROVIDER', 'IMAP_SERVER', 'IMAP_PORT', 'IMAP_SSL', 'MAILBOXES', 'FEED_MODE',
                    'FEED_TITLE', 'FEED_DESCRIPTION', 'MAX_EMAILS', 'CHECK_INTERVAL']:
             if key in os.environ:
                 config[key] = os.environ[key]
@@ -745,7 +906,8 @@ def run_config_server():
     port = int(os.getenv('CONFIG_PORT', '9999'))
     server_address = ('', port)
     
-    httpd = HTTPServer(server_address, ConfigHandler)
+    # Threaded, so a profile capture waiting on the daemon does not block the other pages
+    httpd = ThreadingHTTPServer(server_address, ConfigHandler)
     logger.info(f"Starting configuration server on port {port}")
     logger.info(f"Configuration interface: http://localhost:{port}")
     
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Per-cycle timing spans, appended to a rolling JSON-lines file in data/
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+STATS_FILE = 'cycle_stats.jsonl'
+
+class CycleTrace:
+    """Durations of the steps of one sync cycle, overall and per mailbox, with fetched byte counts"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}     # phase -> seconds
+        self.steps = {}      # step -> {'seconds', 'count'}
+        self.mailboxes = {}  # mailbox -> {'seconds', 'messages', 'fetched', 'bytes', 'steps'}
+        self.stragglers = []  # mailboxes left incomplete when the cycle ran out of time
+        self.stages = {}     # pipeline stage -> {'workers', 'items', 'items_per_second', 'busy', 'blocked', 'max_queue'}
+
+    def mailbox(self, name: str) -> Dict[str, Any]:
+        """Totals of one mailbox; call with the lock held"""
+        return self.mailboxes.setdefault(name, {'seconds': 0.0, 'messages': 0, 'fetched': 0, 'bytes': 0, 'steps': {}})
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time one phase of the cycle"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def span(self, step: str, mailbox: Optional[str] = None):
+        """Time a block as one occurrence of a step, attributed to a mailbox if given"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(step, time.perf_counter() - started, mailbox)
+
+    def add(self, step: str, seconds: float, mailbox: Optional[str] = None):
+        """Record one occurrence of a step"""
+        with self.lock:
+            steps = self.mailbox(mailbox)['steps'] if mailbox is not None else self.steps
+            totals = steps.setdefault(step, {'seconds': 0.0, 'count': 0})
+            totals['seconds'] += seconds
+            totals['count'] += 1
+
+    def count(self, mailbox: str, **values):
+        """Add to a mailbox's totals, e.g. messages, fetched or bytes"""
+        with self.lock:
+            totals = self.mailbox(mailbox)
+            for key, value in values.items():
+                totals[key] += value
+
+    def straggler(self, mailbox: str):
+        """Note a mailbox the cycle had no time to finish"""
+        with self.lock:
+            if mailbox not in self.stragglers:
+                self.stragglers.append(mailbox)
+
+    def stage(self, name: str, **values):
+        """Record the statistics of a pipeline stage"""
+        with self.lock:
+            self.stages[name] = values
+
+    def record(self, duration: float, result: str) -> Dict[str, Any]:
+        """JSON-serializable summary of the cycle"""
+        with self.lock:
+            mailboxes = {name: dict(totals, seconds=round(totals['seconds'], 4),
+                                    steps=_rounded(totals['steps']))
+                         for name, totals in self.mailboxes.items()}
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at).isoformat(timespec='seconds'),
+                'duration': round(duration, 4),
+                'result': result,
+                'bytes_fetched': sum(totals['bytes'] for totals in self.mailboxes.values()),
+                'messages_fetched': sum(totals['fetched'] for totals in self.mailboxes.values()),
+                'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+                'steps': _rounded(self.steps),
+                'mailboxes': mailboxes,
+                'stragglers': list(self.stragglers),
+                'stages': {name: {key: round(value, 4) if isinstance(value, float) else value
+                                  for key, value in stats.items()}
+                           for name, stats in self.stages.items()}
+            }
+
+def _rounded(steps: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {step: {'seconds': round(totals['seconds'], 4), 'count': totals['count']} for step, totals in steps.items()}
+
+def append_record(data_dir: str, record: Dict[str, Any], max_bytes: int = 1024 * 1024):
+    """Append a cycle record, dropping the oldest half of the file once it exceeds max_bytes"""
+    path = os.path.join(data_dir, STATS_FILE)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+        size = f.tell()
+    if size <= max_bytes:
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(size - max_bytes // 2)
+        tail = f.read()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        # Drop the partial record at the cut
+        f.write(tail[tail.find(b'\n') + 1:])
+    os.replace(tmp_path, path)
+
+def read_latest(data_dir: str) -> Optional[Dict[str, Any]]:
+    """Most recent cycle record, if any"""
+    path = os.path.join(data_dir, STATS_FILE)
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 65536))
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    for line in reversed(lines):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # Partial line at the start of the window or an interrupted write
+            continue
+    return None
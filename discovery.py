@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Background IMAP folder discovery for the configuration GUI, with per-account cached results
+"""
+
+import re
+import time
+import hashlib
+import imaplib
+import threading
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (\HasNoChildren) "/" "INBOX" or (\Noselect) NIL Archive
+LIST_LINE = re.compile(r'\((?P<flags>[^)]*)\)\s+(?:"(?:[^"\\]|\\.)*"|NIL)\s+(?P<name>.*)$', re.IGNORECASE)
+# "INBOX" (MESSAGES 12 UNSEEN 3)
+STATUS_LINE = re.compile(r'^(?P<name>"(?:[^"\\]|\\.)*"|\S+)\s+\((?P<items>[^)]*)\)')
+
+def _text(item) -> str:
+    if isinstance(item, tuple):
+        # Name sent as a literal: the line ends with {n} and the name follows
+        return item[0].decode('utf-8', errors='replace').rsplit('{', 1)[0] + '"' + item[1].decode('utf-8', errors='replace') + '"'
+    return item.decode('utf-8', errors='replace') if isinstance(item, bytes) else str(item)
+
+def _unquote(name: str) -> str:
+    name = name.strip()
+    if len(name) >= 2 and name[0] == '"' and name[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', name[1:-1])
+    return name
+
+def parse_list(data: List[Any]) -> List[Tuple[str, bool]]:
+    """(encoded name, selectable) of each LIST response line"""
+    folders = []
+    for item in data:
+        if item is None:
+            continue
+        match = LIST_LINE.match(_text(item))
+        if match:
+            folders.append((_unquote(match.group('name')), '\\noselect' not in match.group('flags').lower()))
+    return folders
+
+def parse_status(data: List[Any]) -> Dict[str, Dict[str, int]]:
+    """Counts of each STATUS response line, keyed by encoded name"""
+    counts = {}
+    for item in data:
+        if item is None:
+            continue
+        match = STATUS_LINE.match(_text(item))
+        if match:
+            values = match.group('items').split()
+            counts[_unquote(match.group('name'))] = {key.upper(): int(value) for key, value in zip(values[::2], values[1::2])
+                                                     if value.isdigit()}
+    return counts
+
+class DiscoveryJob:
+    """One folder listing of an account, run in a background thread"""
+
+    def __init__(self, job_id: str, key: str):
+        self.id = job_id
+        self.key = key
+        self.state = 'running'   # running, done or error
+        self.step = 'Connecting'
+        self.done = 0
+        self.total = 0
+        self.folders = []        # [{'name', 'messages', 'unseen'}], names still IMAP-encoded
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job': self.id,
+            'state': self.state,
+            'step': self.step,
+            'done': self.done,
+            'total': self.total,
+            'folders': [dict(folder) for folder in self.folders],
+            'error': self.error,
+            'finished_at': self.finished_at
+        }
+
+class MailboxDiscovery:
+    """Starts discovery jobs, reusing a running job or a recent result for the same account"""
+
+    def __init__(self, cache_ttl: float = 600, timeout: float = 10, keep_jobs: int = 20):
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.keep_jobs = keep_jobs
+        self.lock = threading.Lock()
+        self.jobs = {}    # job id -> DiscoveryJob, oldest first
+        self.latest = {}  # account key -> job id of its latest job
+
+    def start(self, server: str, port: int, use_ssl: bool, user: str, password: str, refresh: bool = False) -> Tuple[DiscoveryJob, bool]:
+        """Return a job listing the account's folders, started now unless one is running or fresh,
+        and whether it is a cached result"""
+        # The password only enters the key hashed, so cached entries do not keep it
+        key = hashlib.sha256(f"{server}\0{port}\0{use_ssl}\0{user}\0{password}".encode('utf-8')).hexdigest()
+        with self.lock:
+            job = self.jobs.get(self.latest.get(key))
+            if job and (job.state == 'running' or
+                        (not refresh and job.state == 'done' and time.time() - job.finished_at < self.cache_ttl)):
+                return job, job.state == 'done'
+            job = DiscoveryJob(f"{time.time_ns():x}", key)
+            self.jobs[job.id] = job
+            self.latest[key] = job.id
+            for old_id in list(self.jobs)[:-self.keep_jobs]:
+                if self.jobs[old_id].state != 'running':
+                    del self.jobs[old_id]
+        threading.Thread(target=self.run, args=(job, server, port, use_ssl, user, password),
+                         name=f"discovery-{job.id}", daemon=True).start()
+        return job, False
+
+    def get(self, job_id: str) -> Optional[DiscoveryJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_with_status(self, mail) -> Optional[Tuple[List[Tuple[str, bool]], Dict[str, Dict[str, int]]]]:
+        """Folders and their counts in one round trip (RFC 5819), None if the server turns it down"""
+        try:
+            status, _ = mail.xatom('LIST', '""', '"*"', 'RETURN', '(STATUS (MESSAGES UNSEEN))')
+        except imaplib.IMAP4.error as e:
+            logger.info(f"LIST-STATUS failed, counting folders one by one: {e}")
+            return None
+        # Untagged replies are collected by name whatever command produced them
+        _, data = mail.response('LIST')
+        _, status_data = mail.response('STATUS')
+        if status != 'OK':
+            return None
+        return parse_list(data), parse_status(status_data)
+
+    def run(self, job: DiscoveryJob, server: str, port: int, use_ssl: bool, user: str, password: str):
+        """List the folders with their message and unseen counts"""
+        mail = None
+        try:
+            if use_ssl:
+                mail = imaplib.IMAP4_SSL(server, port, timeout=self.timeout)
+            else:
+                mail = imaplib.IMAP4(server, port, timeout=self.timeout)
+            job.step = 'Logging in'
+            mail.login(user, password)
+            mail.sock.settimeout(30)
+
+            job.step = 'Listing folders'
+            listing = self.list_with_status(mail) if 'LIST-STATUS' in mail.capabilities else None
+            if listing is None:
+                status, data = mail.list()
+                if status != 'OK':
+                    raise Exception("Failed to get folder list")
+                folders = parse_list(data)
+                counts = {}
+                selectable = [name for name, can_select in folders if can_select]
+                job.total = len(selectable)
+                job.step = 'Counting messages'
+                for name in selectable:
+                    status, status_data = mail.status(f'"{name}"', '(MESSAGES UNSEEN)')
+                    if status == 'OK':
+                        counts.update(parse_status(status_data))
+                    job.done += 1
+            else:
+                folders, counts = listing
+            mail.logout()
+
+            job.folders = sorted(({'name': name, 'messages': counts.get(name, {}).get('MESSAGES'),
+                                   'unseen': counts.get(name, {}).get('UNSEEN')}
+                                  for name, can_select in folders if can_select),
+                                 key=lambda folder: folder['name'])
+            job.done = job.total = len(job.folders)
+            job.step = 'Done'
+            job.finished_at = time.time()
+            job.state = 'done'
+            logger.info(f"Discovered {len(job.folders)} folders on {server}")
+        except Exception as e:
+            logger.error(f"Folder discovery on {server} failed: {e}")
+            job.error = str(e)
+            job.step = 'Failed'
+            job.finished_at = time.time()
+            job.state = 'error'
+            if mail is not None:
+                try:
+                    mail.shutdown()
+                except Exception:
+                    pass
@@ -12,6 +12,12 @@ fi
 echo "Starting Configuration GUI..."
 python config_gui.py &
 
+# Combined mode: converter and HTTP server share one process and its in-memory state
+if [ "$RUN_MODE" = "combined" ]; then
+    echo "Starting IMAP to RSS converter and RSS HTTP server..."
+    exec python app.py
+fi
+
 # Start the IMAP converter in the background
 echo "Starting IMAP to RSS converter..."
 python app.py &
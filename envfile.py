@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+.env loading shared by the converter and the HTTP server
+
+The environment the process was started with is captured when this module is
+first imported, before any .env values are applied, so keys later removed from
+.env go back to what Docker or the shell passed in rather than to stale .env
+values. Both app.py and server.py load and reload through this module, so the
+record of what .env set is kept once per process.
+"""
+
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Environment the process was started with, restored for keys later removed from .env
+STARTUP_ENV = dict(os.environ)
+
+# Seconds between checks of the .env file for changes
+CHECK_INTERVAL = 5
+
+_lock = threading.RLock()
+_loaded = None  # values applied from .env, None until load() runs
+
+def find_env_file() -> Optional[str]:
+    """Path of the .env file in use, if any"""
+    for env_file in ('/app/.env', './.env'):
+        if os.path.exists(env_file):
+            return env_file
+    return None
+
+def read_env_file(env_file: str) -> Dict[str, str]:
+    """Variables defined in a .env file"""
+    values = {}
+    with open(env_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                values[key] = value
+    return values
+
+def mtime() -> Optional[float]:
+    """Modification time of the .env file, None if there is none"""
+    env_file = find_env_file()
+    try:
+        return os.stat(env_file).st_mtime if env_file else None
+    except OSError:
+        return None
+
+def load() -> Dict[str, str]:
+    """Load environment variables from .env file, once per process"""
+    global _loaded
+    with _lock:
+        if _loaded is not None:
+            return dict(_loaded)
+        env_file = find_env_file()
+        if env_file is None:
+            logger.warning("No .env file found")
+            _loaded = {}
+            return {}
+        logger.info(f"Loading environment variables from {env_file}")
+        values = read_env_file(env_file)
+        for key, value in values.items():
+            os.environ[key] = value
+            logger.debug(f"Set {key}={value[:20]}...")
+        _loaded = values
+        return dict(values)
+
+def reload(validate: Optional[Callable[[], None]] = None) -> List[str]:
+    """Re-read .env and apply what changed since the last load; the changed keys
+
+    validate runs with the new values in place; if it raises ValueError the
+    previous values are put back and the error is raised again.
+    """
+    global _loaded
+    with _lock:
+        if _loaded is None:
+            load()
+        env_file = find_env_file()
+        values = read_env_file(env_file) if env_file else {}
+        changed = sorted(key for key in set(values) | set(_loaded) if values.get(key) != _loaded.get(key))
+        if not changed:
+            return []
+        
+        previous_env = {key: os.environ.get(key) for key in changed}
+        for key in changed:
+            if key in values:
+                os.environ[key] = values[key]
+            elif key in STARTUP_ENV:
+                # Removed from .env: back to what Docker or the shell passed in
+                os.environ[key] = STARTUP_ENV[key]
+            else:
+                # Removed from .env: back to the default
+                os.environ.pop(key, None)
+        if validate is not None:
+            try:
+                validate()
+            except ValueError:
+                for key, value in previous_env.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+                raise
+        _loaded = values
+        return changed
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+RSS rendering helpers shared by the IMAP converter and the HTTP server
+"""
+
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+RSS_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S +0000"
+
+# Maximum number of body characters included in each item
+BODY_LIMIT = 3000
+
+# RFC 5005 feed history namespace
+FH_NAMESPACE = "http://purl.org/syndication/history/1.0"
+
+def create_channel(title: str, description: str, link: str, generator: str,
+                   category: Optional[str] = None, hub: Optional[str] = None) -> Tuple[ET.Element, ET.Element]:
+    """Create an RSS root element and its channel with standard metadata"""
+    rss = ET.Element("rss", version="2.0")
+    rss.set("xmlns:atom", "http://www.w3.org/2005/Atom")
+    channel = ET.SubElement(rss, "channel")
+
+    ET.SubElement(channel, "title").text = title
+    ET.SubElement(channel, "description").text = description
+    ET.SubElement(channel, "link").text = link
+    ET.SubElement(channel, "lastBuildDate").text = datetime.now().strftime(RSS_DATE_FORMAT)
+    ET.SubElement(channel, "generator").text = generator
+    if category is not None:
+        ET.SubElement(channel, "category").text = category
+
+    # Atom link for self-reference
+    add_atom_link(channel, link, "self")
+    if hub is not None:
+        # WebSub discovery
+        add_atom_link(channel, hub, "hub", None)
+
+    return rss, channel
+
+def add_atom_link(channel: ET.Element, href: str, rel: str, link_type: Optional[str] = "application/rss+xml"):
+    """Add an <atom:link> element to a channel"""
+    atom_link = ET.SubElement(channel, "atom:link")
+    atom_link.set("href", href)
+    atom_link.set("rel", rel)
+    if link_type is not None:
+        atom_link.set("type", link_type)
+
+def mark_as_archive(rss: ET.Element, channel: ET.Element):
+    """Flag a feed document as an RFC 5005 archive page"""
+    rss.set("xmlns:fh", FH_NAMESPACE)
+    ET.SubElement(channel, "fh:archive")
+
+def truncate_body(body: str) -> str:
+    """Limit body length to keep feeds reasonably small"""
+    if len(body) > BODY_LIMIT:
+        return body[:BODY_LIMIT] + "..."
+    return body
+
+def format_combined_item(email_data: Dict[str, Any]) -> Tuple[str, str]:
+    """Build title and description for an item in a feed mixing several mailboxes"""
+    title = f"[{email_data['mailbox']}] [{email_data['sender']}] {email_data['subject']}"
+
+    # Include mailbox in description with preserved HTML
+    description = f"<p><strong>Folder:</strong> {email_data['mailbox']}</p><p><strong>From:</strong> {email_data['sender']}</p><hr/>"
+    description += truncate_body(email_data['body'])
+    return title, description
+
+def format_mailbox_item(email_data: Dict[str, Any]) -> Tuple[str, str]:
+    """Build title and description for an item in a single-mailbox feed"""
+    title = f"[{email_data['sender']}] {email_data['subject']}"
+    return title, truncate_body(email_data['body'])
+
+def add_item(channel: ET.Element, email_data: Dict[str, Any], title: str, description: str) -> ET.Element:
+    """Append an email as an RSS item"""
+    item = ET.SubElement(channel, "item")
+    ET.SubElement(item, "title").text = title
+
+    # Use CDATA to preserve HTML content
+    desc_elem = ET.SubElement(item, "description")
+    desc_elem.text = f"<![CDATA[{description}]]>"
+
+    ET.SubElement(item, "guid").text = email_data['id']
+    ET.SubElement(item, "pubDate").text = email_data['date'].strftime(RSS_DATE_FORMAT)
+    ET.SubElement(item, "author").text = email_data['sender']
+    ET.SubElement(item, "category").text = email_data['mailbox']
+
+    # Attachments are downloaded lazily through the server's blob route
+    for attachment in email_data.get('attachments', []):
+        enclosure = ET.SubElement(item, "enclosure")
+        enclosure.set("url", attachment['url'])
+        enclosure.set("length", str(attachment['length']))
+        enclosure.set("type", attachment['type'])
+    return item
+
+def to_pretty_xml(rss: ET.Element) -> str:
+    """Serialize an RSS tree to indented XML"""
+    xml_str = ET.tostring(rss, encoding='unicode')
+    dom = minidom.parseString(xml_str)
+    return dom.toprettyxml(indent="  ")
+
+def render_feeds_index(feeds_data: Dict[str, Any], mailbox_names: List[str]) -> str:
+    """Render the HTML page listing the available feeds"""
+    html = f"""<!DOCTYPE html>
+<html>
+<head>
+    <title>IMAP2RSS - Available Feeds</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }}
+        .container {{ max-width: 800px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; }}
+        h1 {{ color: #333; }}
+        .feed-list {{ list-style: none; padding: 0; }}
+        .feed-item {{ background: #f8f9fa; margin: 10px 0; padding: 15px; border-radius: 5px; border-left: 4px solid #007bff; }}
+        .feed-item a {{ text-decoration: none; color: #007bff; font-weight: bold; }}
+        .feed-item small {{ color: #666; display: block; margin-top: 5px; }}
+        .info {{ background: #e7f3ff; padding: 15px; border-radius: 5px; margin: 20px 0; }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>📰 Available RSS Feeds</h1>
+        
+        <div class="info">
+            <strong>Mode:</strong> {feeds_data.get('feed_mode', 'combined')}<br>
+            <strong>Monitored folders:</strong> {', '.join(mailbox_names)}<br>
+            <strong>Last update:</strong> {feeds_data.get('generated_at', 'Unknown')}
+        </div>
+        
+        <h2>RSS Feeds:</h2>
+        <ul class="feed-list">"""
+            
+    for feed in feeds_data.get('feeds', []):
+        feed_url = f"http://localhost:8888/{feed}.xml"
+        if feed == 'feed':
+            description = "Combined feed with all emails"
+        else:
+            description = f"Emails from folder: {feed}"
+                    
+        html += f"""
+            <li class="feed-item">
+                <a href="/{feed}.xml">{feed}.xml</a>
+                <small>{description}</small>
+                <small><strong>FreshRSS URL:</strong> <code>{feed_url}</code></small>
+            </li>"""
+            
+    html += """
+        </ul>
+        
+        <h2>APIs:</h2>
+        <ul class="feed-list">
+            <li class="feed-item">
+                <a href="/feeds.json">feeds.json</a>
+                <small>List of feeds in JSON format</small>
+            </li>
+            <li class="feed-item">
+                <a href="/health">health</a>
+                <small>Service health status</small>
+            </li>
+        </ul>
+    </div>
+</body>
+</html>"""
+    return html
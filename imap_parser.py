@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Parsing helpers for IMAP FETCH responses and BODYSTRUCTURE
+"""
+
+import re
+import base64
+import quopri
+from typing import List, Dict, Any, Optional
+
+# Atoms may carry a section and partial spec, e.g. BODY[HEADER.FIELDS (FROM)]<0.100>
+ATOM_PATTERN = re.compile(rb'[^\s()"{}\[\]]+(?:\[[^\]]*\])?(?:<[\d.]+>)?')
+LITERAL_PATTERN = re.compile(rb'\{(\d+)\}$')
+
+class ParseError(Exception):
+    """Raised when an IMAP response cannot be parsed"""
+
+def tokenize(data: List[Any]) -> List[Any]:
+    """Turn imaplib response data (bytes and (prefix, literal) tuples) into tokens"""
+    tokens = []
+    for element in data:
+        if isinstance(element, tuple):
+            text, literal = element[0], element[1]
+        elif isinstance(element, bytes):
+            text, literal = element, None
+        else:
+            continue
+
+        if literal is not None:
+            match = LITERAL_PATTERN.search(text.rstrip())
+            if not match:
+                raise ParseError(f"Literal without size marker: {text[-40:]!r}")
+            text = text.rstrip()[:match.start()]
+
+        pos = 0
+        while pos < len(text):
+            char = text[pos:pos + 1]
+            if char.isspace():
+                pos += 1
+            elif char in (b'(', b')'):
+                tokens.append(char)
+                pos += 1
+            elif char == b'"':
+                end = pos + 1
+                value = bytearray()
+                while end < len(text) and text[end:end + 1] != b'"':
+                    if text[end:end + 1] == b'\\':
+                        end += 1
+                    value += text[end:end + 1]
+                    end += 1
+                tokens.append(('string', bytes(value)))
+                pos = end + 1
+            else:
+                match = ATOM_PATTERN.match(text, pos)
+                if not match:
+                    raise ParseError(f"Unexpected character {char!r}")
+                atom = match.group(0)
+                if atom.upper() == b'NIL':
+                    tokens.append(('string', None))
+                elif atom.isdigit():
+                    tokens.append(('number', int(atom)))
+                else:
+                    tokens.append(('atom', atom.decode('ascii', errors='replace')))
+                pos = match.end()
+
+        if literal is not None:
+            tokens.append(('string', literal))
+    return tokens
+
+def parse_value(tokens: List[Any], pos: int):
+    """Parse one value (list, string, number or atom) starting at pos"""
+    token = tokens[pos]
+    if token == b'(':
+        values = []
+        pos += 1
+        while tokens[pos] != b')':
+            value, pos = parse_value(tokens, pos)
+            values.append(value)
+        return values, pos + 1
+    if token == b')':
+        raise ParseError("Unexpected closing parenthesis")
+    return token[1], pos + 1
+
+def parse_fetch_response(data: List[Any]) -> Dict[int, Dict[str, Any]]:
+    """Parse FETCH response data into {sequence number: {item name: value}}"""
+    tokens = tokenize(data)
+    messages = {}
+    pos = 0
+    try:
+        while pos < len(tokens):
+            token = tokens[pos]
+            if token == b')' or token[0] != 'number':
+                pos += 1
+                continue
+            sequence = token[1]
+            pos += 1
+            if pos < len(tokens) and tokens[pos] == ('atom', 'FETCH'):
+                pos += 1
+            values, pos = parse_value(tokens, pos)
+            items = messages.setdefault(sequence, {})
+            for index in range(0, len(values) - 1, 2):
+                # Servers answer BODY.PEEK[x] requests as BODY[x]
+                name = str(values[index]).upper().replace('BODY.PEEK[', 'BODY[')
+                items[name] = values[index + 1]
+    except IndexError:
+        raise ParseError("Truncated FETCH response")
+    return messages
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+    return str(value)
+
+def _params(value) -> Dict[str, str]:
+    if not isinstance(value, list):
+        return {}
+    return {_text(value[i]).lower(): _text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+def parse_bodystructure(structure, section: str = '') -> List[Dict[str, Any]]:
+    """Flatten a parsed BODYSTRUCTURE into leaf parts with their IMAP section numbers"""
+    if not isinstance(structure, list) or not structure:
+        raise ParseError("Invalid BODYSTRUCTURE")
+
+    if isinstance(structure[0], list):
+        parts = []
+        # The child parts come first; the subtype and extension data such as ("BOUNDARY" "xyz") follow
+        children = []
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            children.append(child)
+        for index, child in enumerate(children, start=1):
+            child_section = f"{section}.{index}" if section else str(index)
+            parts.extend(parse_bodystructure(child, child_section))
+        return parts
+
+    try:
+        maintype = (_text(structure[0]) or 'application').lower()
+        subtype = (_text(structure[1]) or 'octet-stream').lower()
+        params = _params(structure[2])
+        content_id = _text(structure[3])
+        encoding = (_text(structure[5]) or '7bit').lower()
+        size = structure[6] if isinstance(structure[6], int) else 0
+
+        # Extension data starts after the type-specific fields
+        if maintype == 'text':
+            extension = 8
+        elif maintype == 'message' and subtype == 'rfc822':
+            extension = 10
+        else:
+            extension = 7
+        disposition = None
+        disposition_params = {}
+        if len(structure) > extension + 1 and isinstance(structure[extension + 1], list):
+            disposition = (_text(structure[extension + 1][0]) or '').lower() or None
+            disposition_params = _params(structure[extension + 1][1]) if len(structure[extension + 1]) > 1 else {}
+    except (IndexError, TypeError, AttributeError) as e:
+        raise ParseError(f"Invalid BODYSTRUCTURE part: {e}")
+
+    return [{
+        'section': section or '1',
+        'content_type': f"{maintype}/{subtype}",
+        'charset': params.get('charset'),
+        'encoding': encoding,
+        'size': size,
+        'cid': content_id.strip('<>') if content_id else None,
+        'filename': disposition_params.get('filename') or params.get('name'),
+        'disposition': disposition
+    }]
+
+def decode_transfer_encoding(data: bytes, encoding: str) -> bytes:
+    """Undo a Content-Transfer-Encoding"""
+    encoding = (encoding or '').lower()
+    if encoding == 'base64':
+        return base64.b64decode(data)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+def estimate_decoded_size(size: int, encoding: str) -> int:
+    """Estimate a part's decoded size from the encoded size BODYSTRUCTURE reports"""
+    if (encoding or '').lower() != 'base64':
+        # Quoted-printable only ever grows the data, so its encoded size is an upper bound
+        return size
+    # MIME wraps base64 in lines of 76 characters plus CRLF; padding makes this a couple of bytes high at most
+    line_breaks = -(-size // 78) * 2
+    return max(0, size - line_breaks) * 3 // 4
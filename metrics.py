@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Process-local counters and histograms rendered in the Prometheus text format
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a cached HTTP response to a full IMAP cycle
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+DESCRIPTIONS = {
+    'imap2rss_cycle_seconds': ('histogram', 'Duration of a full fetch and generate cycle'),
+    'imap2rss_cycle_phase_seconds': ('histogram', 'Duration of each phase of a cycle'),
+    'imap2rss_cycles_total': ('counter', 'Completed cycles by result'),
+    'imap2rss_last_cycle_timestamp_seconds': ('gauge', 'Unix time at which the last cycle finished'),
+    'imap2rss_mailbox_fetch_seconds': ('histogram', 'Time spent fetching one mailbox'),
+    'imap2rss_messages_fetched_total': ('counter', 'Messages fetched from IMAP'),
+    'imap2rss_bytes_fetched_total': ('counter', 'Bytes of message data fetched from IMAP'),
+    'imap2rss_imap_commands_total': ('counter', 'IMAP commands issued, by purpose'),
+    'imap2rss_mailbox_probes_total': ('counter', 'STATUS probes by mailbox and whether it changed'),
+    'imap2rss_poll_interval_seconds': ('gauge', 'Current adaptive poll interval of each mailbox'),
+    'imap2rss_mailbox_arrival_rate': ('gauge', 'Estimated new messages per hour in each mailbox'),
+    'imap2rss_schedule_lag_seconds': ('histogram', 'Delay between the intended and actual start of scheduled cycles'),
+    'imap2rss_cycles_skipped_total': ('counter', 'Scheduled cycles skipped because the previous one overran'),
+    'imap2rss_stragglers_total': ('counter', 'Mailboxes left incomplete when a cycle ran out of time'),
+    'imap2rss_watchdog_aborts_total': ('counter', 'IMAP connections shut down by the hung-cycle watchdog'),
+    'imap2rss_pipeline_items_total': ('counter', 'Items processed by each sync pipeline stage'),
+    'imap2rss_pipeline_item_seconds': ('histogram', 'Time a pipeline stage spent on one item'),
+    'imap2rss_pipeline_queue_depth': ('gauge', 'Items waiting in the queue in front of each pipeline stage'),
+    'imap2rss_pipeline_blocked_seconds_total': ('counter', 'Time spent waiting for room in a full pipeline stage queue'),
+    'imap2rss_sanitize_seconds': ('histogram', 'Time spent cleaning message HTML'),
+    'imap2rss_feed_render_seconds': ('histogram', 'Time spent rendering a feed document'),
+    'imap2rss_feeds_written_total': ('counter', 'Feed files rewritten because their content changed'),
+    'imap2rss_http_request_seconds': ('histogram', 'HTTP request latency by route'),
+    'imap2rss_http_responses_total': ('counter', 'HTTP responses by route and status'),
+    'imap2rss_cache_requests_total': ('counter', 'Server cache lookups by cache and result'),
+}
+
+def _key(labels: Optional[Dict[str, str]]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((labels or {}).items()))
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms keyed by name and labels"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.gauges = {}      # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1):
+        """Increase a counter"""
+        key = (name, _key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        """Set a gauge"""
+        with self.lock:
+            self.gauges[(name, _key(labels))] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None):
+        """Record one observation in a histogram"""
+        key = (name, _key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, str]] = None):
+        """Observe the duration of a block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serializable copy of every metric"""
+        with self.lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, dict(labels), value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, dict(labels), list(values)] for (name, labels), values in self.histograms.items()]
+            }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> 'Registry':
+        """Rebuild a registry published by another process"""
+        registry = cls(snapshot['buckets'])
+        registry.counters = {(name, _key(labels)): value for name, labels, value in snapshot['counters']}
+        registry.gauges = {(name, _key(labels)): value for name, labels, value in snapshot['gauges']}
+        registry.histograms = {(name, _key(labels)): values for name, labels, values in snapshot['histograms']}
+        return registry
+
+    def merge(self, other: 'Registry'):
+        """Add another registry's metrics into this one; both must use the same buckets"""
+        with self.lock:
+            for key, value in other.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(other.gauges)
+            for key, values in other.histograms.items():
+                current = self.histograms.get(key)
+                self.histograms[key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+
+    def write_snapshot(self, path: str):
+        """Publish the registry to a file another process can read"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def render(self) -> str:
+        """Format every metric in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        families = {}
+        for name, labels, value in snapshot['counters'] + snapshot['gauges']:
+            families.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+        for name, labels, values in snapshot['histograms']:
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(snapshot['buckets'], values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=_number(bound)))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(dict(labels, le='+Inf'))} {values[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(values[-2])}")
+            lines.append(f"{name}_count{_labels(labels)} {values[-1]}")
+
+        output = []
+        for name in sorted(families):
+            kind, description = DESCRIPTIONS.get(name, ('untyped', ''))
+            if description:
+                output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(families[name])
+        return '\n'.join(output) + '\n' if output else ''
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+# Metrics of the current process
+REGISTRY = Registry()
+
+def load_snapshot(path: str) -> Optional[Registry]:
+    """Read metrics published by another process, if any"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return Registry.from_snapshot(json.load(f))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Failed to read metrics snapshot {path}: {e}")
+        return None
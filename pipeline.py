@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Staged processing of sync cycles: every stage runs its own worker threads and hands items to the
+next one through a bounded queue, so a slow stage holds back the stages feeding it
+"""
+
+import time
+import queue
+import functools
+import threading
+import logging
+from typing import Dict, Any, List, Optional, Callable
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Items a queue between two stages holds before the stage feeding it waits
+QUEUE_SIZE = 32
+
+# Tells a worker its stage has no more input
+_DONE = object()
+
+class Stage:
+    """One step of a pipeline: process(item, emit) runs for every item on one of the stage's workers and
+    calls emit for each item it passes on. With open_worker, each worker first calls open_worker(index)
+    and the result becomes process's first argument; close_worker receives it when the worker stops"""
+
+    def __init__(self, name: str, process: Callable, workers: int = 1,
+                 open_worker: Optional[Callable] = None, close_worker: Optional[Callable] = None):
+        self.name = name
+        self.process = process
+        self.workers = max(1, workers)
+        self.open_worker = open_worker
+        self.close_worker = close_worker
+        self.queue = None
+        self.threads = []
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.0       # seconds the workers spent processing
+        self.blocked = 0.0    # seconds the previous stage waited for room in this stage's queue
+        self.max_queue = 0
+
+class Pipeline:
+    """Stages connected by queues of at most queue_size items: put() feeds the first stage and waits
+    while its queue is full, close() lets every stage finish its input in order. An inline pipeline
+    runs every item through all stages on the calling thread instead, with one worker per stage"""
+
+    def __init__(self, name: str, stages: List[Stage], queue_size: int = QUEUE_SIZE, trace=None, inline: bool = False):
+        self.name = name
+        self.stages = stages
+        self.trace = trace
+        self.inline = inline
+        self.contexts = []    # per-stage worker values of an inline pipeline
+        self.started = None
+        for stage in stages:
+            stage.queue = queue.Queue(maxsize=max(1, queue_size))
+
+    def start(self):
+        """Start the workers of every stage"""
+        self.started = time.perf_counter()
+        if self.inline:
+            for stage in self.stages:
+                stage.workers = 1
+                self.contexts.append(stage.open_worker(0) if stage.open_worker is not None else None)
+            return
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self.work, args=(index, worker),
+                                          name=f"{self.name}-{stage.name}-{worker}", daemon=True)
+                stage.threads.append(thread)
+                thread.start()
+
+    def put(self, item):
+        """Feed an item to the first stage"""
+        self.send(0, item)
+
+    def send(self, index: int, item):
+        """Queue an item for a stage, waiting while its queue is full; the last stage's output is dropped"""
+        if index >= len(self.stages):
+            return
+        stage = self.stages[index]
+        if self.inline:
+            process = stage.process
+            if stage.open_worker is not None:
+                process = functools.partial(stage.process, self.contexts[index])
+            # Busy time of a stage includes the later stages it hands items to
+            self.run_item(index, process, item)
+            return
+        started = time.perf_counter()
+        stage.queue.put(item)
+        waited = time.perf_counter() - started
+        depth = stage.queue.qsize()
+        with stage.lock:
+            stage.blocked += waited
+            stage.max_queue = max(stage.max_queue, depth)
+        metrics.REGISTRY.set('imap2rss_pipeline_queue_depth', depth, {'stage': stage.name})
+        if waited > 0.001:
+            metrics.REGISTRY.inc('imap2rss_pipeline_blocked_seconds_total', {'stage': stage.name}, waited)
+
+    def work(self, index: int, worker: int):
+        stage = self.stages[index]
+        process = stage.process
+        context = None
+        if stage.open_worker is not None:
+            try:
+                context = stage.open_worker(worker)
+            except Exception as e:
+                # The stage's other workers take its share of the input
+                logger.error(f"Failed to start {stage.name} worker {worker}: {e}")
+                return
+            process = functools.partial(stage.process, context)
+        try:
+            while True:
+                item = stage.queue.get()
+                metrics.REGISTRY.set('imap2rss_pipeline_queue_depth', stage.queue.qsize(), {'stage': stage.name})
+                if item is _DONE:
+                    return
+                self.run_item(index, process, item)
+        finally:
+            if stage.close_worker is not None:
+                try:
+                    stage.close_worker(context)
+                except Exception as e:
+                    logger.error(f"Failed to stop {stage.name} worker {worker}: {e}")
+
+    def run_item(self, index: int, process: Callable, item):
+        """Run one item through a stage, timing it"""
+        stage = self.stages[index]
+        started = time.perf_counter()
+        try:
+            process(item, functools.partial(self.send, index + 1))
+        except Exception as e:
+            logger.error(f"Pipeline stage {stage.name} failed: {e}")
+        elapsed = time.perf_counter() - started
+        with stage.lock:
+            stage.items += 1
+            stage.busy += elapsed
+        metrics.REGISTRY.observe('imap2rss_pipeline_item_seconds', elapsed, {'stage': stage.name})
+
+    def close(self):
+        """Wait until every item has passed through, then record the stages' statistics"""
+        for stage, context in zip(self.stages, self.contexts):
+            if stage.close_worker is not None:
+                try:
+                    stage.close_worker(context)
+                except Exception as e:
+                    logger.error(f"Failed to stop {stage.name} worker: {e}")
+        for stage in self.stages:
+            # Stages finish in order, so everything a stage emits is queued before the next one is told to stop
+            for thread in stage.threads:
+                if thread.is_alive():
+                    stage.queue.put(_DONE)
+            for thread in stage.threads:
+                thread.join()
+            if not stage.queue.empty():
+                logger.error(f"Pipeline stage {stage.name} has no workers left, {stage.queue.qsize()} items dropped")
+        elapsed = time.perf_counter() - self.started
+        for name, stats in self.stats(elapsed).items():
+            metrics.REGISTRY.inc('imap2rss_pipeline_items_total', {'stage': name}, stats['items'])
+            if self.trace:
+                self.trace.stage(name, **stats)
+
+    def stats(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        """Items, throughput, busy and blocked time, and the deepest queue of each stage"""
+        return {stage.name: {
+            'workers': stage.workers,
+            'items': stage.items,
+            'items_per_second': stage.items / elapsed if elapsed > 0 else 0.0,
+            'busy': stage.busy,
+            'blocked': stage.blocked,
+            'max_queue': stage.max_queue
+        } for stage in self.stages}
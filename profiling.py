@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Opt-in cProfile and tracemalloc capture of daemon cycles, requested through data/
+"""
+
+import os
+import io
+import time
+import glob
+import pstats
+import signal
+import cProfile
+import tracemalloc
+import zipfile
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import refresh
+
+logger = logging.getLogger(__name__)
+
+REQUEST_FILE = 'profile_request.json'
+STATUS_FILE = 'profile_status.json'
+PROFILES_DIR = 'profiles'
+
+def request_capture(data_dir: str, cycles: int = 1) -> int:
+    """Ask the daemon to profile its next cycles and wake it with SIGUSR2; returns the request id"""
+    pid = refresh.daemon_pid(data_dir)
+    request = {'id': time.time_ns(), 'cycles': cycles}
+    refresh.write_json(os.path.join(data_dir, REQUEST_FILE), request)
+    try:
+        os.kill(pid, signal.SIGUSR2)
+    except ProcessLookupError:
+        raise refresh.DaemonNotRunning("Converter daemon is not running")
+    return request['id']
+
+def take_request(data_dir: str) -> Optional[Dict[str, Any]]:
+    """Claim a pending capture request, if any; a request written meanwhile waits for the next check"""
+    request_path = os.path.join(data_dir, REQUEST_FILE)
+    taken_path = f"{request_path}.taken"
+    try:
+        os.replace(request_path, taken_path)
+    except FileNotFoundError:
+        return None
+    request = refresh.read_json(taken_path)
+    os.remove(taken_path)
+    return request
+
+def read_status(data_dir: str) -> Optional[Dict[str, Any]]:
+    """The last completed capture, if any"""
+    return refresh.read_json(os.path.join(data_dir, STATUS_FILE))
+
+def wait_for(data_dir: str, request_id: int, timeout: float, poll_interval: float = 0.5) -> Optional[Dict[str, Any]]:
+    """Wait until the capture for a request has been written"""
+    deadline = time.monotonic() + timeout
+    while True:
+        status = read_status(data_dir)
+        if status and status.get('request_id', 0) >= request_id:
+            return status
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll_interval)
+
+def list_captures(data_dir: str) -> List[str]:
+    """Names of the captures on disk, newest first"""
+    paths = glob.glob(os.path.join(data_dir, PROFILES_DIR, 'cycle-*.pstats'))
+    return sorted((os.path.basename(path)[:-len('.pstats')] for path in paths), reverse=True)
+
+def capture_files(data_dir: str, name: str) -> List[str]:
+    """Paths of the files written for one capture"""
+    directory = os.path.join(data_dir, PROFILES_DIR)
+    return glob.glob(os.path.join(directory, f"{name}.*")) + glob.glob(os.path.join(directory, f"{name}-*"))
+
+def capture_archive(data_dir: str, names: List[str]) -> bytes:
+    """Zip the files of some captures for download"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name in names:
+            for path in capture_files(data_dir, name):
+                archive.write(path, os.path.basename(path))
+    return buffer.getvalue()
+
+class CycleProfiler:
+    """Runs cycles under cProfile and tracemalloc, keeping the most recent captures in data/profiles"""
+
+    def __init__(self, data_dir: str, keep: int = 10, top: int = 40):
+        self.data_dir = data_dir
+        self.directory = os.path.join(data_dir, PROFILES_DIR)
+        self.keep = keep
+        self.top = top
+        self.cycles_left = 0
+        self.request_id = 0
+        self.captures = []  # names written for the current request
+        self.active = False  # a profiled cycle is running
+
+    def arm(self, cycles: int, request_id: int = 0):
+        """Profile the next cycles"""
+        self.cycles_left = max(self.cycles_left, cycles)
+        self.request_id = max(self.request_id, request_id)
+        logger.info(f"Profiling the next {self.cycles_left} cycles")
+
+    def run(self, function, *args):
+        """Call function under the profilers and write a capture"""
+        profiler = cProfile.Profile()
+        tracemalloc.start(25)
+        started = time.perf_counter()
+        self.active = True
+        profiler.enable()
+        try:
+            return function(*args)
+        finally:
+            profiler.disable()
+            self.active = False
+            duration = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            try:
+                self.write(profiler, snapshot, peak, duration)
+            except Exception as e:
+                logger.error(f"Failed to write profile: {e}")
+            self.cycles_left -= 1
+            if self.cycles_left <= 0:
+                self.finish()
+
+    def write(self, profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot, peak: int, duration: float):
+        """Dump the pstats file and a text summary of the slowest calls and largest allocations"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"cycle-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        base = os.path.join(self.directory, name)
+        profiler.dump_stats(f"{base}.pstats")
+
+        summary = io.StringIO()
+        summary.write(f"Cycle took {duration:.3f}s, peak traced memory {peak / 1024:.0f} KiB\n\n")
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        summary.write(f"\nTop {self.top} allocations still held at the end of the cycle:\n")
+        for stat in snapshot.statistics('traceback')[:self.top]:
+            summary.write(f"\n{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            summary.write('\n'.join(f"    {line}" for line in stat.traceback.format(limit=5)) + '\n')
+        with open(f"{base}-summary.txt", 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+
+        self.captures.append(name)
+        logger.info(f"Profile written to {base}.pstats")
+        self.rotate()
+
+    def rotate(self):
+        """Delete captures beyond the most recent ones"""
+        for name in list_captures(self.data_dir)[self.keep:]:
+            for path in capture_files(self.data_dir, name):
+                os.remove(path)
+
+    def finish(self):
+        """Publish the captures of the completed request"""
+        refresh.write_json(os.path.join(self.data_dir, STATUS_FILE), {
+            'request_id': self.request_id,
+            'captures': self.captures,
+            'completed_at': time.time()
+        })
+        self.captures = []
+        self.cycles_left = 0
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+On-demand refresh requests passed from the HTTP server to the converter daemon through data/
+"""
+
+import os
+import json
+import time
+import signal
+import threading
+import logging
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+REQUEST_FILE = 'refresh_request.json'
+STATUS_FILE = 'sync_status.json'
+PID_FILE = 'daemon.pid'
+
+# Serializes request merging within the server process
+_request_lock = threading.Lock()
+
+class DaemonNotRunning(Exception):
+    """Raised when no converter daemon can be signalled"""
+
+def read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_json(path: str, data: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def write_pid(data_dir: str):
+    """Record the daemon's process id so the server can wake it; call once its signal handlers are set"""
+    with open(os.path.join(data_dir, PID_FILE), 'w') as f:
+        f.write(str(os.getpid()))
+
+def process_start_time(pid: int) -> Optional[float]:
+    """Unix time a process started, or None where /proc is not available"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name in parentheses may contain spaces; starttime is the 22nd field
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime '))
+    except FileNotFoundError:
+        if os.path.isdir('/proc/self'):
+            raise ProcessLookupError(pid)
+        return None
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+    return boot_time + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+def daemon_pid(data_dir: str) -> int:
+    """Process id of the running daemon, checked against its pid file"""
+    path = os.path.join(data_dir, PID_FILE)
+    try:
+        with open(path) as f:
+            pid = int(f.read().strip())
+        written = os.stat(path).st_mtime
+        started = process_start_time(pid)
+    except (OSError, ValueError):
+        raise DaemonNotRunning("Converter daemon is not running")
+    # The daemon writes the file after it starts, so a process started later has only reused the pid
+    # of a daemon that is gone; the default action of the wake-up signals would terminate it
+    if started is not None and started > written + 1:
+        raise DaemonNotRunning("Converter daemon is not running (stale pid file)")
+    return pid
+
+def request_refresh(data_dir: str, mailboxes: Optional[List[str]] = None) -> int:
+    """Queue a refresh, merging it with one not yet picked up, and wake the daemon; returns the request id"""
+    pid = daemon_pid(data_dir)
+
+    request_path = os.path.join(data_dir, REQUEST_FILE)
+    with _request_lock:
+        pending = read_json(request_path)
+        if pending is not None:
+            # A request covering every mailbox absorbs any narrower one
+            if pending['mailboxes'] is None or mailboxes is None:
+                mailboxes = None
+            else:
+                mailboxes = sorted(set(pending['mailboxes']) | set(mailboxes))
+        # Ids only grow, so waiters on a merged request are satisfied by its completion
+        request = {'id': time.time_ns(), 'mailboxes': mailboxes, 'requested_at': time.time()}
+        write_json(request_path, request)
+
+    try:
+        os.kill(pid, signal.SIGUSR1)
+    except ProcessLookupError:
+        raise DaemonNotRunning("Converter daemon is not running")
+    return request['id']
+
+def request_reload(data_dir: str):
+    """Ask the daemon to re-read .env with SIGHUP"""
+    pid = daemon_pid(data_dir)
+    try:
+        os.kill(pid, signal.SIGHUP)
+    except OSError:
+        raise DaemonNotRunning("Converter daemon is not running")
+
+def take_request(data_dir: str) -> Optional[Dict[str, Any]]:
+    """Claim the pending refresh request, if any; later requests go to the next cycle"""
+    request_path = os.path.join(data_dir, REQUEST_FILE)
+    taken_path = f"{request_path}.taken"
+    try:
+        os.replace(request_path, taken_path)
+    except FileNotFoundError:
+        return None
+    request = read_json(taken_path)
+    os.remove(taken_path)
+    return request
+
+def write_status(data_dir: str, status: Dict[str, Any]):
+    """Publish the outcome of the last sync"""
+    write_json(os.path.join(data_dir, STATUS_FILE), status)
+
+def read_status(data_dir: str) -> Optional[Dict[str, Any]]:
+    """Outcome of the last sync, if the daemon has completed one"""
+    return read_json(os.path.join(data_dir, STATUS_FILE))
+
+def wait_for(data_dir: str, request_id: int, timeout: float, poll_interval: float = 0.2) -> Optional[Dict[str, Any]]:
+    """Wait until a sync covering the request has published its feeds"""
+    deadline = time.monotonic() + timeout
+    while True:
+        status = read_status(data_dir)
+        if status and status.get('request_id', 0) >= request_id:
+            return status
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll_interval)
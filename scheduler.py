@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Daemon scheduling: adaptive per-mailbox polling, fixed-rate cycles and the hung-cycle watchdog
+"""
+
+import sys
+import time
+import math
+import random
+import socket
+import threading
+import traceback
+import logging
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_FILE = 'poll_schedule.json'
+
+# Weight of past observations halves every this many seconds
+RATE_HALF_LIFE = 24 * 3600
+
+# Commands of a probe session besides one STATUS per mailbox (CAPABILITY, LOGIN, LOGOUT)
+SESSION_COMMANDS = 3
+
+# Commands of syncing one changed mailbox apart from its new messages: SELECT, SEARCH and the
+# header FETCH, plus a share of the sync session's own CAPABILITY, LOGIN, LIST, CLOSE and LOGOUT
+SYNC_COMMANDS = 5
+
+# Commands per new message (the FETCH of its body parts), spent however often the mailbox is polled
+MESSAGE_COMMANDS = 1
+
+# Seconds a cycle may run past its deadline before the watchdog shuts its IMAP connection
+WATCHDOG_GRACE = 30
+
+class FixedRateSchedule:
+    """Cycle start times on a fixed grid, so the period does not drift by the length of each cycle;
+    every start is delayed by a random fraction (up to jitter) of the interval"""
+
+    def __init__(self, interval: float, jitter: float = 0.1, start: Optional[float] = None):
+        self.interval = interval
+        self.jitter = jitter
+        self.slot = time.time() if start is None else start
+        self.offset = 0.0
+
+    def configure(self, interval: float, jitter: float, now: float):
+        """Apply a new interval, counted from now"""
+        if (interval, jitter) != (self.interval, self.jitter):
+            self.interval = interval
+            self.jitter = jitter
+            self.slot = now
+            self.offset = 0.0
+
+    def next_run(self) -> float:
+        """Intended start of the next cycle"""
+        return self.slot + self.offset
+
+    def advance(self, now: float) -> int:
+        """Move past the slots whose start has come; returns how many of them a cycle overran and skipped"""
+        if self.next_run() > now:
+            # A refresh ran before the slot; it still runs on time
+            return 0
+        if self.interval <= 0:
+            self.slot = now
+            return 0
+        passed = math.floor((now - self.slot) / self.interval) + 1
+        self.slot += passed * self.interval
+        self.offset = random.uniform(0, self.jitter * self.interval)
+        return passed - 1
+
+class CycleWatchdog:
+    """Shuts down the IMAP connections of a cycle still running WATCHDOG_GRACE seconds past its deadline,
+    so a server that stops or trickles responses cannot stall the daemon"""
+
+    def __init__(self, grace: float = WATCHDOG_GRACE, poll_interval: float = 1.0):
+        self.grace = grace
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.sessions = []        # (IMAP session, id of the thread using it)
+        self.deadline = None      # time.monotonic() value
+        self.thread = None
+
+    def start(self):
+        """Start the watchdog thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='cycle-watchdog', daemon=True)
+            self.thread.start()
+
+    def watch(self, mail, deadline: Optional[float]):
+        """Guard an IMAP session, used by the calling thread, until clear() is called"""
+        with self.lock:
+            self.sessions.append((mail, threading.get_ident()))
+            self.deadline = deadline
+
+    def clear(self):
+        with self.lock:
+            self.sessions = []
+            self.deadline = None
+
+    def run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self.lock:
+                if not self.sessions or self.deadline is None or time.monotonic() < self.deadline + self.grace:
+                    continue
+                sessions, self.sessions = self.sessions, []
+                frames = sys._current_frames()
+            for mail, thread_id in sessions:
+                frame = frames.get(thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame else 'unavailable'
+                logger.warning(f"Cycle is {self.grace}s past its deadline, shutting down an IMAP connection; stuck at:\n{stack}")
+                metrics.REGISTRY.inc('imap2rss_watchdog_aborts_total')
+                try:
+                    # Unblocks a recv waiting on the server; the cycle then fails over to its stored items
+                    mail.sock.shutdown(socket.SHUT_RDWR)
+                except OSError as e:
+                    logger.error(f"Watchdog failed to shut down the IMAP connection: {e}")
+
+class AdaptiveScheduler:
+    """Tracks each mailbox's arrival rate from UIDNEXT and spaces its probes to expect about one new message each,
+    within [min_interval, max_interval] and an hourly IMAP command budget"""
+
+    def __init__(self, min_interval: float = 60, max_interval: float = 3600, command_budget: int = 1000):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.command_budget = command_budget
+        self.mailboxes = {}           # mailbox -> state, see add()
+        self.commands = deque()       # (timestamp, commands) within the last hour
+        self.stretch = 1.0            # factor applied to every interval to respect the budget
+
+    def configure(self, min_interval: float, max_interval: float, command_budget: int):
+        """Apply new bounds, e.g. after a configuration reload"""
+        if (min_interval, max_interval, command_budget) != (self.min_interval, self.max_interval, self.command_budget):
+            self.min_interval = min_interval
+            self.max_interval = max_interval
+            self.command_budget = command_budget
+            self.plan(time.time())
+
+    def add(self, mailbox: str, now: float):
+        """Start tracking a mailbox, due immediately"""
+        self.mailboxes[mailbox] = {
+            'interval': self.min_interval,
+            'next_due': now,
+            'uidvalidity': None,
+            'uidnext': None,
+            'probed_at': None,
+            'arrivals': 0.0,   # decayed count of new messages
+            'observed': 0.0,   # decayed seconds of observation
+        }
+
+    def set_mailboxes(self, mailboxes: List[str], now: Optional[float] = None):
+        """Track exactly the configured mailboxes"""
+        now = time.time() if now is None else now
+        for mailbox in mailboxes:
+            if mailbox not in self.mailboxes:
+                self.add(mailbox, now)
+        for mailbox in list(self.mailboxes):
+            if mailbox not in mailboxes:
+                del self.mailboxes[mailbox]
+
+    def rate(self, mailbox: str) -> float:
+        """Estimated new messages per second"""
+        state = self.mailboxes[mailbox]
+        return state['arrivals'] / state['observed'] if state['observed'] > 0 else 0.0
+
+    def record_probe(self, mailbox: str, uidvalidity: Optional[int], uidnext: Optional[int], now: float):
+        """Fold a STATUS result into the mailbox's arrival rate; UIDNEXT only grows as messages arrive"""
+        state = self.mailboxes.get(mailbox)
+        if state is None:
+            return
+        if (state['probed_at'] is not None and uidnext is not None and state['uidnext'] is not None
+                and uidvalidity == state['uidvalidity'] and uidnext >= state['uidnext']):
+            elapsed = max(now - state['probed_at'], 0.0)
+            decay = 0.5 ** (elapsed / RATE_HALF_LIFE)
+            state['arrivals'] = state['arrivals'] * decay + (uidnext - state['uidnext'])
+            state['observed'] = state['observed'] * decay + elapsed
+        state['uidvalidity'] = uidvalidity
+        state['uidnext'] = uidnext
+        state['probed_at'] = now
+
+    def record_commands(self, commands: int, now: float):
+        """Count IMAP commands against the budget"""
+        if commands:
+            self.commands.append((now, commands))
+
+    def used(self, now: float) -> int:
+        """Commands issued during the last hour"""
+        while self.commands and self.commands[0][0] <= now - 3600:
+            self.commands.popleft()
+        return sum(count for _, count in self.commands)
+
+    def base_interval(self, mailbox: str) -> float:
+        """Seconds in which about one new message is expected, within the bounds"""
+        state = self.mailboxes[mailbox]
+        # With less than one arrival observed, the time watched so far is the best guess,
+        # so a quiet mailbox slows down as it stays quiet rather than jumping to the maximum
+        interval = state['observed'] / max(state['arrivals'], 1.0)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def plan(self, now: float):
+        """Recompute every interval, stretching them all when the expected hourly commands exceed the budget"""
+        if not self.mailboxes:
+            return
+        intervals = {mailbox: self.base_interval(mailbox) for mailbox in self.mailboxes}
+        polling = 0.0
+        messages = 0.0
+        for mailbox, interval in intervals.items():
+            # Mailboxes due together share a session, so the session overhead is split between them
+            changed = min(1.0, self.rate(mailbox) * interval)
+            polling += 3600 / interval * (1 + SESSION_COMMANDS / len(intervals) + changed * SYNC_COMMANDS)
+            messages += self.rate(mailbox) * 3600 * MESSAGE_COMMANDS
+        # Only polling less often saves commands; new messages cost the same either way
+        available = max(self.command_budget - messages, self.command_budget * 0.1)
+        stretch = max(1.0, polling / available) if self.command_budget > 0 else 1.0
+        if stretch > 1.0 and abs(stretch - self.stretch) > 0.1 * self.stretch:
+            logger.warning(f"Polling slowed {stretch:.1f}x to stay within {self.command_budget} IMAP commands per hour")
+        self.stretch = stretch
+        for mailbox, interval in intervals.items():
+            state = self.mailboxes[mailbox]
+            # The budget takes precedence over max_interval
+            state['interval'] = interval * self.stretch
+            if state['probed_at'] is not None:
+                state['next_due'] = state['probed_at'] + state['interval']
+
+    def due(self, now: float) -> List[str]:
+        """Mailboxes to probe now, most overdue first, as many as the remaining budget allows"""
+        due = sorted((mailbox for mailbox, state in self.mailboxes.items() if state['next_due'] <= now),
+                     key=lambda mailbox: self.mailboxes[mailbox]['next_due'])
+        if self.command_budget > 0 and due:
+            allowance = self.command_budget - self.used(now) - SESSION_COMMANDS
+            due = due[:max(0, math.floor(allowance / (1 + SYNC_COMMANDS)))]
+        return due
+
+    def next_due(self, now: float) -> float:
+        """Time of the next probe, later when the budget of the last hour is spent"""
+        if not self.mailboxes:
+            return now + self.max_interval
+        next_due = min(state['next_due'] for state in self.mailboxes.values())
+        if self.command_budget > 0 and self.used(now) + SESSION_COMMANDS + 1 + SYNC_COMMANDS > self.command_budget:
+            # Wait for the oldest commands to leave the window
+            next_due = max(next_due, self.commands[0][0] + 3600 if self.commands else now + self.max_interval)
+        return max(next_due, now)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        """JSON-serializable schedule, for data/poll_schedule.json"""
+        return {
+            'updated_at': now,
+            'commands_last_hour': self.used(now),
+            'command_budget': self.command_budget,
+            'stretch': round(self.stretch, 2),
+            'mailboxes': {mailbox: {
+                'interval': round(state['interval'], 1),
+                'next_due': state['next_due'],
+                'messages_per_hour': round(self.rate(mailbox) * 3600, 3),
+                'uidvalidity': state['uidvalidity'],
+                'uidnext': state['uidnext'],
+                'probed_at': state['probed_at'],
+                'arrivals': state['arrivals'],
+                'observed': state['observed'],
+            } for mailbox, state in self.mailboxes.items()}
+        }
+
+    def restore(self, snapshot: Optional[Dict[str, Any]], now: float):
+        """Resume the rates of a previous run; every restored mailbox is probed right away"""
+        if not snapshot:
+            return
+        for mailbox, saved in snapshot.get('mailboxes', {}).items():
+            state = self.mailboxes.get(mailbox)
+            if state is None:
+                continue
+            for key in ('interval', 'uidvalidity', 'uidnext', 'probed_at', 'arrivals', 'observed'):
+                state[key] = saved.get(key, state[key])
+            state['next_due'] = now
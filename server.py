@@ -7,30 +7,54 @@ from http.server import HTTPServer, SimpleHTTPRequestHandler
 import os
 import logging
 import json
-from urllib.parse import urlparse
+import gzip
+import hashlib
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs, urlencode, quote
+import re
+import envfile
+import feedgen
+from store import ItemStore, FeedQuery, SearchQuery
+from blobs import BlobCache
+from websub import WebSubHub
+import metrics
+import refresh
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_env_file():
-    """Load environment variables from .env file"""
-    env_file = '/app/.env'
-    if not os.path.exists(env_file):
-        env_file = './.env'
-    if os.path.exists(env_file):
-        logger.info(f"Loading environment variables from {env_file}")
-        with open(env_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    os.environ[key] = value
-                    logger.debug(f"Set {key}={value[:20]}...")
-    else:
-        logger.warning("No .env file found")
-
-# Load .env file before doing anything else
-load_env_file()
+# Load .env file before doing anything else; envfile keeps what it set to tell what a reload changes
+envfile.load()
+
+class EnvFileWatcher:
+    """Notices .env changes, so settings saved in the GUI reach a server running apart from the converter"""
+    
+    def __init__(self, check_interval=envfile.CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.checked = time.monotonic()
+        self.mtime = envfile.mtime()
+    
+    def changed(self):
+        """Whether .env was modified since the last call, checked at most once per check interval"""
+        if time.monotonic() - self.checked < self.check_interval:
+            return False
+        with self.lock:
+            if time.monotonic() - self.checked < self.check_interval:
+                return False
+            self.checked = time.monotonic()
+            mtime = envfile.mtime()
+            if mtime == self.mtime:
+                return False
+            self.mtime = mtime
+            return True
 
 def decode_imap_utf7(s):
     """Decode IMAP modified UTF-7 string to normal UTF-8"""
@@ -60,17 +84,454 @@ def decode_imap_utf7(s):
         logger.debug(f"Failed to decode IMAP UTF-7: {s} -> {e}")
         return s  # Return original string if decode fails
 
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into a dict of encoding -> quality"""
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        encoding = parts[0].strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[encoding] = quality
+    return accepted
+
+def route_label(path, query):
+    """Low-cardinality name of the route serving a request path, for metrics"""
+    if path == '/feed.xml' and query:
+        return 'query_feed'
+    if path in ('/', '/feed.xml', '/feeds', '/search.xml', '/health', '/feeds.json', '/metrics', '/hub', '/refresh'):
+        return {'/': 'index', '/feeds': 'feed.xml', '/search.xml': 'search'}.get(path, path[1:])
+    if path.startswith('/blob/'):
+        return 'blob'
+    if path.startswith('/archive/'):
+        return 'archive'
+    if path.endswith('.xml'):
+        return 'mailbox_feed'
+    return 'other'
+
+def content_etag(content):
+    """Strong validator derived from the response bytes, stable across restarts"""
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+def http_date(timestamp):
+    """Format a Unix timestamp as an HTTP date"""
+    return formatdate(timestamp, usegmt=True)
+
+class DynamicFeedCache:
+    """LRU cache of query-driven feeds rendered on demand from the item store"""
+    
+    def __init__(self, store, max_entries=128, ttl=60):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl = ttl  # Only applies to relative time windows such as since=24h
+        self.entries = OrderedDict()  # normalized query key -> cached feed
+        self.lock = threading.Lock()
+        self.seen_seq = store.max_seq()
+        self.settings = None
+        self.load_settings()
+    
+    def load_settings(self):
+        """Pick up the channel settings from the environment, dropping feeds rendered with older ones"""
+        settings = (os.getenv('FEED_TITLE', 'Email RSS Feed'),
+                    os.getenv('FEED_DESCRIPTION', 'RSS feed generated from IMAP emails'),
+                    os.getenv('BASE_URL', 'http://localhost:8888').rstrip('/'))
+        if settings == self.settings:
+            return
+        with self.lock:
+            self.feed_title, self.feed_description, self.base_url = settings
+            self.settings = settings
+            self.entries.clear()
+    
+    def invalidate_changed(self):
+        """Drop cached feeds matched by items stored since the last check"""
+        max_seq = self.store.max_seq()
+        if max_seq == self.seen_seq:
+            return
+        new_items = self.store.get_items_after(None, self.seen_seq, max_seq - self.seen_seq)
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if any(entry['query'].matches(item) for item in new_items):
+                    del self.entries[key]
+            self.seen_seq = max_seq
+    
+    def get(self, query):
+        """Return the cached feed for a query, rendering it if needed"""
+        self.load_settings()
+        self.invalidate_changed()
+        key = query.key()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and query.is_relative and time.time() - entry['rendered_at'] > self.ttl:
+                entry = None
+            if entry:
+                self.entries.move_to_end(key)
+                metrics.REGISTRY.inc('imap2rss_cache_requests_total', {'cache': 'dynamic_feeds', 'result': 'hit'})
+                return entry
+        
+        metrics.REGISTRY.inc('imap2rss_cache_requests_total', {'cache': 'dynamic_feeds', 'result': 'miss'})
+        with metrics.REGISTRY.timer('imap2rss_feed_render_seconds', {'feed': 'query'}):
+            content = self.render(query).encode('utf-8')
+        compressed = gzip.compress(content, mtime=0)
+        entry = {
+            'query': query,
+            'content': content,
+            'gzip': compressed,
+            'etags': {None: content_etag(content), 'gzip': content_etag(compressed)},
+            'rendered_at': time.time()
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+    
+    def render(self, query):
+        """Render the RSS document for a query"""
+        link = f"{self.base_url}{query.path}?{urlencode(query.canonical_params())}"
+        rss, channel = feedgen.create_channel(
+            f"{self.feed_title} - {query.describe()}", self.feed_description, link, "IMAP to RSS Converter")
+        
+        single_mailbox = query.mailboxes and len(query.mailboxes) == 1
+        for email_data in query.run(self.store):
+            if single_mailbox:
+                title, description = feedgen.format_mailbox_item(email_data)
+            else:
+                title, description = feedgen.format_combined_item(email_data)
+            feedgen.add_item(channel, email_data, title, description)
+        
+        return feedgen.to_pretty_xml(rss)
+
+class FeedFileCache:
+    """LRU cache of feed files and their precompressed sidecars, revalidated against the files' stat"""
+    
+    def __init__(self, data_dir, suffixes, max_entries=64, revalidate_interval=1.0, inline_max=131072):
+        self.data_dir = data_dir
+        self.suffixes = suffixes
+        self.max_entries = max_entries
+        # Larger files are streamed from disk with sendfile instead of being held in memory
+        self.inline_max = inline_max
+        # Files are only re-stat'ed once per interval; app.py replaces them atomically
+        self.revalidate_interval = revalidate_interval
+        self.entries = OrderedDict()  # feed name -> cached variants
+        self.lock = threading.Lock()
+    
+    def signature(self, feed_path):
+        """Identify the current version of a feed and its sidecars by mtime and size"""
+        try:
+            feed_stat = os.stat(feed_path)
+        except OSError:
+            return None
+        signature = [(feed_stat.st_mtime_ns, feed_stat.st_size)]
+        for encoding, suffix in self.suffixes:
+            try:
+                sidecar_stat = os.stat(feed_path + suffix)
+            except OSError:
+                signature.append(None)
+                continue
+            # A sidecar older than the feed belongs to a previous version
+            if sidecar_stat.st_mtime_ns >= feed_stat.st_mtime_ns:
+                signature.append((sidecar_stat.st_mtime_ns, sidecar_stat.st_size))
+            else:
+                signature.append(None)
+        return tuple(signature)
+    
+    def get(self, feed_name):
+        """Return the cached variants of a feed, or None if it does not exist"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(feed_name)
+            if entry and now - entry['checked_at'] < self.revalidate_interval:
+                self.entries.move_to_end(feed_name)
+                metrics.REGISTRY.inc('imap2rss_cache_requests_total', {'cache': 'feed_files', 'result': 'hit'})
+                return entry
+        
+        feed_path = os.path.join(self.data_dir, feed_name)
+        signature = self.signature(feed_path)
+        if signature is None:
+            with self.lock:
+                self.entries.pop(feed_name, None)
+            return None
+        if entry and entry['signature'] == signature:
+            entry['checked_at'] = now
+            metrics.REGISTRY.inc('imap2rss_cache_requests_total', {'cache': 'feed_files', 'result': 'hit'})
+            return entry
+        
+        metrics.REGISTRY.inc('imap2rss_cache_requests_total', {'cache': 'feed_files', 'result': 'miss'})
+        try:
+            entry = self.load(feed_path, signature)
+        except OSError:
+            # Replaced between stat and open; the next request picks up the new version
+            return None
+        entry['checked_at'] = now
+        with self.lock:
+            self.entries[feed_name] = entry
+            self.entries.move_to_end(feed_name)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+    
+    def warm(self, file_names):
+        """Load files left by a previous run, so the first requests after a restart are served from memory"""
+        loaded = 0
+        for file_name in file_names[:self.max_entries]:
+            feed_path = os.path.join(self.data_dir, file_name)
+            signature = self.signature(feed_path)
+            if signature is None:
+                continue
+            try:
+                entry = self.load(feed_path, signature)
+            except OSError:
+                continue
+            entry['checked_at'] = time.monotonic()
+            with self.lock:
+                self.entries[file_name] = entry
+            loaded += 1
+        return loaded
+    
+    def invalidate(self, feed_name):
+        """Forget a feed so the next lookup reloads it"""
+        with self.lock:
+            self.entries.pop(feed_name, None)
+    
+    def publish(self, file_name, contents):
+        """Swap in a file the converter in this process just wrote, without reading it back"""
+        feed_path = os.path.join(self.data_dir, file_name)
+        signature = self.signature(feed_path)
+        if signature is None:
+            return
+        paths = [(None, feed_path)] + [(encoding, feed_path + suffix) for encoding, suffix in self.suffixes]
+        variants = {}
+        for (encoding, path), file_stat in zip(paths, signature):
+            if file_stat is None:
+                continue
+            content = contents.get(encoding)
+            if content is None or len(content) != file_stat[1]:
+                # Replaced again since it was written; read what is on disk
+                self.invalidate(file_name)
+                return
+            variants[encoding] = {'content': content if len(content) <= self.inline_max else None,
+                                  'path': path, 'stat': file_stat, 'etag': content_etag(content)}
+        entry = {
+            'signature': signature,
+            'variants': variants,
+            'last_modified': signature[0][0] / 1e9,
+            'checked_at': time.monotonic()
+        }
+        with self.lock:
+            self.entries[file_name] = entry
+            self.entries.move_to_end(file_name)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def load(self, feed_path, signature):
+        """Read a feed and its current sidecars, or just their validators if too large to keep"""
+        paths = [(None, feed_path)] + [(encoding, feed_path + suffix) for encoding, suffix in self.suffixes]
+        variants = {}
+        for (encoding, path), file_stat in zip(paths, signature):
+            if file_stat is None:
+                continue
+            with open(path, 'rb') as f:
+                if file_stat[1] <= self.inline_max:
+                    content = f.read()
+                    etag = content_etag(content)
+                else:
+                    content = None
+                    etag = f'"{hashlib.file_digest(f, "sha256").hexdigest()[:32]}"'
+            variants[encoding] = {'content': content, 'path': path, 'stat': file_stat, 'etag': etag}
+        return {
+            'signature': signature,
+            'variants': variants,
+            # app.py only rewrites a feed when its items change
+            'last_modified': signature[0][0] / 1e9
+        }
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTP server handling connections on a bounded pool of worker threads"""
+    
+    # Listen backlog, so bursts of pollers are queued by the kernel instead of refused
+    request_queue_size = 1024
+    
+    def __init__(self, server_address, handler_class, workers=32, backlog=256):
+        self.pending = queue.Queue(maxsize=backlog)
+        super().__init__(server_address, handler_class)
+        # Connections still sending a request line and headers -> when they must be done
+        self.header_deadlines = {}
+        self.deadline_lock = threading.Lock()
+        threading.Thread(target=self.deadline_loop, name="http-header-deadlines", daemon=True).start()
+        self.workers = []
+        for index in range(workers):
+            worker = threading.Thread(target=self.worker_loop, name=f"http-worker-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def watch_headers(self, connection, timeout):
+        """Give a connection until the timeout to send the next request's headers"""
+        with self.deadline_lock:
+            self.header_deadlines[connection] = time.monotonic() + timeout
+    
+    def headers_read(self, connection):
+        with self.deadline_lock:
+            self.header_deadlines.pop(connection, None)
+    
+    def deadline_loop(self):
+        """Cut off connections that trickle their headers; the socket timeout only bounds each read"""
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            with self.deadline_lock:
+                expired = [connection for connection, deadline in self.header_deadlines.items() if deadline <= now]
+                for connection in expired:
+                    del self.header_deadlines[connection]
+            for connection in expired:
+                try:
+                    # The worker's blocked read returns and the handler closes the connection
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+    
+    def process_request(self, request, client_address):
+        """Hand the connection to a worker, refusing it when the backlog is full"""
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+    
+    def worker_loop(self):
+        """Serve queued connections until shutdown"""
+        while True:
+            request, client_address = self.pending.get()
+            if request is None:
+                break
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+    
+    def handle_error(self, request, client_address):
+        """Clients dropping connections is routine under load; report anything else"""
+        if isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            logger.debug(f"Connection from {client_address[0]} dropped")
+            return
+        super().handle_error(request, client_address)
+    
+    @property
+    def busy(self):
+        """Whether connections are waiting for a free worker"""
+        return not self.pending.empty()
+    
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            self.pending.put((None, None))
+
 class RSSHandler(SimpleHTTPRequestHandler):
+    
+    # HTTP/1.1 keep-alive; every response must carry a Content-Length
+    protocol_version = 'HTTP/1.1'
+    
+    # Socket timeout per connection, so idle or stalled clients release their worker
+    timeout = int(os.getenv('HTTP_TIMEOUT', '10'))
+    
+    # Overall limit on receiving a request line and headers, so a client sending them byte by byte
+    # cannot hold a worker indefinitely; enforced by ThreadPoolHTTPServer
+    header_timeout = float(os.getenv('HTTP_HEADER_TIMEOUT', '15'))
+    
+    # Precompressed sidecars written by app.py, in order of preference
+    ENCODING_SUFFIXES = [('gzip', '.gz'), ('deflate', '.deflate')]
+    
+    # Attachment types shown inline; anything else is sent as a download, since a sender-chosen
+    # type such as text/html or image/svg+xml would run script on the feed's origin
+    INLINE_CONTENT_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+    
+    # Feed files held in memory, set up by create_server
+    feed_files = None
+    
+    # Query-driven feeds, set up by run_server
+    dynamic_feeds = None
+    
+    # Optional WebSub hub, set up by run_server
+    websub = None
+    
+    # Whether /metrics adds the snapshot published by a converter running in another process
+    merge_daemon_metrics = True
+    
+    # Lazily downloaded attachments, set up by run_server
+    blob_cache = None
+    blob_fetcher = None
+    blob_fetcher_lock = threading.Lock()
+    
+    # Downloads in progress by (item id, section) -> [lock, requests using it]; other parts download in parallel
+    blob_fetch_locks = {}
+    blob_fetch_locks_lock = threading.Lock()
+    
+    # Use local data dir if not running in Docker; resolved once by create_server
+    data_dir = None
+    
+    # Watches .env when the server runs apart from the converter, set up by run_server
+    env_watcher = None
+    
     def __init__(self, *args, **kwargs):
-        # Use local data dir if not running in Docker
-        data_dir = "/app/data" if os.path.exists("/app/data") else "./data"
-        super().__init__(*args, directory=data_dir, **kwargs)
+        super().__init__(*args, directory=self.data_dir, **kwargs)
+    
+    def reload_settings(self):
+        """Apply .env changes saved since the server started"""
+        if self.env_watcher is None or not self.env_watcher.changed():
+            return
+        if self.blob_fetcher is not None:
+            # Attachments are downloaded with the saved credentials too; its reload applies .env for the process
+            try:
+                self.blob_fetcher.reload_config()
+            except Exception as e:
+                logger.error(f"Failed to reload the attachment client's settings: {e}")
+            return
+        try:
+            changed = envfile.reload()
+        except OSError as e:
+            logger.error(f"Failed to read {envfile.find_env_file()}: {e}")
+            return
+        if changed:
+            logger.info(f"Configuration reloaded, changed: {', '.join(changed)}")
     
     def do_GET(self):
-        if self.path == '/':
+        started = time.perf_counter()
+        self.response_status = None
+        self.reload_settings()
+        try:
+            self.route_get()
+        finally:
+            self.record_request(started)
+    
+    def route_get(self):
+        parsed_url = urlparse(self.path)
+        if parsed_url.path == '/feed.xml' and parsed_url.query:
+            self.serve_dynamic_feed(FeedQuery, parse_qs(parsed_url.query))
+        elif parsed_url.path == '/search.xml':
+            self.serve_dynamic_feed(SearchQuery, parse_qs(parsed_url.query))
+        elif re.match(r'^/blob/[0-9a-f]{32}/[\d.]+$', parsed_url.path):
+            _, _, item_id, section = parsed_url.path.split('/')
+            self.serve_blob(item_id, section)
+        elif self.path == '/':
             self.serve_feeds_index()
         elif self.path == '/feed.xml' or self.path == '/feeds':
             self.serve_rss_feed('feed.xml')
+        elif self.path.startswith('/archive/') and self.path.endswith('.xml'):
+            # Archive pages never change once written
+            self.serve_rss_feed(self.path[1:], cache_control='public, max-age=31536000, immutable')
         elif self.path.endswith('.xml'):
             # Serve specific mailbox feed
             feed_name = self.path[1:]  # Remove leading slash
@@ -78,152 +539,540 @@ class RSSHandler(SimpleHTTPRequestHandler):
         elif self.path == '/health':
             self.send_response(200)
             self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', '2')
             self.end_headers()
             self.wfile.write(b'OK')
         elif self.path == '/feeds.json':
             self.serve_feeds_json()
+        elif self.path == '/metrics':
+            self.serve_metrics()
         else:
             self.send_error(404, "Not found")
     
-    def serve_feeds_index(self):
-        """Serve an HTML index of available feeds"""
-        try:
-            # Load feeds index
-            data_dir = "/app/data" if os.path.exists("/app/data") else "./data"
-            index_path = os.path.join(data_dir, "feeds_index.json")
-            if os.path.exists(index_path):
-                with open(index_path, 'r') as f:
-                    feeds_data = json.load(f)
+    def do_POST(self):
+        started = time.perf_counter()
+        self.response_status = None
+        self.reload_settings()
+        try:
+            parsed_url = urlparse(self.path)
+            if parsed_url.path == '/hub' and self.websub is not None:
+                self.serve_hub()
+            elif parsed_url.path == '/refresh':
+                self.serve_refresh(parse_qs(parsed_url.query))
             else:
-                feeds_data = {'feeds': ['feed'], 'mailboxes': ['INBOX']}
-            
-            html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>IMAP2RSS - Available Feeds</title>
-    <style>
-        body {{ font-family: Arial, sans-serif; margin: 40px; background: #f5f5f5; }}
-        .container {{ max-width: 800px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px; }}
-        h1 {{ color: #333; }}
-        .feed-list {{ list-style: none; padding: 0; }}
-        .feed-item {{ background: #f8f9fa; margin: 10px 0; padding: 15px; border-radius: 5px; border-left: 4px solid #007bff; }}
-        .feed-item a {{ text-decoration: none; color: #007bff; font-weight: bold; }}
-        .feed-item small {{ color: #666; display: block; margin-top: 5px; }}
-        .info {{ background: #e7f3ff; padding: 15px; border-radius: 5px; margin: 20px 0; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>📰 Available RSS Feeds</h1>
-        
-        <div class="info">
-            <strong>Mode:</strong> {feeds_data.get('feed_mode', 'combined')}<br>
-            <strong>Monitored folders:</strong> {', '.join([decode_imap_utf7(mb) for mb in feeds_data.get('mailboxes', ['INBOX'])])}<br>
-            <strong>Last update:</strong> {feeds_data.get('generated_at', 'Unknown')}
-        </div>
-        
-        <h2>RSS Feeds:</h2>
-        <ul class="feed-list">"""
+                self.send_error(404, "Not found")
+        finally:
+            self.record_request(started)
+    
+    def serve_refresh(self, params):
+        """Wake the converter for an immediate sync, optionally waiting until its feeds are published"""
+        mailboxes = params.get('mailbox')
+        unknown = [mb for mb in mailboxes or [] if not self.configured_mailbox(mb)]
+        if unknown:
+            self.send_error(400, f"Unknown mailbox: {', '.join(unknown)}")
+            return
+        
+        try:
+            request_id = refresh.request_refresh(self.data_dir, mailboxes)
+        except refresh.DaemonNotRunning as e:
+            self.send_error(503, str(e))
+            return
+        except Exception as e:
+            logger.error(f"Error requesting refresh: {e}")
+            self.send_error(500, f"Error: {e}")
+            return
+        
+        response = {'request_id': request_id, 'mailboxes': mailboxes, 'status': 'queued'}
+        status_code = 202
+        if params.get('wait', ['0'])[0].lower() in ('1', 'true', 'yes'):
+            status = refresh.wait_for(self.data_dir, request_id, float(os.getenv('REFRESH_WAIT_TIMEOUT', '60')))
+            if status is None:
+                response['status'] = 'timeout'
+                status_code = 504
+            else:
+                response.update(status=status['result'], completed_at=status['completed_at'])
+                status_code = 200
+        
+        content = json.dumps(response).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def configured_mailbox(self, mailbox: str) -> bool:
+        """Whether MAILBOXES names the mailbox, directly or through a pattern"""
+        from app import mailbox_pattern, FOLDER_LIST_FILE
+        # Patterns are matched with the delimiter of the daemon's last LIST
+        folder_list = refresh.read_json(os.path.join(self.data_dir, FOLDER_LIST_FILE)) or {}
+        if mailbox in folder_list.get('unselectable', []):
+            return False
+        delimiter = folder_list.get('delimiter') or '/'
+        for entry in os.getenv('MAILBOXES', 'INBOX').split(','):
+            entry = entry.strip()
+            if '*' in entry or '%' in entry:
+                if mailbox_pattern(entry, delimiter).fullmatch(mailbox):
+                    return True
+            elif entry and entry == mailbox:
+                return True
+        return False
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def record_request(self, started):
+        """Record latency and status of the request just handled"""
+        parsed_url = urlparse(self.path)
+        route = route_label(parsed_url.path, parsed_url.query)
+        metrics.REGISTRY.observe('imap2rss_http_request_seconds', time.perf_counter() - started, {'route': route})
+        metrics.REGISTRY.inc('imap2rss_http_responses_total',
+                             {'route': route, 'status': str(getattr(self, 'response_status', 0))})
+    
+    def serve_metrics(self):
+        """Serve server and converter metrics in the Prometheus text format"""
+        registry = metrics.Registry.from_snapshot(metrics.REGISTRY.snapshot())
+        # The converter runs in its own process and publishes a snapshot after each cycle
+        daemon_metrics = None
+        if self.merge_daemon_metrics:
+            daemon_metrics = metrics.load_snapshot(os.path.join(self.data_dir, 'daemon_metrics.json'))
+        if daemon_metrics is not None:
+            registry.merge(daemon_metrics)
+        self.send_generated('text/plain; version=0.0.4; charset=utf-8', registry.render().encode('utf-8'))
+    
+    def serve_hub(self):
+        """Handle WebSub subscribe, unsubscribe and publish requests"""
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+        except ValueError:
+            length = -1
+        if length < 0 or length > 65536:
+            self.send_error(400, "Invalid request body")
+            return
+        body = self.rfile.read(length).decode('utf-8', errors='replace')
+        
+        try:
+            status, message = self.websub.handle(parse_qs(body), self.client_address[0], self.headers.get('Authorization'))
+            content = message.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except Exception as e:
+            logger.error(f"Error handling WebSub request: {e}")
+            self.send_error(500, f"Error: {e}")
+    
+    def serve_feeds_index(self):
+        """Serve the HTML index of available feeds rendered by the converter"""
+        if self.serve_data_file('index.html', 'text/html; charset=utf-8'):
+            return
+        # Nothing generated yet: show the defaults
+        feeds_data = {'feeds': ['feed'], 'mailboxes': ['INBOX']}
+        mailbox_names = [decode_imap_utf7(mb) for mb in feeds_data['mailboxes']]
+        self.send_generated('text/html; charset=utf-8', feedgen.render_feeds_index(feeds_data, mailbox_names).encode('utf-8'))
+    
+    def serve_rss_feed(self, feed_name, cache_control='public, max-age=30'):
+        """Serve a specific RSS feed"""
+        if not self.serve_data_file(feed_name, 'application/rss+xml; charset=utf-8', cache_control):
+            self.send_error(404, f"RSS feed {feed_name} not found. Check if the IMAP converter is running.")
+    
+    def serve_data_file(self, file_name, content_type, cache_control='public, max-age=30'):
+        """Serve a file written by the converter from the feed cache; False if it does not exist"""
+        entry = None if '..' in file_name.split('/') else self.feed_files.get(file_name)
+        if entry is None:
+            return False
+        
+        try:
+            encoding = self.choose_encoding(entry['variants'])
+            variant = entry['variants'][encoding]
+            validators = {
+                'ETag': variant['etag'],
+                'Last-Modified': http_date(entry['last_modified']),
+                # Better caching for RSS feeds - cache for 30 seconds
+                'Cache-Control': cache_control,
+                'Vary': 'Accept-Encoding'
+            }
+            if self.is_not_modified(validators['ETag'], entry['last_modified']):
+                self.send_not_modified(validators)
+                return True
             
-            for feed in feeds_data.get('feeds', []):
-                feed_url = f"http://localhost:8888/{feed}.xml"
-                if feed == 'feed':
-                    description = "Combined feed with all emails"
-                else:
-                    description = f"Emails from folder: {feed}"
-                    
-                html += f"""
-            <li class="feed-item">
-                <a href="/{feed}.xml">{feed}.xml</a>
-                <small>{description}</small>
-                <small><strong>FreshRSS URL:</strong> <code>{feed_url}</code></small>
-            </li>"""
+            headers = {'Content-Type': content_type}
+            if encoding:
+                headers['Content-Encoding'] = encoding
+            headers.update(validators)
             
-            html += """
-        </ul>
-        
-        <h2>APIs:</h2>
-        <ul class="feed-list">
-            <li class="feed-item">
-                <a href="/feeds.json">feeds.json</a>
-                <small>List of feeds in JSON format</small>
-            </li>
-            <li class="feed-item">
-                <a href="/health">health</a>
-                <small>Service health status</small>
-            </li>
-        </ul>
-    </div>
-</body>
-</html>"""
+            if variant['content'] is not None:
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(variant['content'])))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(variant['content'])
+                return True
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html.encode('utf-8'))
+            with open(variant['path'], 'rb') as f:
+                file_stat = os.fstat(f.fileno())
+                if (file_stat.st_mtime_ns, file_stat.st_size) != variant['stat']:
+                    # Replaced since the last revalidation; reload before answering
+                    self.feed_files.invalidate(file_name)
+                    return self.serve_data_file(file_name, content_type, cache_control)
+                self.send_file(f, file_stat.st_size, headers)
             
+        except ConnectionError:
+            # Client went away mid-response
+            self.close_connection = True
         except Exception as e:
-            logger.error(f"Error serving feeds index: {e}")
-            self.send_error(500, f"Error: {e}")
+            logger.error(f"Error serving {file_name}: {e}")
+            self.send_error(500, f"Error reading {file_name}: {e}")
+        return True
     
-    def serve_rss_feed(self, feed_name):
-        """Serve a specific RSS feed"""
-        data_dir = "/app/data" if os.path.exists("/app/data") else "./data"
-        feed_path = os.path.join(data_dir, feed_name)
+    def serve_dynamic_feed(self, query_class, params):
+        """Serve a feed filtered or searched by URL parameters, rendered from the item store"""
+        if self.dynamic_feeds is None:
+            self.send_error(503, "Item store not available")
+            return
+        if query_class is SearchQuery and not self.dynamic_feeds.store.fts_enabled:
+            self.send_error(503, "Search not available: SQLite was built without FTS5")
+            return
         
-        if not os.path.exists(feed_path):
-            self.send_error(404, f"RSS feed {feed_name} not found. Check if the IMAP converter is running.")
+        try:
+            query = query_class.from_params(params, int(os.getenv('MAX_EMAILS', '50')),
+                                          int(os.getenv('DYNAMIC_FEED_MAX_LIMIT', '500')))
+        except ValueError as e:
+            self.send_error(400, str(e))
             return
         
         try:
-            with open(feed_path, 'rb') as f:
-                content = f.read()
+            entry = self.dynamic_feeds.get(query)
+            if self.accepts_encoding('gzip'):
+                encoding, content = 'gzip', entry['gzip']
+            else:
+                encoding, content = None, entry['content']
+            validators = {
+                'ETag': entry['etags'][encoding],
+                'Last-Modified': http_date(entry['rendered_at']),
+                'Cache-Control': 'public, max-age=30',
+                'Vary': 'Accept-Encoding'
+            }
+            if self.is_not_modified(validators['ETag'], entry['rendered_at']):
+                self.send_not_modified(validators)
+                return
             
             self.send_response(200)
             self.send_header('Content-Type', 'application/rss+xml; charset=utf-8')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
             self.send_header('Content-Length', str(len(content)))
-            # Better caching for RSS feeds - cache for 30 seconds
-            self.send_header('Cache-Control', 'public, max-age=30')
-            self.send_header('ETag', f'"{hash(content) % 1000000}"')
+            for name, value in validators.items():
+                self.send_header(name, value)
             self.end_headers()
             self.wfile.write(content)
             
+        except ConnectionError:
+            # Client went away mid-response
+            self.close_connection = True
         except Exception as e:
-            logger.error(f"Error serving RSS feed {feed_name}: {e}")
-            self.send_error(500, f"Error reading RSS feed: {e}")
+            logger.error(f"Error serving dynamic feed {self.path}: {e}")
+            self.send_error(500, f"Error rendering feed: {e}")
     
-    def serve_feeds_json(self):
-        """Serve feeds list as JSON"""
+    def serve_blob(self, item_id, section):
+        """Serve an attachment or inline image, fetching it from IMAP on first request"""
+        if self.blob_cache is None or self.dynamic_feeds is None:
+            self.send_error(503, "Blob cache not available")
+            return
+        
+        store = self.dynamic_feeds.store
+        part = store.get_part(item_id, section)
+        if not part:
+            self.send_error(404, "Attachment not found")
+            return
+        
+        # A message part never changes once its UID is assigned
+        validators = {'Cache-Control': 'public, max-age=31536000, immutable'}
+        if part['blob_hash']:
+            validators['ETag'] = f'"{part["blob_hash"]}"'
+            if self.is_not_modified(validators['ETag']):
+                self.send_not_modified(validators)
+                return
+        
         try:
-            data_dir = "/app/data" if os.path.exists("/app/data") else "./data"
-            index_path = os.path.join(data_dir, "feeds_index.json")
-            if os.path.exists(index_path):
-                with open(index_path, 'rb') as f:
-                    content = f.read()
+            blob_path = self.blob_cache.get(part['blob_hash']) if part['blob_hash'] else None
+            metrics.REGISTRY.inc('imap2rss_cache_requests_total',
+                                 {'cache': 'blobs', 'result': 'miss' if blob_path is None else 'hit'})
+            if blob_path is None:
+                # One download per part; a concurrent request may have fetched it already
+                with self.blob_fetch_lock(item_id, section):
+                    part = store.get_part(item_id, section)
+                    blob_path = self.blob_cache.get(part['blob_hash']) if part['blob_hash'] else None
+                    if blob_path is None:
+                        data = self.get_blob_fetcher().fetch_part(
+                            part['mailbox'], part['uidvalidity'], part['uid'], section, part['encoding'])
+                        digest = self.blob_cache.put(data)
+                        store.set_part_blob(item_id, section, digest, len(data))
+                        part['blob_hash'] = digest
+                        blob_path = self.blob_cache.path(digest)
+            
+            content_type = (part['content_type'] or '').split(';', 1)[0].strip().lower()
+            if content_type in self.INLINE_CONTENT_TYPES:
+                headers = {'Content-Type': content_type, 'Content-Disposition': 'inline'}
             else:
-                content = json.dumps({'feeds': ['feed'], 'mailboxes': ['INBOX']}).encode('utf-8')
+                headers = {'Content-Type': 'application/octet-stream', 'Content-Disposition': 'attachment'}
+            headers['X-Content-Type-Options'] = 'nosniff'
+            if part['filename']:
+                # Header-safe ASCII name, with the original in filename* for clients that support it
+                filename = re.sub(r'[^\x20-\x7e]|["\\]', '_', part['filename'])
+                headers['Content-Disposition'] += f'; filename="{filename}"; filename*=UTF-8\'\'{quote(part["filename"])}'
+            validators['ETag'] = f'"{part["blob_hash"]}"'
+            headers.update(validators)
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json; charset=utf-8')
-            self.send_header('Content-Length', str(len(content)))
-            self.end_headers()
-            self.wfile.write(content)
+            with open(blob_path, 'rb') as f:
+                self.send_file(f, os.fstat(f.fileno()).st_size, headers)
             
+        except ConnectionError:
+            # Client went away mid-response
+            self.close_connection = True
         except Exception as e:
-            logger.error(f"Error serving feeds JSON: {e}")
-            self.send_error(500, f"Error: {e}")
+            logger.error(f"Error serving blob {item_id}/{section}: {e}")
+            self.send_error(502, f"Error fetching attachment: {e}")
+    
+    @classmethod
+    def get_blob_fetcher(cls):
+        """IMAP client used to download parts, created on first use"""
+        with cls.blob_fetcher_lock:
+            if cls.blob_fetcher is None:
+                from app import ImapToRss
+                cls.blob_fetcher = ImapToRss()
+        return cls.blob_fetcher
+    
+    @classmethod
+    @contextmanager
+    def blob_fetch_lock(cls, item_id, section):
+        """Hold the download lock of one part, dropping it once no request waits on it"""
+        key = (item_id, section)
+        with cls.blob_fetch_locks_lock:
+            entry = cls.blob_fetch_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with cls.blob_fetch_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del cls.blob_fetch_locks[key]
+    
+    def send_file(self, f, size, headers):
+        """Send an open file with sendfile, honouring a single byte range"""
+        try:
+            byte_range = self.requested_range(size, headers.get('ETag'))
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        
+        if byte_range is None:
+            offset, count = 0, size
+            self.send_response(200)
+        else:
+            offset, count = byte_range[0], byte_range[1] - byte_range[0] + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {byte_range[0]}-{byte_range[1]}/{size}')
+        self.send_header('Content-Length', str(count))
+        self.send_header('Accept-Ranges', 'bytes')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        
+        if count:
+            # Copies from the page cache to the socket without passing through Python
+            self.connection.sendfile(f, offset, count)
+    
+    def requested_range(self, size, etag):
+        """Parse a single-range Range header into (first, last), or None to send everything"""
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if not match or not any(match.groups()):
+            return None
+        # A stale If-Range means the client's partial copy is useless
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() != etag:
+            return None
+        
+        first, last = match.groups()
+        if not first:
+            # Suffix range: the last N bytes
+            if int(last) == 0 or size == 0:
+                raise ValueError("Unsatisfiable range")
+            return max(0, size - int(last)), size - 1
+        if int(first) >= size:
+            raise ValueError("Unsatisfiable range")
+        end = min(int(last), size - 1) if last else size - 1
+        if end < int(first):
+            return None
+        return int(first), end
+    
+    def is_not_modified(self, etag, last_modified=None):
+        """Evaluate If-None-Match, or If-Modified-Since when no entity tags were sent"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # Weak comparison, as required for If-None-Match
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+        
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            # HTTP dates have one-second resolution
+            return int(last_modified) <= since
+        return False
+    
+    def send_not_modified(self, validators):
+        """Answer a conditional request whose cached copy is still current"""
+        self.send_response(304)
+        for name, value in validators.items():
+            self.send_header(name, value)
+        self.end_headers()
+    
+    def accepts_encoding(self, encoding):
+        """Check whether the client accepts a content encoding"""
+        accepted = parse_accept_encoding(self.headers.get('Accept-Encoding', ''))
+        return accepted.get(encoding, accepted.get('*', 0)) > 0
+    
+    def choose_encoding(self, variants):
+        """Pick the best precompressed variant of a feed accepted by the client"""
+        for encoding, _ in self.ENCODING_SUFFIXES:
+            if encoding in variants and self.accepts_encoding(encoding):
+                return encoding
+        return None
+    
+    def serve_feeds_json(self):
+        """Serve feeds list as JSON"""
+        if self.serve_data_file('feeds_index.json', 'application/json; charset=utf-8'):
+            return
+        self.send_generated('application/json; charset=utf-8',
+                            json.dumps({'feeds': ['feed'], 'mailboxes': ['INBOX']}).encode('utf-8'))
+    
+    def send_generated(self, content_type, content):
+        """Send a small body rendered on the fly"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def handle_one_request(self):
+        watch_headers = getattr(self.server, 'watch_headers', None)
+        if watch_headers is None:
+            super().handle_one_request()
+            return
+        watch_headers(self.connection, self.header_timeout)
+        try:
+            super().handle_one_request()
+        finally:
+            self.server.headers_read(self.connection)
+    
+    def parse_request(self):
+        # Request line and headers are in once parsed; the deadline does not cover the response
+        result = super().parse_request()
+        if hasattr(self.server, 'headers_read'):
+            self.server.headers_read(self.connection)
+        return result
+    
+    def end_headers(self):
+        # Free the worker for waiting clients instead of holding it for keep-alive
+        if getattr(self.server, 'busy', False) and not self.close_connection:
+            self.send_header('Connection', 'close')
+        super().end_headers()
     
     def log_message(self, format, *args):
         logger.info(f"{self.address_string()} - {format % args}")
 
-def run_server():
+def create_server(server_address, workers):
+    """Create the HTTP server, using a worker pool unless workers is 0"""
+    data_dir = "/app/data" if os.path.exists("/app/data") else "./data"
+    RSSHandler.data_dir = data_dir
+    RSSHandler.feed_files = FeedFileCache(
+        data_dir, RSSHandler.ENCODING_SUFFIXES,
+        max_entries=int(os.getenv('FEED_CACHE_SIZE', '64')),
+        revalidate_interval=float(os.getenv('FEED_CACHE_REVALIDATE', '1')),
+        inline_max=int(os.getenv('FEED_CACHE_INLINE_KB', '128')) * 1024)
+    if workers > 0:
+        return ThreadPoolHTTPServer(server_address, RSSHandler, workers=workers,
+                                    backlog=int(os.getenv('HTTP_BACKLOG', '256')))
+    # Keep-alive would let one client monopolize a single-threaded server
+    RSSHandler.protocol_version = 'HTTP/1.0'
+    return HTTPServer(server_address, RSSHandler)
+
+def warm_feed_cache(data_dir):
+    """Preload the feeds listed in the last feed index into the serving cache"""
+    try:
+        with open(os.path.join(data_dir, 'feeds_index.json'), 'r', encoding='utf-8') as f:
+            feed_names = json.load(f).get('feeds', [])
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"Failed to read feeds index: {e}")
+        return
+    loaded = RSSHandler.feed_files.warm([f"{name}.xml" for name in feed_names] + ['index.html', 'feeds_index.json'])
+    logger.info(f"Loaded {loaded} files from the previous run into the feed cache")
+
+def run_server(converter=None):
+    """Serve feeds; given a converter, also run its sync loop in this process, sharing state"""
     port = int(os.getenv('HTTP_PORT', '8888'))
     server_address = ('', port)
     
-    httpd = HTTPServer(server_address, RSSHandler)
+    data_dir = "/app/data" if os.path.exists("/app/data") else "./data"
+    try:
+        os.makedirs(data_dir, exist_ok=True)
+        store = converter.store if converter else ItemStore(os.path.join(data_dir, 'items.db'))
+        RSSHandler.dynamic_feeds = DynamicFeedCache(
+            store,
+            max_entries=int(os.getenv('DYNAMIC_FEED_CACHE_SIZE', '128')),
+            ttl=int(os.getenv('DYNAMIC_FEED_TTL', '60')))
+        RSSHandler.blob_cache = BlobCache(
+            os.path.join(data_dir, 'blobs'),
+            max_bytes=int(os.getenv('BLOB_CACHE_MAX_MB', '256')) * 1024 * 1024)
+    except Exception as e:
+        logger.error(f"Failed to open item store, dynamic feeds disabled: {e}")
+    
+    if os.getenv('WEBSUB_ENABLED', 'false').lower() == 'true':
+        base_url = os.getenv('BASE_URL', 'http://localhost:8888').rstrip('/')
+        RSSHandler.websub = WebSubHub(
+            data_dir, os.getenv('WEBSUB_HUB_URL', f"{base_url}/hub"),
+            publish_token=os.getenv('WEBSUB_PUBLISH_TOKEN', ''),
+            allow_private_callbacks=os.getenv('WEBSUB_ALLOW_PRIVATE_CALLBACKS', 'false').lower() == 'true')
+        logger.info(f"WebSub hub enabled at {RSSHandler.websub.hub_url}")
+    
+    workers = int(os.getenv('HTTP_WORKERS', '32'))
+    httpd = create_server(server_address, workers)
+    warm_feed_cache(data_dir)
+    if workers > 0:
+        logger.info(f"Serving with {workers} worker threads")
     logger.info(f"Starting HTTP server on port {port}")
     logger.info(f"RSS feed will be available at http://localhost:{port}/feed.xml")
     
+    if converter is not None:
+        # Feeds written by the converter go straight into the serving cache
+        converter.feed_published = RSSHandler.feed_files.publish
+        converter.local_hub = RSSHandler.websub
+        RSSHandler.blob_fetcher = converter
+        RSSHandler.merge_daemon_metrics = False
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        try:
+            # Signals for POST /refresh are only delivered to the main thread
+            converter.run_daemon()
+        except KeyboardInterrupt:
+            logger.info("Shutting down")
+            httpd.shutdown()
+        return
+    
+    # The converter's own reloads cover the settings shared with it when they run in one process
+    RSSHandler.env_watcher = EnvFileWatcher()
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+SQLite-backed store of processed emails and feed archive pages
+"""
+
+import re
+import html
+import json
+import sqlite3
+import threading
+import time
+import logging
+import functools
+import unicodedata
+from datetime import datetime, timezone
+from email.utils import parseaddr
+from typing import List, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    mailbox TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    date TEXT NOT NULL,
+    body TEXT NOT NULL,
+    added_at REAL NOT NULL,
+    date_ts REAL,
+    sender_addr TEXT,
+    uid INTEGER,
+    uidvalidity INTEGER,
+    attachments TEXT
+);
+CREATE TABLE IF NOT EXISTS parts (
+    item_id TEXT NOT NULL,
+    section TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    encoding TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    filename TEXT,
+    blob_hash TEXT,
+    PRIMARY KEY (item_id, section)
+);
+CREATE TABLE IF NOT EXISTS archives (
+    feed TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    first_seq INTEGER NOT NULL,
+    last_seq INTEGER NOT NULL,
+    item_count INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (feed, page)
+);
+CREATE TABLE IF NOT EXISTS mailbox_state (
+    mailbox TEXT PRIMARY KEY,
+    uidvalidity INTEGER NOT NULL,
+    uidnext INTEGER,
+    message_count INTEGER,
+    recent_uids TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+# Created after migrations, since older databases lack the indexed columns
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_items_date ON items (date_ts);
+CREATE INDEX IF NOT EXISTS idx_items_mailbox_date ON items (mailbox, date_ts);
+CREATE INDEX IF NOT EXISTS idx_items_sender_date ON items (sender_addr, date_ts);
+CREATE INDEX IF NOT EXISTS idx_items_mailbox_uid ON items (mailbox, uidvalidity, uid);
+"""
+
+# Full-text index over subject, sender and plain body text; rowid is items.seq
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    subject, sender, body, content='', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+# Relative 'since' values such as 30m, 24h, 7d or 2w
+RELATIVE_SINCE = re.compile(r'^(\d+)([mhdw])$')
+RELATIVE_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def sender_address(sender: str) -> str:
+    """Extract the lowercased email address from a From header"""
+    return parseaddr(sender)[1].lower()
+
+def html_to_text(html_content: str) -> str:
+    """Strip tags and entities from a sanitized body for indexing"""
+    text = re.sub(r'<[^>]+>', ' ', html_content)
+    text = html.unescape(text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def fts_tokens(text: str) -> List[str]:
+    """Split text into words the way the unicode61 tokenizer with remove_diacritics does"""
+    decomposed = unicodedata.normalize('NFD', text.lower())
+    return re.findall(r'[^\W_]+', ''.join(char for char in decomposed if not unicodedata.combining(char)))
+
+@functools.lru_cache(maxsize=1024)
+def item_tokens(subject: str, sender: str, body: str) -> frozenset:
+    """Words the search index holds for an item"""
+    return frozenset(fts_tokens(subject) + fts_tokens(sender) + fts_tokens(html_to_text(body)))
+
+class FeedQuery:
+    """Filter over stored items, normalized so equal queries share a cache key"""
+
+    PARAMS = ('mailbox', 'from', 'since', 'limit')
+    path = '/feed.xml'
+
+    def __init__(self, mailboxes: Optional[List[str]] = None, sender: Optional[str] = None,
+                 since: Optional[str] = None, limit: int = 50):
+        self.mailboxes = sorted(set(mailboxes)) if mailboxes else None
+        self.sender = sender.strip().lower() if sender else None
+        self.since = since.strip().lower() if since else None
+        self.limit = limit
+        # Validate early so bad queries are rejected before reaching the cache
+        self.since_ts()
+
+    @classmethod
+    def from_params(cls, params: Dict[str, List[str]], default_limit: int, max_limit: int) -> 'FeedQuery':
+        """Build a query from parsed URL parameters"""
+        unknown = set(params) - set(cls.PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        try:
+            limit = int(params.get('limit', [default_limit])[0])
+        except ValueError:
+            raise ValueError("limit must be a number")
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        return cls(mailboxes=params.get('mailbox'), sender=params.get('from', [None])[0],
+                   since=params.get('since', [None])[0], limit=min(limit, max_limit))
+
+    def key(self) -> tuple:
+        """Normalized cache key"""
+        return (tuple(self.mailboxes or ()), self.sender, self.since, self.limit)
+
+    @property
+    def is_relative(self) -> bool:
+        """Whether the time window moves with the clock"""
+        return bool(self.since and RELATIVE_SINCE.match(self.since))
+
+    def since_ts(self) -> Optional[float]:
+        """Resolve 'since' (relative, epoch seconds or ISO date) to a timestamp"""
+        if not self.since:
+            return None
+        match = RELATIVE_SINCE.match(self.since)
+        if match:
+            return time.time() - int(match.group(1)) * RELATIVE_UNITS[match.group(2)]
+        try:
+            return float(self.since)
+        except ValueError:
+            pass
+        try:
+            since_date = datetime.fromisoformat(self.since.upper())
+        except ValueError:
+            raise ValueError(f"Invalid since value: {self.since}")
+        if since_date.tzinfo is None:
+            since_date = since_date.replace(tzinfo=timezone.utc)
+        return since_date.timestamp()
+
+    def sender_clause(self) -> Tuple[str, str]:
+        """Exact (indexed) match for addresses, substring match otherwise"""
+        if '@' in self.sender:
+            return 'sender_addr = ?', self.sender
+        return 'sender LIKE ?', f"%{self.sender}%"
+
+    def matches(self, email_data: Dict[str, Any]) -> bool:
+        """Check whether an item belongs to this query's result set"""
+        if self.mailboxes and email_data['mailbox'] not in self.mailboxes:
+            return False
+        if self.sender:
+            if '@' in self.sender:
+                if sender_address(email_data['sender']) != self.sender:
+                    return False
+            elif self.sender not in email_data['sender'].lower():
+                return False
+        since_ts = self.since_ts()
+        if since_ts is not None and email_data['date'].timestamp() < since_ts:
+            return False
+        return True
+
+    def run(self, store: 'ItemStore') -> List[Dict[str, Any]]:
+        """Fetch the matching items from the store"""
+        return store.query_items(self)
+
+    def canonical_params(self) -> List[Tuple[str, str]]:
+        """URL parameters in normalized order, used for self links"""
+        params = [('mailbox', mailbox) for mailbox in self.mailboxes or ()]
+        if self.sender:
+            params.append(('from', self.sender))
+        if self.since:
+            params.append(('since', self.since))
+        params.append(('limit', str(self.limit)))
+        return params
+
+    def describe(self) -> str:
+        """Human readable summary for feed titles"""
+        parts = []
+        if self.mailboxes:
+            parts.append(', '.join(self.mailboxes))
+        if self.sender:
+            parts.append(f"from {self.sender}")
+        if self.since:
+            parts.append(f"since {self.since}")
+        return ' - '.join(parts) or 'all folders'
+
+class SearchQuery:
+    """Full-text search over stored items, with the same interface as FeedQuery"""
+
+    PARAMS = ('q', 'mailbox', 'limit')
+    path = '/search.xml'
+    is_relative = False
+
+    def __init__(self, text: str, mailboxes: Optional[List[str]] = None, limit: int = 50):
+        self.terms = [term.lower() for term in re.findall(r'\w+\*?', text)]
+        if not self.terms:
+            raise ValueError("Search query must contain at least one word")
+        self.mailboxes = sorted(set(mailboxes)) if mailboxes else None
+        self.limit = limit
+
+    @classmethod
+    def from_params(cls, params: Dict[str, List[str]], default_limit: int, max_limit: int) -> 'SearchQuery':
+        """Build a search from parsed URL parameters"""
+        unknown = set(params) - set(cls.PARAMS)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+        if 'q' not in params:
+            raise ValueError("Missing q parameter")
+        try:
+            limit = int(params.get('limit', [default_limit])[0])
+        except ValueError:
+            raise ValueError("limit must be a number")
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        return cls(' '.join(params['q']), mailboxes=params.get('mailbox'), limit=min(limit, max_limit))
+
+    def key(self) -> tuple:
+        """Normalized cache key"""
+        return ('search', tuple(self.terms), tuple(self.mailboxes or ()), self.limit)
+
+    def match_expression(self) -> str:
+        """FTS5 expression requiring every term; a trailing * keeps prefix matching"""
+        parts = []
+        for term in self.terms:
+            if term.endswith('*'):
+                parts.append(f'"{term[:-1]}"*')
+            else:
+                parts.append(f'"{term}"')
+        return ' AND '.join(parts)
+
+    def matches(self, email_data: Dict[str, Any]) -> bool:
+        """Check used for cache invalidation, tokenizing like the index; a phrase term only needs its words"""
+        if self.mailboxes and email_data['mailbox'] not in self.mailboxes:
+            return False
+        tokens = item_tokens(email_data['subject'], email_data['sender'], email_data['body'])
+        for term in self.terms:
+            words = fts_tokens(term)
+            if term.endswith('*') and words:
+                last = words.pop()
+                if not any(token.startswith(last) for token in tokens):
+                    return False
+            if not all(word in tokens for word in words):
+                return False
+        return True
+
+    def run(self, store: 'ItemStore') -> List[Dict[str, Any]]:
+        """Fetch the matching items from the store"""
+        return store.search_items(self)
+
+    def canonical_params(self) -> List[Tuple[str, str]]:
+        """URL parameters in normalized order, used for self links"""
+        params = [('q', ' '.join(self.terms))]
+        params.extend(('mailbox', mailbox) for mailbox in self.mailboxes or ())
+        params.append(('limit', str(self.limit)))
+        return params
+
+    def describe(self) -> str:
+        """Human readable summary for feed titles"""
+        description = f"search: {' '.join(self.terms)}"
+        if self.mailboxes:
+            description += f" in {', '.join(self.mailboxes)}"
+        return description
+
+class ItemStore:
+    """Persistent store of every email processed by the converter"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.migrate()
+        self.conn.executescript(INDEXES)
+        self.fts_enabled = self.create_fts_index()
+        self.conn.commit()
+
+    def create_fts_index(self) -> bool:
+        """Create the full-text index, backfilling it from existing items"""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'").fetchone()
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 not available, search disabled: {e}")
+            return False
+
+        if not exists:
+            rows = self.conn.execute('SELECT seq, subject, sender, body FROM items').fetchall()
+            if rows:
+                logger.info(f"Indexing {len(rows)} stored items for full-text search")
+                self.conn.executemany(
+                    'INSERT INTO items_fts (rowid, subject, sender, body) VALUES (?, ?, ?, ?)',
+                    [(row['seq'], row['subject'], row['sender'], html_to_text(row['body'])) for row in rows])
+        return True
+
+    def migrate(self):
+        """Add columns introduced after the first schema version"""
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(items)')}
+
+        if 'date_ts' not in columns:
+            logger.info("Adding date and sender index columns to item store")
+            self.conn.execute('ALTER TABLE items ADD COLUMN date_ts REAL')
+            self.conn.execute('ALTER TABLE items ADD COLUMN sender_addr TEXT')
+            rows = self.conn.execute('SELECT seq, date, sender FROM items').fetchall()
+            self.conn.executemany(
+                'UPDATE items SET date_ts = ?, sender_addr = ? WHERE seq = ?',
+                [(datetime.fromisoformat(row['date']).timestamp(), sender_address(row['sender']), row['seq'])
+                 for row in rows])
+
+        if 'uid' not in columns:
+            logger.info("Adding IMAP location columns to item store")
+            self.conn.execute('ALTER TABLE items ADD COLUMN uid INTEGER')
+            self.conn.execute('ALTER TABLE items ADD COLUMN uidvalidity INTEGER')
+            self.conn.execute('ALTER TABLE items ADD COLUMN attachments TEXT')
+
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            self.conn.close()
+
+    def add_items(self, emails: List[Dict[str, Any]]) -> List[str]:
+        """Insert emails not stored yet, oldest first, and return the new ids"""
+        new_ids = []
+        now = time.time()
+        with self.lock:
+            for email_data in sorted(emails, key=lambda x: x['date'].timestamp()):
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO items (id, mailbox, sender, subject, date, body, added_at, date_ts, '
+                    'sender_addr, uid, uidvalidity, attachments) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (email_data['id'], email_data['mailbox'], email_data['sender'],
+                     email_data['subject'], email_data['date'].isoformat(), email_data['body'], now,
+                     email_data['date'].timestamp(), sender_address(email_data['sender']),
+                     email_data.get('uid'), email_data.get('uidvalidity'),
+                     json.dumps(email_data.get('attachments', []))))
+                if cursor.rowcount:
+                    new_ids.append(email_data['id'])
+                    self.conn.executemany(
+                        'INSERT OR IGNORE INTO parts (item_id, section, content_type, encoding, size, filename) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        [(email_data['id'], part['section'], part['content_type'], part['encoding'],
+                          part['size'], part['filename']) for part in email_data.get('parts', [])])
+                    if self.fts_enabled:
+                        self.conn.execute(
+                            'INSERT INTO items_fts (rowid, subject, sender, body) VALUES (?, ?, ?, ?)',
+                            (cursor.lastrowid, email_data['subject'], email_data['sender'],
+                             html_to_text(email_data['body'])))
+                elif email_data.get('uid') is not None:
+                    # Already stored before UIDVALIDITY changed; track where it is now. Within one UIDVALIDITY the
+                    # first UID keeps the item, or two messages sharing an id would take it from each other every sync
+                    self.conn.execute(
+                        'UPDATE items SET uid = ?, uidvalidity = ? WHERE id = ? AND (uid IS NULL OR uidvalidity IS NOT ?)',
+                        (email_data['uid'], email_data['uidvalidity'], email_data['id'], email_data['uidvalidity']))
+            self.conn.commit()
+        return new_ids
+
+    def get_items_after(self, mailboxes: Optional[List[str]], after_seq: int, limit: int) -> List[Dict[str, Any]]:
+        """Get items stored after a sequence number, oldest first"""
+        query = 'SELECT * FROM items WHERE seq > ?'
+        params = [after_seq]
+        if mailboxes is not None:
+            query += f" AND mailbox IN ({', '.join('?' * len(mailboxes))})"
+            params.extend(mailboxes)
+        query += ' ORDER BY seq LIMIT ?'
+        params.append(limit)
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [self.row_to_email(row) for row in rows]
+
+    def query_items(self, query: FeedQuery) -> List[Dict[str, Any]]:
+        """Get the most recent items matching a query, newest first"""
+        clauses = []
+        params = []
+        if query.mailboxes:
+            clauses.append(f"mailbox IN ({', '.join('?' * len(query.mailboxes))})")
+            params.extend(query.mailboxes)
+        if query.sender:
+            clause, value = query.sender_clause()
+            clauses.append(clause)
+            params.append(value)
+        since_ts = query.since_ts()
+        if since_ts is not None:
+            clauses.append('date_ts >= ?')
+            params.append(since_ts)
+
+        sql = 'SELECT * FROM items'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY date_ts DESC LIMIT ?'
+        params.append(query.limit)
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self.row_to_email(row) for row in rows]
+
+    def search_items(self, query: SearchQuery) -> List[Dict[str, Any]]:
+        """Get the most recently stored items matching a full-text search"""
+        if not self.fts_enabled:
+            return []
+        sql = ('SELECT items.* FROM items_fts JOIN items ON items.seq = items_fts.rowid '
+               'WHERE items_fts MATCH ?')
+        params = [query.match_expression()]
+        if query.mailboxes:
+            sql += f" AND items.mailbox IN ({', '.join('?' * len(query.mailboxes))})"
+            params.extend(query.mailboxes)
+        # Newest first by rowid lets FTS5 stop early instead of sorting every match
+        sql += ' ORDER BY items_fts.rowid DESC LIMIT ?'
+        params.append(query.limit)
+
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self.row_to_email(row) for row in rows]
+
+    def max_seq(self) -> int:
+        """Sequence number of the most recently stored item"""
+        with self.lock:
+            row = self.conn.execute('SELECT MAX(seq) FROM items').fetchone()
+        return row[0] or 0
+
+    def get_part(self, item_id: str, section: str) -> Optional[Dict[str, Any]]:
+        """Get a stored MIME part together with the IMAP location of its message"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT parts.*, items.mailbox, items.uid, items.uidvalidity FROM parts '
+                'JOIN items ON items.id = parts.item_id WHERE parts.item_id = ? AND parts.section = ?',
+                (item_id, section)).fetchone()
+        return dict(row) if row else None
+
+    def set_part_blob(self, item_id: str, section: str, blob_hash: str, size: Optional[int] = None):
+        """Remember where the content of a part was cached, and correct its enclosure's estimated length"""
+        with self.lock:
+            self.conn.execute('UPDATE parts SET blob_hash = ? WHERE item_id = ? AND section = ?',
+                              (blob_hash, item_id, section))
+            if size is not None:
+                row = self.conn.execute('SELECT attachments FROM items WHERE id = ?', (item_id,)).fetchone()
+                attachments = json.loads(row['attachments']) if row and row['attachments'] else []
+                for attachment in attachments:
+                    if attachment['url'].endswith(f"/{item_id}/{section}"):
+                        attachment['length'] = size
+                self.conn.execute('UPDATE items SET attachments = ? WHERE id = ?', (json.dumps(attachments), item_id))
+            self.conn.commit()
+
+    def get_items_by_uid(self, mailbox: str, uidvalidity: int, uids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Get stored items of a mailbox by IMAP UID"""
+        items = {}
+        with self.lock:
+            # Chunked to stay below SQLite's limit on bound parameters
+            for start in range(0, len(uids), 500):
+                chunk = uids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT * FROM items WHERE mailbox = ? AND uidvalidity = ? AND uid IN ({', '.join('?' * len(chunk))})",
+                    [mailbox, uidvalidity] + chunk).fetchall()
+                for row in rows:
+                    items[row['uid']] = self.row_to_email(row)
+        return items
+
+    def id_held_by_other_uid(self, item_id: str, uidvalidity: int, uid: int) -> bool:
+        """Whether the item with this id is stored for a different UID of the same UIDVALIDITY"""
+        with self.lock:
+            row = self.conn.execute('SELECT uid, uidvalidity FROM items WHERE id = ?', (item_id,)).fetchone()
+        return bool(row) and row['uid'] is not None and row['uidvalidity'] == uidvalidity and row['uid'] != uid
+
+    def get_mailbox_state(self, mailbox: str) -> Optional[Dict[str, Any]]:
+        """Get what the last sync saw of a mailbox"""
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM mailbox_state WHERE mailbox = ?', (mailbox,)).fetchone()
+        if not row:
+            return None
+        state = dict(row)
+        state['recent_uids'] = json.loads(state['recent_uids'])
+        return state
+
+    def set_mailbox_state(self, mailbox: str, uidvalidity: int, uidnext: Optional[int],
+                          message_count: Optional[int], recent_uids: List[int]):
+        """Record the UIDs a sync found in a mailbox, so the next one only fetches new messages"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO mailbox_state (mailbox, uidvalidity, uidnext, message_count, recent_uids, '
+                'synced_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (mailbox, uidvalidity, uidnext, message_count, json.dumps(recent_uids), time.time()))
+            self.conn.commit()
+
+    def last_archive(self, feed: str) -> Optional[Dict[str, Any]]:
+        """Get the most recent archive page of a feed"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT * FROM archives WHERE feed = ? ORDER BY page DESC LIMIT 1', (feed,)).fetchone()
+        return dict(row) if row else None
+
+    def add_archive(self, feed: str, page: int, first_seq: int, last_seq: int, item_count: int):
+        """Record a newly written archive page"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO archives (feed, page, first_seq, last_seq, item_count, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (feed, page, first_seq, last_seq, item_count, time.time()))
+            self.conn.commit()
+
+    @staticmethod
+    def row_to_email(row: sqlite3.Row) -> Dict[str, Any]:
+        """Convert a database row to the email dict used by the feed generators"""
+        return {
+            'id': row['id'],
+            'seq': row['seq'],
+            'subject': row['subject'],
+            'sender': row['sender'],
+            'date': datetime.fromisoformat(row['date']),
+            'body': row['body'],
+            'mailbox': row['mailbox'],
+            'category': row['mailbox'],
+            'uid': row['uid'],
+            'uidvalidity': row['uidvalidity'],
+            'attachments': json.loads(row['attachments']) if row['attachments'] else []
+        }
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+RFC 5005 archive pages never repeat items the current feed still shows
+"""
+
+import glob
+import os
+import re
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app
+
+def make_emails(mailbox, start, count):
+    return [{'id': f"{mailbox}-{start:%Y%m%d}-{index}", 'mailbox': mailbox, 'sender': 'sender@example.com',
+             'subject': f"{mailbox} {index}", 'date': start + timedelta(hours=index), 'body': '<p>text</p>'}
+            for index in range(count)]
+
+def feed_guids(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return set(re.findall(r'<guid[^>]*>([^<]+)</guid>', f.read()))
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        previous_dir = os.getcwd()
+        os.chdir(directory.name)
+        self.addCleanup(os.chdir, previous_dir)
+        os.makedirs('data')
+        patcher = mock.patch.dict(os.environ, {'EMAIL_USER': 'user', 'EMAIL_PASS': 'pass', 'MAILBOXES': 'New,Old',
+                                               'MAX_EMAILS': '20', 'FEED_MODE': 'combined'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.converter = app.ImapToRss()
+        self.addCleanup(self.converter.store.close)
+
+    def sync(self, all_emails):
+        """Store and render like run_once does"""
+        for emails in all_emails.values():
+            self.converter.store.add_items(emails)
+        self.converter.generate_feeds(all_emails)
+
+    def archived_guids(self):
+        guids = set()
+        for path in glob.glob(os.path.join('data', 'archive', 'feed-*.xml')):
+            guids |= feed_guids(path)
+        return guids
+
+    def test_cold_sync_with_newer_mailbox_first_archives_nothing_shown(self):
+        new = make_emails('New', datetime(2026, 2, 1), 20)
+        old = make_emails('Old', datetime(2026, 1, 1), 20)
+        self.sync({'New': new, 'Old': old})
+
+        current = feed_guids(os.path.join('data', 'feed.xml'))
+        self.assertEqual(current, {email['id'] for email in new})
+        self.assertFalse(current & self.archived_guids())
+
+    def test_items_are_archived_once_they_leave_the_feed(self):
+        first = make_emails('New', datetime(2026, 2, 1), 20)
+        old = make_emails('Old', datetime(2026, 1, 1), 20)
+        self.sync({'New': first, 'Old': old})
+        newer = make_emails('New', datetime(2026, 3, 1), 20)
+        self.sync({'New': newer, 'Old': old})
+
+        current = feed_guids(os.path.join('data', 'feed.xml'))
+        archived = self.archived_guids()
+        self.assertEqual(current, {email['id'] for email in newer})
+        self.assertFalse(current & archived)
+        self.assertEqual(archived, {email['id'] for email in first + old})
+
+if __name__ == '__main__':
+    unittest.main()
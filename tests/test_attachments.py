@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Enclosure lengths: estimated from BODYSTRUCTURE, then exact once the part is downloaded
+"""
+
+import base64
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app
+
+def encoded_size(size):
+    """Size of a base64 MIME body as BODYSTRUCTURE reports it"""
+    return len(base64.encodebytes(b'\0' * size).replace(b'\n', b'\r\n'))
+
+class EnclosureLengthTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        previous_dir = os.getcwd()
+        os.chdir(directory.name)
+        self.addCleanup(os.chdir, previous_dir)
+        os.makedirs('data')
+        patcher = mock.patch.dict(os.environ, {'EMAIL_USER': 'user', 'EMAIL_PASS': 'pass'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.converter = app.ImapToRss()
+        self.addCleanup(self.converter.store.close)
+
+    def email_with_part(self, size, encoding):
+        email_data = {'id': 'a' * 32, 'mailbox': 'INBOX', 'sender': 'sender@example.com', 'subject': 'Report',
+                      'date': datetime(2026, 1, 1, tzinfo=timezone.utc), 'body': '<p>see attached</p>',
+                      'parts': [{'section': '2', 'content_type': 'application/pdf', 'encoding': encoding,
+                                 'size': size, 'filename': 'report.pdf', 'cid': None}]}
+        self.converter.link_attachments(email_data)
+        return email_data
+
+    def test_base64_estimate_does_not_count_line_breaks(self):
+        for size in (0, 57, 3000, 12345):
+            length = self.email_with_part(encoded_size(size), 'base64')['attachments'][0]['length']
+            self.assertGreaterEqual(length, size)
+            self.assertLessEqual(length, size + 2)
+        self.assertEqual(self.email_with_part(encoded_size(3000), 'base64')['attachments'][0]['length'], 3000)
+        self.assertEqual(self.email_with_part(1200, '7bit')['attachments'][0]['length'], 1200)
+
+    def test_downloaded_part_sets_the_exact_length(self):
+        email_data = self.email_with_part(encoded_size(3000), 'base64')
+        store = self.converter.store
+        store.add_items([email_data])
+        store.set_part_blob(email_data['id'], '2', 'f' * 64, 2998)
+
+        stored = store.get_items_after(None, 0, 1)[0]
+        self.assertEqual(stored['attachments'][0]['length'], 2998)
+        self.assertEqual(store.get_part(email_data['id'], '2')['blob_hash'], 'f' * 64)
+
+if __name__ == '__main__':
+    unittest.main()
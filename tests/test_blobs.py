@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Attachment downloads: one IMAP fetch per part, with different parts fetched in parallel
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server
+from blobs import BlobCache
+from store import ItemStore
+
+FETCH_SECONDS = 0.5
+
+class SlowFetcher:
+    """Stands in for the IMAP client, taking a while per download"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fetches = []
+
+    def fetch_part(self, mailbox, uidvalidity, uid, section, encoding):
+        with self.lock:
+            self.fetches.append((uid, section))
+        time.sleep(FETCH_SECONDS)
+        return f"part {uid}/{section}".encode('ascii')
+
+class BlobFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        previous_dir = os.getcwd()
+        os.chdir(directory.name)
+        self.addCleanup(os.chdir, previous_dir)
+        os.makedirs('data')
+        store = ItemStore(os.path.join('data', 'items.db'))
+        self.addCleanup(store.close)
+        self.item_ids = []
+        for uid in (1, 2):
+            item_id = f"{uid:032x}"
+            self.item_ids.append(item_id)
+            store.add_items([{'id': item_id, 'mailbox': 'INBOX', 'sender': 'sender@example.com', 'subject': 'Files',
+                              'date': datetime(2026, 1, uid, tzinfo=timezone.utc), 'body': '<p>files</p>', 'uid': uid,
+                              'uidvalidity': 7, 'parts': [{'section': '2', 'content_type': 'application/pdf',
+                                                           'encoding': 'base64', 'size': 100, 'filename': 'a.pdf'}]}])
+
+        self.httpd = server.create_server(('127.0.0.1', 0), workers=4)
+        self.fetcher = SlowFetcher()
+        for name, value in (('dynamic_feeds', server.DynamicFeedCache(store)),
+                            ('blob_cache', BlobCache(os.path.join('data', 'blobs'), 1024 * 1024)),
+                            ('blob_fetcher', self.fetcher)):
+            patcher = mock.patch.object(server.RSSHandler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+
+    def fetch_all(self, item_ids):
+        """Request the parts concurrently, returning the bodies and the elapsed time"""
+        bodies = [None] * len(item_ids)
+        def get(index, item_id):
+            url = f"http://127.0.0.1:{self.httpd.server_address[1]}/blob/{item_id}/2"
+            with urllib.request.urlopen(url, timeout=10) as response:
+                bodies[index] = response.read()
+        threads = [threading.Thread(target=get, args=item) for item in enumerate(item_ids)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return bodies, time.monotonic() - started
+
+    def test_different_parts_download_in_parallel(self):
+        bodies, elapsed = self.fetch_all(self.item_ids)
+        self.assertEqual(bodies, [b'part 1/2', b'part 2/2'])
+        self.assertLess(elapsed, FETCH_SECONDS * 1.8)
+        self.assertEqual(server.RSSHandler.blob_fetch_locks, {})
+
+    def test_same_part_is_downloaded_once(self):
+        bodies, _ = self.fetch_all([self.item_ids[0]] * 3)
+        self.assertEqual(bodies, [b'part 1/2'] * 3)
+        self.assertEqual(self.fetcher.fetches, [(1, '2')])
+        self.assertEqual(server.RSSHandler.blob_fetch_locks, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Keys removed from .env go back to the startup environment, whichever module loaded .env first
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Imports the server before the converter, as the attachment client does, then removes FEED_TITLE from .env
+RELOAD_SCRIPT = textwrap.dedent('''
+    import json, os, sys
+    sys.path.insert(0, sys.argv[1])
+    import server
+    import app
+    converter = app.ImapToRss()
+    before = converter.feed_title
+    with open('.env', 'w') as f:
+        f.write('EMAIL_USER=user\\nEMAIL_PASS=pass\\n')
+    changed = converter.reload_config()
+    print(json.dumps({'before': before, 'changed': changed, 'env': os.environ.get('FEED_TITLE'),
+                      'feed_title': converter.feed_title, 'shell': os.environ.get('FEED_DESCRIPTION')}))
+''')
+
+class EnvReloadTest(unittest.TestCase):
+
+    def run_reload(self, env):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, 'data'))
+            with open(os.path.join(directory, '.env'), 'w') as f:
+                f.write('EMAIL_USER=user\nEMAIL_PASS=pass\nFEED_TITLE=Custom Title\nFEED_DESCRIPTION=From env file\n')
+            result = subprocess.run([sys.executable, '-c', RELOAD_SCRIPT, ROOT], cwd=directory, env=env,
+                                    capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def clean_env(self):
+        return {key: value for key, value in os.environ.items() if key not in ('FEED_TITLE', 'FEED_DESCRIPTION')}
+
+    def test_removed_key_returns_to_default(self):
+        outcome = self.run_reload(self.clean_env())
+        self.assertEqual(outcome['before'], 'Custom Title')
+        self.assertTrue(outcome['changed'])
+        self.assertIsNone(outcome['env'])
+        self.assertNotEqual(outcome['feed_title'], 'Custom Title')
+
+    def test_removed_key_returns_to_startup_value(self):
+        env = self.clean_env()
+        env['FEED_DESCRIPTION'] = 'From the shell'
+        outcome = self.run_reload(env)
+        self.assertEqual(outcome['shell'], 'From the shell')
+
+if __name__ == '__main__':
+    unittest.main()
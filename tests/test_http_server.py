@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Clients trickling their headers are cut off at the deadline while other clients are served
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server
+
+def read_response(sock):
+    """Status line of one response read off a keep-alive connection, consuming its body"""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError("connection closed before the response")
+        data += chunk
+    head, body = data.split(b'\r\n\r\n', 1)
+    lines = head.decode('latin-1').split('\r\n')
+    length = next(int(line.split(':', 1)[1]) for line in lines if line.lower().startswith('content-length:'))
+    while len(body) < length:
+        body += sock.recv(4096)
+    return lines[0]
+
+class HeaderDeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        previous_dir = os.getcwd()
+        os.chdir(directory.name)
+        self.addCleanup(os.chdir, previous_dir)
+        os.makedirs('data')
+        patcher = mock.patch.object(server.RSSHandler, 'header_timeout', 1.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.httpd = server.create_server(('127.0.0.1', 0), workers=2)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        self.address = self.httpd.server_address
+
+    def test_slow_headers_are_cut_off_while_others_are_served(self):
+        slow = socket.create_connection(self.address, timeout=10)
+        self.addCleanup(slow.close)
+        slow.sendall(b'GET /health HTTP/1.1\r\nHost: localhost\r\n')
+        started = time.monotonic()
+        closed = threading.Event()
+
+        def trickle():
+            # One header byte at a time, well within the socket timeout, never finishing the headers
+            try:
+                while not closed.is_set():
+                    slow.sendall(b'X')
+                    time.sleep(0.2)
+            except OSError:
+                pass
+
+        threading.Thread(target=trickle, daemon=True).start()
+
+        # Another client keeps its connection and is served while the slow one is stuck
+        client = socket.create_connection(self.address, timeout=5)
+        self.addCleanup(client.close)
+        for _ in range(3):
+            client.sendall(b'GET /health HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            self.assertEqual(read_response(client), 'HTTP/1.1 200 OK')
+
+        try:
+            self.assertEqual(slow.recv(4096), b'')
+        except ConnectionResetError:
+            pass
+        closed.set()
+        elapsed = time.monotonic() - started
+        self.assertGreaterEqual(elapsed, 1.0)
+        self.assertLess(elapsed, 5.0)
+
+        # Both workers are free again; the idle keep-alive connection met the same deadline
+        for _ in range(2):
+            with socket.create_connection(self.address, timeout=5) as fresh:
+                fresh.sendall(b'GET /health HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+                self.assertEqual(read_response(fresh), 'HTTP/1.1 200 OK')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Query parsing and cache keys, and the dynamic feed cache
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import ItemStore, FeedQuery, SearchQuery
+import server
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def make_email(item_id, subject, body='<p>text</p>', mailbox='INBOX', sender='Ana <ana@example.com>', hours=0):
+    return {'id': item_id, 'mailbox': mailbox, 'sender': sender, 'subject': subject,
+            'date': START + timedelta(hours=hours), 'body': body}
+
+class QueryParsingTest(unittest.TestCase):
+
+    def test_equal_feed_queries_share_a_key(self):
+        first = FeedQuery.from_params({'mailbox': ['Work', 'INBOX', 'Work'], 'from': [' Ana@Example.com '],
+                                       'since': ['24H']}, 50, 200)
+        second = FeedQuery.from_params({'from': ['ana@example.com'], 'since': ['24h'], 'mailbox': ['INBOX', 'Work'],
+                                        'limit': ['50']}, 50, 200)
+        self.assertEqual(first.key(), second.key())
+        self.assertEqual(first.mailboxes, ['INBOX', 'Work'])
+        self.assertTrue(first.is_relative)
+
+    def test_feed_query_limits(self):
+        self.assertEqual(FeedQuery.from_params({'limit': ['5000']}, 50, 200).limit, 200)
+        self.assertEqual(FeedQuery.from_params({}, 50, 200).limit, 50)
+        for params in ({'limit': ['0']}, {'limit': ['many']}, {'since': ['yesterday']}, {'subject': ['x']}):
+            with self.assertRaises(ValueError, msg=params):
+                FeedQuery.from_params(params, 50, 200)
+
+    def test_feed_query_since_forms(self):
+        iso = FeedQuery(since='2026-01-01').since_ts()
+        self.assertEqual(iso, START.timestamp())
+        self.assertEqual(FeedQuery(since=str(START.timestamp())).since_ts(), iso)
+        self.assertFalse(FeedQuery(since='2026-01-01').is_relative)
+
+    def test_equal_searches_share_a_key(self):
+        first = SearchQuery.from_params({'q': ['Weekly  REPORT'], 'mailbox': ['Work', 'INBOX']}, 50, 200)
+        second = SearchQuery.from_params({'q': ['weekly report'], 'mailbox': ['INBOX', 'Work'], 'limit': ['50']}, 50, 200)
+        self.assertEqual(first.key(), second.key())
+        self.assertEqual(first.terms, ['weekly', 'report'])
+        self.assertNotEqual(first.key(), FeedQuery(mailboxes=['INBOX', 'Work']).key())
+
+    def test_search_query_errors(self):
+        for params in ({}, {'q': ['!!!']}, {'q': ['x'], 'since': ['1h']}, {'q': ['x'], 'limit': ['-1']}):
+            with self.assertRaises(ValueError, msg=params):
+                SearchQuery.from_params(params, 50, 200)
+
+    def test_prefix_terms(self):
+        query = SearchQuery('report* café')
+        self.assertEqual(query.terms, ['report*', 'café'])
+        self.assertEqual(query.match_expression(), '"report"* AND "café"')
+
+class DynamicFeedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ItemStore(os.path.join(directory.name, 'items.db'))
+        self.addCleanup(self.store.close)
+        self.store.add_items([make_email('inbox-1', 'First inbox item'),
+                              make_email('work-1', 'First work item', mailbox='Work', hours=1)])
+        patcher = mock.patch.dict(os.environ, {'FEED_TITLE': 'Feeds'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_new_items_invalidate_only_matching_feeds(self):
+        cache = server.DynamicFeedCache(self.store)
+        inbox, work = FeedQuery(mailboxes=['INBOX']), FeedQuery(mailboxes=['Work'])
+        inbox_entry, work_entry = cache.get(inbox), cache.get(work)
+        self.assertIs(cache.get(inbox), inbox_entry)
+
+        # The converter storing a newly synced item, as it does before regenerating the feed files
+        self.store.add_items([make_email('inbox-2', 'Second inbox item', hours=2)])
+        self.assertIs(cache.get(work), work_entry)
+        refreshed = cache.get(inbox)
+        self.assertIsNot(refreshed, inbox_entry)
+        self.assertIn(b'Second inbox item', refreshed['content'])
+
+    def test_new_items_invalidate_matching_searches(self):
+        cache = server.DynamicFeedCache(self.store)
+        search = SearchQuery('second')
+        self.assertNotIn(b'Second work item', cache.get(search)['content'])
+        self.store.add_items([make_email('work-2', 'Second work item', mailbox='Work', hours=2)])
+        if self.store.fts_enabled:
+            self.assertIn(b'Second work item', cache.get(search)['content'])
+
+    def test_least_recently_used_feed_is_evicted(self):
+        cache = server.DynamicFeedCache(self.store, max_entries=2)
+        first, second, third = FeedQuery(limit=1), FeedQuery(limit=2), FeedQuery(limit=3)
+        first_entry = cache.get(first)
+        cache.get(second)
+        self.assertIs(cache.get(first), first_entry)
+        cache.get(third)
+
+        self.assertEqual(list(cache.entries), [first.key(), third.key()])
+        self.assertIs(cache.get(first), first_entry)
+
+    def test_channel_settings_change_drops_rendered_feeds(self):
+        cache = server.DynamicFeedCache(self.store)
+        entry = cache.get(FeedQuery())
+        with mock.patch.dict(os.environ, {'FEED_TITLE': 'Renamed'}):
+            renamed = cache.get(FeedQuery())
+        self.assertIsNot(renamed, entry)
+        self.assertIn(b'Renamed', renamed['content'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Search matching used for cache invalidation agrees with the FTS5 index
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from store import ItemStore, SearchQuery
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def make_email(item_id, subject, body='<p>text</p>', mailbox='INBOX', sender='Ana <ana@example.com>', hours=0):
+    return {'id': item_id, 'mailbox': mailbox, 'sender': sender, 'subject': subject,
+            'date': START + timedelta(hours=hours), 'body': body}
+
+class SearchMatchingTest(unittest.TestCase):
+    """SearchQuery.matches decides cache invalidation, so it must agree with the index"""
+
+    EMAILS = [
+        make_email('cafe-accent', 'Café menu', '<p>Lunch specials</p>'),
+        make_email('cafe-plain', 'Cafe hours', '<p>Open late</p>', hours=1),
+        make_email('report', 'Weekly reporting', '<p>Numbers <b>inside</b></p>', mailbox='Work', hours=2),
+        make_email('html', 'Greeting', '<p>Ol&aacute; <b>mundo</b></p>', sender='Bob <bob@other.org>', hours=3),
+        make_email('tags', 'Markup', '<div class="report">no words here</div>', hours=4),
+    ]
+
+    QUERIES = ['cafe', 'café', 'CAFÉ menu', 'report*', 'report', 'reporting', 'mundo', 'ola', 'olá', 'ana',
+               'example', 'bob', 'inside numbers', 'class', 'lunch* special*', 'open late']
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ItemStore(os.path.join(directory.name, 'items.db'))
+        self.addCleanup(self.store.close)
+        if not self.store.fts_enabled:
+            self.skipTest("SQLite FTS5 not available")
+        self.store.add_items(self.EMAILS)
+        self.stored = self.store.get_items_after(None, 0, len(self.EMAILS))
+
+    def test_matches_agrees_with_the_index(self):
+        for text in self.QUERIES:
+            for mailboxes in (None, ['Work']):
+                query = SearchQuery(text, mailboxes=mailboxes)
+                indexed = {item['id'] for item in self.store.search_items(query)}
+                matched = {item['id'] for item in self.stored if query.matches(item)}
+                self.assertEqual(matched, indexed, f"{text!r} in {mailboxes}")
+
+    def test_diacritics_are_folded(self):
+        found = {item['id'] for item in self.store.search_items(SearchQuery('cafe'))}
+        self.assertEqual(found, {'cafe-accent', 'cafe-plain'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+WebSub hub behaviour against a local stand-in subscriber
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from websub import WebSubHub
+
+TOPIC = 'http://feeds.example/feed.xml'
+FEED = b'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title></channel></rss>'
+
+def make_subscriber(echo_challenge=True, push_status=200):
+    """Handler class answering verifications and pushes, recording what it received"""
+
+    class Subscriber(BaseHTTPRequestHandler):
+        verified = []
+        pushed = []
+
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            self.verified.append(params)
+            content = params.get('hub.challenge', [''])[0] if echo_challenge else 'not the challenge'
+            content = content.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+            self.pushed.append((dict(self.headers), body))
+            self.send_response(push_status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Subscriber
+
+class WebSubHubTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.data_dir = directory.name
+        with open(os.path.join(self.data_dir, 'feed.xml'), 'wb') as f:
+            f.write(FEED)
+
+    def start_subscriber(self, **behaviour):
+        handler = make_subscriber(**behaviour)
+        subscriber = HTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=subscriber.serve_forever, daemon=True).start()
+        self.addCleanup(subscriber.server_close)
+        self.addCleanup(subscriber.shutdown)
+        return handler, f"http://127.0.0.1:{subscriber.server_address[1]}/callback"
+
+    def hub(self, **options):
+        return WebSubHub(self.data_dir, 'http://feeds.example/hub', timeout=5, **options)
+
+    def saved_callbacks(self):
+        with open(os.path.join(self.data_dir, 'websub.json'), 'r', encoding='utf-8') as f:
+            return {callback for callbacks in json.load(f).values() for callback in callbacks}
+
+    def test_private_callbacks_are_refused(self):
+        handler, callback = self.start_subscriber()
+        hub = self.hub()
+        for private in (callback, 'http://10.0.0.5/callback', 'http://[::1]/callback', 'http://169.254.169.254/'):
+            status, _ = hub.handle({'hub.mode': ['subscribe'], 'hub.topic': [TOPIC], 'hub.callback': [private]}, '203.0.113.5')
+            self.assertEqual(status, 400, private)
+
+        # A host name is only resolved when verifying, and one resolving to loopback is never contacted
+        named = callback.replace('127.0.0.1', 'localhost')
+        hub.verify('subscribe', TOPIC, named, 3600, None)
+        self.assertEqual(handler.verified, [])
+        self.assertEqual(hub.subscriptions, {})
+
+    def test_challenge_is_verified(self):
+        handler, callback = self.start_subscriber()
+        hub = self.hub(allow_private_callbacks=True)
+        hub.verify('subscribe', TOPIC, callback, 3600, 'secret')
+
+        params = handler.verified[0]
+        self.assertEqual(params['hub.mode'], ['subscribe'])
+        self.assertEqual(params['hub.topic'], [TOPIC])
+        self.assertEqual(params['hub.lease_seconds'], ['3600'])
+        self.assertIn(callback, hub.subscriptions['/feed.xml'])
+        self.assertEqual(self.saved_callbacks(), {callback})
+
+    def test_wrong_challenge_is_not_subscribed(self):
+        handler, callback = self.start_subscriber(echo_challenge=False)
+        hub = self.hub(allow_private_callbacks=True)
+        hub.verify('subscribe', TOPIC, callback, 3600, None)
+
+        self.assertEqual(len(handler.verified), 1)
+        self.assertEqual(hub.subscriptions, {})
+
+    def test_gone_drops_the_subscription(self):
+        handler, callback = self.start_subscriber(push_status=410)
+        hub = self.hub(allow_private_callbacks=True)
+        hub.verify('subscribe', TOPIC, callback, 3600, None)
+        self.assertIn(callback, hub.subscriptions['/feed.xml'])
+
+        hub.distribute('/feed.xml')
+        self.assertEqual(len(handler.pushed), 1)
+        self.assertNotIn(callback, hub.subscriptions.get('/feed.xml', {}))
+        self.assertEqual(self.saved_callbacks(), set())
+
+    def test_pushed_content_is_signed(self):
+        handler, callback = self.start_subscriber()
+        hub = self.hub(allow_private_callbacks=True)
+        hub.verify('subscribe', TOPIC, callback, 3600, 'subscriber-secret')
+        hub.distribute('/feed.xml')
+
+        headers, body = handler.pushed[0]
+        self.assertEqual(body, FEED)
+        signature = hmac.new(b'subscriber-secret', FEED, hashlib.sha256).hexdigest()
+        self.assertEqual(headers['X-Hub-Signature'], f"sha256={signature}")
+        self.assertIn(f'<{TOPIC}>; rel="self"', headers['Link'])
+        # Still subscribed after a successful push
+        self.assertIn(callback, hub.subscriptions['/feed.xml'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Minimal WebSub hub: subscriber verification and content distribution for the feed files
+"""
+
+import os
+import json
+import hmac
+import hashlib
+import ipaddress
+import queue
+import secrets
+import socket
+import threading
+import time
+import logging
+import urllib.request
+import urllib.error
+from urllib.parse import urlparse, urlencode, parse_qsl, urlunparse, unquote
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 10 * 24 * 3600
+MAX_LEASE_SECONDS = 30 * 24 * 3600
+MIN_LEASE_SECONDS = 300
+
+# Threads confirming subscriber intent, and requests waiting for one before the hub answers 503
+VERIFY_WORKERS = 4
+VERIFY_QUEUE_SIZE = 64
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Treat redirects as failures, so a callback cannot send the hub on to an address it refuses"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+def normalize_topic(topic: str) -> str:
+    """Feed path a topic URL names, the same whether or not its characters are percent-encoded"""
+    return unquote(urlparse(topic).path)
+
+class WebSubHub:
+    """Keeps subscriptions in websub.json and pushes changed feeds to their callbacks"""
+
+    def __init__(self, data_dir: str, hub_url: str, timeout: int = 10, publish_token: str = '',
+                 allow_private_callbacks: bool = False):
+        self.data_dir = data_dir
+        self.hub_url = hub_url
+        self.timeout = timeout
+        self.publish_token = publish_token
+        self.allow_private_callbacks = allow_private_callbacks
+        self.opener = urllib.request.build_opener(NoRedirect)
+        self.path = os.path.join(data_dir, 'websub.json')
+        self.lock = threading.Lock()
+        self.subscriptions = self.load()  # topic path -> {callback: subscription}
+        self.pending = queue.Queue()
+        self.verifications = queue.Queue(maxsize=VERIFY_QUEUE_SIZE)
+        threading.Thread(target=self.distribute_loop, daemon=True).start()
+        for _ in range(VERIFY_WORKERS):
+            threading.Thread(target=self.verify_loop, daemon=True).start()
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Read saved subscriptions, dropping expired ones"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                subscriptions = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Failed to load WebSub subscriptions: {e}")
+            return {}
+        now = time.time()
+        return {topic: {callback: sub for callback, sub in callbacks.items() if sub['expires_at'] > now}
+                for topic, callbacks in subscriptions.items()}
+
+    def save(self):
+        """Persist subscriptions atomically; call with the lock held"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.subscriptions, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def feed_path(self, topic: str) -> Optional[str]:
+        """Map a topic URL to the feed file it names, if that feed exists"""
+        name = normalize_topic(topic).lstrip('/')
+        if not name.endswith('.xml') or '..' in name.split('/') or name.startswith('archive/'):
+            return None
+        file_path = os.path.join(self.data_dir, name)
+        return file_path if os.path.exists(file_path) else None
+
+    def callback_allowed(self, callback: str, resolve: bool = True) -> bool:
+        """Whether every address of a callback's host is public, unless private callbacks are allowed;
+        without resolve, host names pass and only literal addresses are checked"""
+        if self.allow_private_callbacks:
+            return True
+        host = urlparse(callback).hostname
+        if not host:
+            return False
+        try:
+            addresses = {ipaddress.ip_address(host)}
+        except ValueError:
+            if not resolve:
+                return True
+            try:
+                addresses = {ipaddress.ip_address(info[4][0].split('%', 1)[0])
+                             for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)}
+            except (OSError, UnicodeError):
+                return False
+        return bool(addresses) and all(ip.is_global and not ip.is_multicast for ip in addresses)
+
+    def publish_allowed(self, client_host: str, authorization: Optional[str]) -> bool:
+        """Publish pings need the shared token when one is set, and otherwise come from this machine"""
+        if self.publish_token:
+            return authorization is not None and hmac.compare_digest(authorization, f"Bearer {self.publish_token}")
+        try:
+            return ipaddress.ip_address(client_host).is_loopback
+        except ValueError:
+            return False
+
+    def handle(self, params: Dict[str, List[str]], client_host: str, authorization: Optional[str] = None) -> Tuple[int, str]:
+        """Process a hub request, returning an HTTP status and message"""
+        mode = params.get('hub.mode', [''])[0]
+        if mode == 'publish':
+            if not self.publish_allowed(client_host, authorization):
+                return 403, "Publishing is not allowed"
+            topics = params.get('hub.url', []) + params.get('hub.topic', [])
+            if not topics:
+                return 400, "hub.url is required"
+            for topic in topics:
+                self.publish(topic)
+            return 202, "Accepted"
+
+        if mode not in ('subscribe', 'unsubscribe'):
+            return 400, "Unsupported hub.mode"
+        topic = params.get('hub.topic', [''])[0]
+        callback = params.get('hub.callback', [''])[0]
+        if urlparse(callback).scheme not in ('http', 'https'):
+            return 400, "hub.callback must be an http(s) URL"
+        # Names are resolved by the verification workers, keeping lookups off the request threads
+        if not self.callback_allowed(callback, resolve=False):
+            return 400, "hub.callback must be a public address"
+        if mode == 'subscribe' and self.feed_path(topic) is None:
+            return 404, "Unknown hub.topic"
+        try:
+            lease = int(params.get('hub.lease_seconds', [DEFAULT_LEASE_SECONDS])[0])
+        except ValueError:
+            return 400, "Invalid hub.lease_seconds"
+        lease = max(MIN_LEASE_SECONDS, min(lease, MAX_LEASE_SECONDS))
+        secret = params.get('hub.secret', [None])[0]
+        if secret is not None and len(secret.encode('utf-8')) >= 200:
+            return 400, "hub.secret must be shorter than 200 bytes"
+
+        # Intent is verified asynchronously, as the spec allows
+        try:
+            self.verifications.put_nowait((mode, topic, callback, lease, secret))
+        except queue.Full:
+            return 503, "Too many pending verifications"
+        return 202, "Accepted"
+
+    def verify_loop(self):
+        """Confirm queued subscription requests one at a time"""
+        while True:
+            request = self.verifications.get()
+            try:
+                self.verify(*request)
+            except Exception as e:
+                logger.error(f"WebSub verification of {request[2]} failed: {e}")
+
+    def verify(self, mode: str, topic: str, callback: str, lease: int, secret: Optional[str]):
+        """Confirm the subscriber's intent and record the subscription"""
+        challenge = secrets.token_urlsafe(24)
+        query = {'hub.mode': mode, 'hub.topic': topic, 'hub.challenge': challenge}
+        if mode == 'subscribe':
+            query['hub.lease_seconds'] = lease
+        parts = urlparse(callback)
+        verify_url = urlunparse(parts._replace(query=urlencode(parse_qsl(parts.query) + list(query.items()))))
+        if not self.callback_allowed(callback):
+            logger.warning(f"WebSub {mode} for {topic} refused: {callback} is not a public address")
+            return
+        try:
+            with self.opener.open(verify_url, timeout=self.timeout) as response:
+                confirmed = 200 <= response.status < 300 and response.read(1024).decode('utf-8', 'replace').strip() == challenge
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning(f"WebSub verification of {callback} failed: {e}")
+            return
+        if not confirmed:
+            logger.warning(f"WebSub {mode} for {topic} not confirmed by {callback}")
+            return
+
+        topic_path = normalize_topic(topic)
+        with self.lock:
+            callbacks = self.subscriptions.setdefault(topic_path, {})
+            if mode == 'subscribe':
+                callbacks[callback] = {'topic': topic, 'secret': secret, 'expires_at': time.time() + lease}
+            else:
+                callbacks.pop(callback, None)
+                if not callbacks:
+                    del self.subscriptions[topic_path]
+            self.save()
+        logger.info(f"WebSub {mode} confirmed: {callback} -> {topic}")
+
+    def publish(self, topic: str):
+        """Queue a topic for distribution to its subscribers"""
+        self.pending.put(normalize_topic(topic))
+
+    def distribute_loop(self):
+        """Deliver published topics one at a time, coalescing repeated notifications"""
+        while True:
+            topics = {self.pending.get()}
+            while not self.pending.empty():
+                topics.add(self.pending.get_nowait())
+            for topic_path in topics:
+                try:
+                    self.distribute(topic_path)
+                except Exception as e:
+                    logger.error(f"WebSub distribution of {topic_path} failed: {e}")
+
+    def distribute(self, topic_path: str):
+        """POST the current feed content to every active subscriber of a topic"""
+        now = time.time()
+        with self.lock:
+            callbacks = self.subscriptions.get(topic_path, {})
+            expired = [callback for callback, sub in callbacks.items() if sub['expires_at'] <= now]
+            for callback in expired:
+                del callbacks[callback]
+            if expired:
+                self.save()
+            targets = list(callbacks.items())
+        if not targets:
+            return
+
+        file_path = self.feed_path(topic_path)
+        if file_path is None:
+            return
+        with open(file_path, 'rb') as f:
+            content = f.read()
+
+        delivered = 0
+        for callback, sub in targets:
+            headers = {
+                'Content-Type': 'application/rss+xml; charset=utf-8',
+                'Link': f'<{self.hub_url}>; rel="hub", <{sub["topic"]}>; rel="self"'
+            }
+            if sub.get('secret'):
+                signature = hmac.new(sub['secret'].encode('utf-8'), content, hashlib.sha256).hexdigest()
+                headers['X-Hub-Signature'] = f"sha256={signature}"
+            if not self.callback_allowed(callback):
+                logger.warning(f"WebSub delivery to {callback} skipped: not a public address")
+                continue
+            request = urllib.request.Request(callback, data=content, headers=headers, method='POST')
+            try:
+                with self.opener.open(request, timeout=self.timeout):
+                    delivered += 1
+            except urllib.error.HTTPError as e:
+                # 410 Gone means the subscriber no longer wants this topic
+                if e.code == 410:
+                    with self.lock:
+                        self.subscriptions.get(topic_path, {}).pop(callback, None)
+                        self.save()
+                logger.warning(f"WebSub delivery to {callback} failed: HTTP {e.code}")
+            except (urllib.error.URLError, OSError) as e:
+                logger.warning(f"WebSub delivery to {callback} failed: {e}")
+        logger.info(f"WebSub pushed {topic_path} to {delivered}/{len(targets)} subscribers")